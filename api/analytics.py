@@ -0,0 +1,398 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from api.latency import ReplyLatency
+from api.messages import local_days
+from api.sessions import SESSION_GAP_SECONDS, SessionStats, build_sessions, split_sessions
+from api.sketch import SpaceSaving
+
+# 凌晨4点之前都算前一天
+LATE_HOUR = 4
+DAY_SECONDS = 24 * 3600
+# 第一句话之后这么多秒内同一个人发的消息算在第一句话里
+START_MESSAGE_SECONDS = 600
+# 保存的统计结果的格式，统计的内容变了之后加一，之前保存的结果会重新统计
+SUMMARY_VERSION = 3
+# 保存和传递时原样保留的字段
+SUMMARY_FIELDS = [
+    "start_time",
+    "start_from_my",
+    "start_content",
+    "resp_content",
+    "resp_interval",
+    "late_time",
+    "late_interval",
+    "late_is_sender",
+    "late_content",
+    "last_time",
+    "last_is_sender",
+    "my_count",
+    "user_count",
+    "my_words",
+    "user_words",
+    "cursor",
+    "busiest_day_topics",
+]
+
+
+def daily_frame(days, my, user, tz=None) -> pd.DataFrame:
+    # days 是每天0点的秒级时间戳
+    index = pd.to_datetime(days, unit="s", utc=True)
+    return pd.DataFrame(
+        {"my": my, "user": user},
+        index=index.tz_convert(tz) if tz is not None else index,
+        dtype=np.int64,
+    )
+
+
+def hourly_frame(my, user) -> pd.DataFrame:
+    return pd.DataFrame(
+        {"my": my, "user": user}, index=pd.RangeIndex(24, name="hour"), dtype=np.int64
+    )
+
+
+@dataclass()
+class ChatSummary:
+    """
+    一次对话的统计结果，全部由整列数据计算，不逐条遍历消息。
+    可以和之后新消息的统计结果合并，cursor 是已经统计到的位置
+    """
+
+    # 第一句话和对方的回复，时间都是秒级时间戳
+    start_time: int
+    start_from_my: bool
+    start_content: str
+    resp_content: str | None
+    resp_interval: int | None
+    # 离凌晨4点最近的消息，和相差的秒数
+    late_time: int
+    late_interval: int
+    late_is_sender: bool
+    late_content: str
+    last_time: int
+    last_is_sender: bool
+    # 按天统计，index 是当天0点，列是 my / user
+    daily: pd.DataFrame
+    # 按小时统计，index 是 0-23，列是 my / user
+    hourly: pd.DataFrame
+    # 分词后每个词的出现次数，词按第一次出现的顺序排列
+    vocab: list[str] = field(default_factory=list)
+    token_counts: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int64))
+    # 设置了 topic_capacity 时用固定大小的 SpaceSaving 代替上面的精确计数，已经去掉停用词
+    sketch: SpaceSaving | None = field(default=None)
+    my_count: int = field(default=0)
+    user_count: int = field(default=0)
+    my_words: int = field(default=0)
+    user_words: int = field(default=0)
+    # 双方回复时间的分布
+    latency: ReplyLatency = field(default_factory=ReplyLatency)
+    # 按间隔切分的每次聊天的汇总
+    sessions: SessionStats | None = field(default=None)
+    # 统计到的最后一条消息 (CreateTime, db_index, localId)
+    cursor: tuple[int, int, int] | None = field(default=None)
+    # 聊天最多的一天的话题，按 (当天0点, 当天消息数) 缓存
+    busiest_day_topics: tuple[int, int, list[str]] | None = field(default=None)
+
+    @property
+    def count(self):
+        return self.my_count + self.user_count
+
+    @property
+    def words(self):
+        return self.my_words + self.user_words
+
+    def busiest_day(self):
+        # (当天0点, 消息数)，次数相同时取最早的一天
+        total = self.daily["my"] + self.daily["user"]
+        return total.idxmax(), int(total.max())
+
+    def top_words(self, top_n=10, min_count=3, stop_filter=None) -> list[str]:
+        # 次数相同时先出现的在前，和 TokenIndex.top 一致
+        from api.stop_words import get_stop_word_filter
+
+        if self.sketch is not None:
+            return self.sketch.top(top_n, min_count)
+
+        counts = self.token_counts.copy()
+        counts[(stop_filter or get_stop_word_filter()).mask(self.vocab)] = 0
+        order = np.argsort(-counts, kind="stable")[:top_n]
+        return [self.vocab[i] for i in order if counts[i] >= min_count]
+
+    def merge(self, other: "ChatSummary") -> "ChatSummary":
+        # other 是 cursor 之后的新消息的统计结果
+        sketch = None
+        if self.sketch is not None and other.sketch is not None:
+            sketch = self.sketch.merge(other.sketch)
+        word_ids = {word: i for i, word in enumerate(self.vocab)}
+        for word in other.vocab:
+            word_ids.setdefault(word, len(word_ids))
+        token_counts = np.zeros(len(word_ids), dtype=np.int64)
+        token_counts[: len(self.vocab)] = self.token_counts
+        np.add.at(
+            token_counts,
+            np.fromiter((word_ids[w] for w in other.vocab), np.int64, len(other.vocab)),
+            other.token_counts,
+        )
+        # self 的第一句话还没有回复时，other 是接着 self 统计的第一句话和回复
+        start = other if self.resp_content is None else self
+        late = other if other.late_interval < self.late_interval else self
+        return ChatSummary(
+            start_time=start.start_time,
+            start_from_my=start.start_from_my,
+            start_content=start.start_content,
+            resp_content=start.resp_content,
+            resp_interval=start.resp_interval,
+            late_time=late.late_time,
+            late_interval=late.late_interval,
+            late_is_sender=late.late_is_sender,
+            late_content=late.late_content,
+            last_time=other.last_time,
+            last_is_sender=other.last_is_sender,
+            daily=self.daily.add(other.daily, fill_value=0).astype(np.int64),
+            hourly=self.hourly + other.hourly,
+            vocab=list(word_ids),
+            token_counts=token_counts,
+            sketch=sketch,
+            my_count=self.my_count + other.my_count,
+            user_count=self.user_count + other.user_count,
+            my_words=self.my_words + other.my_words,
+            user_words=self.user_words + other.user_words,
+            latency=self.latency.merge(other.latency),
+            sessions=self.sessions.merge(other.sessions),
+            cursor=other.cursor or self.cursor,
+            busiest_day_topics=self.busiest_day_topics,
+        )
+
+    def to_dict(self) -> dict:
+        # 保存成 json，天按0点的时间戳保存
+        return {
+            **{name: getattr(self, name) for name in SUMMARY_FIELDS},
+            "vocab": self.vocab,
+            "daily": [
+                (self.daily.index.asi8 // 10**9).tolist(),
+                self.daily["my"].tolist(),
+                self.daily["user"].tolist(),
+            ],
+            "hourly": [self.hourly["my"].tolist(), self.hourly["user"].tolist()],
+            "token_counts": self.token_counts.tolist(),
+            "sketch": self.sketch.to_dict() if self.sketch is not None else None,
+            "latency": self.latency.to_dict(),
+            "sessions": self.sessions.to_dict(),
+        }
+
+    @staticmethod
+    def from_dict(data: dict, tz=None):
+        return ChatSummary.from_parts(
+            data,
+            daily=daily_frame(*data["daily"], tz=tz),
+            hourly=hourly_frame(*data["hourly"]),
+            vocab=data["vocab"],
+            token_counts=np.asarray(data["token_counts"], dtype=np.int64),
+            latency=ReplyLatency.from_dict(data["latency"]),
+        )
+
+    def to_arrays(self) -> tuple[dict, dict[str, np.ndarray]]:
+        """
+        交给其他进程的格式，不转换成 list：按天/小时的统计、词频、词表和回复时间的直方图放在 arrays 里，
+        由调用方放进共享内存，其余的字段很小，放在 meta 里。词表按 utf-8 拼接，offsets 是每个词的结束位置
+        """
+        words = [word.encode() for word in self.vocab]
+        meta = {
+            **{name: getattr(self, name) for name in SUMMARY_FIELDS},
+            "sketch": self.sketch.to_dict() if self.sketch is not None else None,
+            "sessions": self.sessions.to_dict(),
+        }
+        arrays = {
+            "days": self.daily.index.asi8 // 10**9,
+            "daily": self.daily[["my", "user"]].to_numpy(dtype=np.int64),
+            "hourly": self.hourly[["my", "user"]].to_numpy(dtype=np.int64),
+            "token_counts": self.token_counts,
+            "vocab": np.frombuffer(b"".join(words), dtype=np.uint8),
+            "vocab_offsets": np.cumsum([len(word) for word in words], dtype=np.int64),
+            "latency_months": self.latency.months,
+            "latency_monthly": self.latency.monthly,
+            "latency_hourly": self.latency.hourly,
+        }
+        return meta, arrays
+
+    @staticmethod
+    def from_arrays(meta: dict, arrays: dict[str, np.ndarray], tz=None):
+        vocab = arrays["vocab"].tobytes()
+        ends = arrays["vocab_offsets"].tolist()
+        return ChatSummary.from_parts(
+            meta,
+            daily=daily_frame(arrays["days"], *arrays["daily"].T, tz=tz),
+            hourly=hourly_frame(*arrays["hourly"].T),
+            vocab=[
+                vocab[start:end].decode() for start, end in zip([0, *ends[:-1]], ends)
+            ],
+            token_counts=arrays["token_counts"],
+            latency=ReplyLatency(
+                arrays["latency_months"],
+                arrays["latency_monthly"],
+                arrays["latency_hourly"],
+            ),
+        )
+
+    @staticmethod
+    def from_parts(data: dict, **parts):
+        # data 中是 SUMMARY_FIELDS 和 sketch / sessions，parts 是已经转换好的其余字段
+        cursor = data.get("cursor")
+        sketch = data.get("sketch")
+        busiest = data.get("busiest_day_topics")
+        return ChatSummary(
+            **{
+                **{name: data[name] for name in SUMMARY_FIELDS},
+                **parts,
+                "sketch": SpaceSaving.from_dict(sketch) if sketch else None,
+                "sessions": SessionStats.from_dict(data["sessions"]),
+                "cursor": tuple(cursor) if cursor else None,
+                "busiest_day_topics": tuple(busiest) if busiest else None,
+            }
+        )
+
+
+def find_start_message(
+    create_time: np.ndarray,
+    is_sender: np.ndarray,
+    seconds=START_MESSAGE_SECONDS,
+    start: tuple[int, bool] | None = None,
+):
+    """
+    第一句话：开头连续同一个人发的、600秒以内的消息，之后对方的第一条是回复。
+    start 是之前的消息中还没有回复的第一句话 (时间, 是否我发的)，这些消息接在它后面
+    """
+    start_time, start_sender = start if start is not None else (create_time[0], is_sender[0])
+    changed = np.flatnonzero(is_sender != start_sender)
+    resp_index = int(changed[0]) if len(changed) else None
+    start_indices = np.flatnonzero(create_time[:resp_index] - start_time < seconds)
+    return start_indices, resp_index
+
+
+def seconds_to_late_hour(datetime: pd.DatetimeIndex) -> np.ndarray:
+    # 和凌晨4点差多少秒，4点整算作差一整天
+    seconds = (
+        datetime.hour.to_numpy() * 3600
+        + datetime.minute.to_numpy() * 60
+        + datetime.second.to_numpy()
+    ).astype(np.int64)
+    return np.where(
+        seconds < LATE_HOUR * 3600,
+        LATE_HOUR * 3600 - seconds,
+        DAY_SECONDS - seconds + LATE_HOUR * 3600,
+    )
+
+
+def count_by_sender(keys: np.ndarray, is_sender: np.ndarray, size: int):
+    # keys 是 0 到 size-1 的编号，分别统计我和对方的消息数，返回 (my, user)
+    my = np.bincount(keys[is_sender], minlength=size)
+    user = np.bincount(keys[~is_sender], minlength=size)
+    return my, user
+
+
+def daily_counts(datetime: pd.DatetimeIndex, is_sender: np.ndarray) -> pd.DataFrame:
+    # 只保留有消息的天
+    days = local_days(datetime)
+    unique_days, first, keys = np.unique(
+        days.asi8, return_index=True, return_inverse=True
+    )
+    my, user = count_by_sender(keys, is_sender, len(unique_days))
+    return pd.DataFrame({"my": my, "user": user}, index=days[first])
+
+
+def hourly_counts(datetime: pd.DatetimeIndex, is_sender: np.ndarray) -> pd.DataFrame:
+    my, user = count_by_sender(datetime.hour.to_numpy(), is_sender, 24)
+    return pd.DataFrame({"my": my, "user": user}, index=pd.RangeIndex(24, name="hour"))
+
+
+def summarize_chat(
+    df: pd.DataFrame,
+    token_index=None,
+    topic_capacity: int | None = None,
+    previous: ChatSummary | None = None,
+    session_gap=SESSION_GAP_SECONDS,
+    check=None,
+) -> ChatSummary | None:
+    """
+    由 MessageBatch.to_analysis_frame() 得到的 DataFrame 计算统计结果，没有消息时返回 None，
+    token_index 是同样这些消息的 TokenIndex，topic_capacity 是 SpaceSaving 最多保存的词数，
+    previous 是之前消息的统计结果，用它的最后一条消息计算第一条新消息的回复时间，
+    它的第一句话还没有回复时，这些消息接着统计第一句话和回复，
+    相隔超过 session_gap 秒的消息算作两次聊天，
+    check() 在各项统计之间调用，可以抛出异常中止统计
+    """
+    check = check or (lambda: None)
+    if len(df) == 0:
+        return None
+    datetime: pd.DatetimeIndex = df.index
+    is_sender = df["is_sender"].to_numpy(dtype=bool)
+    create_time = datetime.asi8 // 10**9
+    content = df["content"]
+    words = content.str.len().to_numpy(dtype=np.int64, na_value=0)
+
+    start = None
+    start_content = []
+    if previous is not None and previous.resp_content is None:
+        start = (previous.start_time, previous.start_from_my)
+        start_content = [previous.start_content]
+    start_indices, resp_index = find_start_message(
+        create_time, is_sender, start=start
+    )
+    start_time, start_from_my = start or (int(create_time[0]), bool(is_sender[0]))
+    late = seconds_to_late_hour(datetime)
+    late_index = int(np.argmin(late))
+    my_count = int(is_sender.sum())
+    vocab = []
+    token_counts = np.zeros(0, np.int64)
+    sketch = None
+    if token_index is not None:
+        if topic_capacity is None:
+            vocab = list(token_index.vocab)
+            token_counts = token_index.counts().astype(np.int64)
+        else:
+            # 分词时每块已经统计了 SpaceSaving 并合并，不再生成整个词表的计数
+            sketch = token_index.sketch
+            if sketch is None or sketch.capacity != topic_capacity:
+                sketch = token_index.build_sketch(topic_capacity)
+    check()
+    daily = daily_counts(datetime, is_sender)
+    hourly = hourly_counts(datetime, is_sender)
+    check()
+    latency = ReplyLatency.build(
+        datetime,
+        is_sender,
+        (previous.last_time, previous.last_is_sender) if previous else None,
+    )
+    check()
+    sessions = SessionStats.build(
+        build_sessions(df, split_sessions(create_time, session_gap), words, token_index),
+        session_gap,
+    )
+    return ChatSummary(
+        start_time=start_time,
+        start_from_my=start_from_my,
+        start_content=" ".join([*start_content, *content.iloc[start_indices]]),
+        resp_content=None if resp_index is None else content.iloc[resp_index],
+        resp_interval=None
+        if resp_index is None
+        else int(create_time[resp_index] - start_time),
+        late_time=int(create_time[late_index]),
+        late_interval=int(late[late_index]),
+        late_is_sender=bool(is_sender[late_index]),
+        late_content=content.iloc[late_index],
+        last_time=int(create_time[-1]),
+        last_is_sender=bool(is_sender[-1]),
+        daily=daily,
+        hourly=hourly,
+        vocab=vocab,
+        token_counts=token_counts,
+        sketch=sketch,
+        my_count=my_count,
+        user_count=len(df) - my_count,
+        my_words=int(words[is_sender].sum()),
+        user_words=int(words[~is_sender].sum()),
+        latency=latency,
+        sessions=sessions,
+    )
@@ -0,0 +1,1036 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import datetime as dt
+import hashlib
+import json
+import logging
+import traceback
+from asyncio import Task
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, List
+
+from api.progress import AnalysisCancelled, AnalysisProgress, ProgressReporter
+from api.query import ANALYSIS_FILTER, MessageFilter
+from api.wechat import MessageCursor, MessageData, WeChatAPI
+from ui.utils import get_time_interval, ai_url
+
+if TYPE_CHECKING:
+    from api.analytics import ChatSummary
+    from api.messages import MessageBatch
+    from api.tokens import TokenIndex
+
+# pandas / jieba / flet / matplotlib 在用到时才导入，没有界面时（命令行、批量分析）不加载 flet
+
+# 分析时每次读取的消息数
+READ_BATCH_SIZE = 2000
+# 每读取这么多条消息就分词、统计一次，再和之前的统计结果合并，内存占用和聊天记录的长度无关
+ANALYSIS_CHUNK_ROWS = 100_000
+
+
+class Analyzer:
+    def __init__(
+        self,
+        wechat_api: WeChatAPI,
+        message_filter: MessageFilter = ANALYSIS_FILTER,
+        topic_capacity: int | None = None,
+        session_gap: int | None = None,
+        topic_epsilon: float | None = None,
+        topic_max_bytes: int | None = None,
+    ):
+        from api.sketch import get_capacity
+
+        self.wechat_api: WeChatAPI = wechat_api
+        # 参与分析的消息
+        self.message_filter = message_filter
+        # 话题统计最多保存的词数，由词数、误差上限 topic_epsilon、内存上限 topic_max_bytes 中最小的决定，
+        # 都是 None 时精确统计全部的词，聊天记录很长时可以限制内存
+        self.topic_capacity = get_capacity(topic_capacity, topic_epsilon, topic_max_bytes)
+        # 相隔超过多少秒的消息算作两次聊天，None 时是 SESSION_GAP_SECONDS
+        self.session_gap = session_gap
+        self.analysis_task: Task | None = None
+        self.end_callback = None
+        # 分析线程的进度和取消
+        self.progress: ProgressReporter | None = None
+        # ft.colors.BLUE，不在这里导入 flet
+        self.theme_color = "blue"
+
+        self.my_info: UserInfo | None = None
+        self.user_info: UserInfo | None = None
+        self.start_message_info: StartMessageInfo | None = None
+        self.count_rank_info: CountRankInfo | None = None
+
+        self.most_late_message: MostLateMessageInfo | None = None
+        self.summary: ChatSummary | None = None
+        # 词云图片
+        self.cloud_path: Path | None = None
+
+    def start_analysis(
+        self, user_id: str, end_callback, error_callback, progress_callback=None
+    ):
+        # progress_callback(AnalysisProgress) 是协程，在界面的事件循环中执行
+        loop = asyncio.get_running_loop()
+
+        def report(progress: AnalysisProgress):
+            if progress_callback:
+                asyncio.run_coroutine_threadsafe(progress_callback(progress), loop)
+
+        self.end_callback = end_callback
+        self.progress = ProgressReporter(report)
+        self.analysis_task = asyncio.create_task(
+            self.generate_analysis_task(user_id, end_callback, error_callback=error_callback)
+        )
+
+    async def get_ai_result(self, user_id, username, password):
+        if not username or not password:
+            return None
+        import flet as ft
+        import httpx
+
+        try:
+            message_string = "\n".join(
+                content
+                for batch in self.iter_chat_messages(user_id)
+                for content in batch.contents()
+            )
+            url = ai_url
+            res = ""
+            async with httpx.AsyncClient().stream(
+                method="POST",
+                url=url,
+                json={
+                    "username": username,
+                    "password": password,
+                    "content": message_string,
+                },
+                timeout=300,
+            ) as response:
+                async for chunk in response.aiter_lines():
+                    if chunk.startswith("data:"):
+                        data = json.loads(chunk[5:])
+                        if "result" in data and data["result"]:
+                            res += data["result"]
+                    else:
+                        return self.build_container(ft.Text(chunk, selectable=True))
+            return self.build_container(ft.Text(res, selectable=True))
+        except Exception as e:
+            logging.warning(f"{e} {traceback.format_exc()}")
+            return self.build_container(ft.Text(str(e), selectable=True))
+
+    def iter_chat_messages(
+        self, user_id, after: MessageCursor | None = None
+    ) -> Iterator[MessageBatch]:
+        # 分批读取，无用的信息在查询时就过滤掉，每批之后检查是否取消，所以每批不要太大
+        yield from self.wechat_api.iter_chat_messages(
+            user_id, batch_size=READ_BATCH_SIZE, message_filter=self.message_filter, after=after
+        )
+
+    async def generate_analysis_task(self, user_id: str, end_callback, error_callback):
+        # 读取、分词、统计和生成图表都在线程中执行，不阻塞界面的事件循环
+        try:
+            views = await asyncio.to_thread(self.run_analysis, user_id, self.progress)
+            await end_callback(views)
+        except AnalysisCancelled:
+            logging.info(f"analysis {user_id} cancelled")
+        except Exception as e:
+            logging.error(f"generate_analysis_task error {e} {traceback.format_exc()}")
+            await end_callback()
+            await error_callback(f"{e} {traceback.format_exc()}")
+
+    def run_analysis(self, user_id: str, progress: ProgressReporter | None = None):
+        """
+        在分析线程中执行，返回界面上的控件，控件的更新在事件循环中进行。
+        有分析进程时，这里只同步消息和生成控件，读取、分词、统计和画词云都在分析进程中执行
+        """
+        progress = progress or ProgressReporter()
+        worker = self.wechat_api.get_analysis_worker()
+        if worker is None:
+            self.analyze(user_id, progress)
+            self.render_images(progress)
+        else:
+            self.prepare(user_id, progress)
+            self.load_result(*worker.analyze(user_id, self.get_options(), progress))
+        return self.build_view()
+
+    def wait_warmup(self, stage: str, progress: ProgressReporter):
+        # 等待预热的同时检查是否取消
+        while not self.wechat_api.warmup.wait(stage, progress.interval):
+            progress.check()
+
+    def analyze(self, user_id: str, progress: ProgressReporter | None = None):
+        """
+        读取并统计，不生成界面，批量分析也用这个。
+        progress 报告各阶段的进度，每批消息、每块分词之后检查是否取消，取消时抛出 AnalysisCancelled
+        """
+        progress = progress or ProgressReporter()
+        self.prepare(user_id, progress)
+        self.aggregate(user_id, progress)
+
+    def prepare(self, user_id: str, progress: ProgressReporter):
+        # 需要连接微信的部分：双方的信息、消息数排名，并把新消息同步到本地
+        my_id = self.wechat_api.my_id
+        # {'wxid': 'wxid_xxx', 'code': '', 'remark': '', 'name': 'xxx', 'country': '',
+        # 'province': '', 'city': '', 'gender': '女'}
+        self.my_info = UserInfo.from_dict(
+            self.wechat_api.source.get_info_by_wxid(my_id)
+        )
+        self.user_info = UserInfo.from_dict(
+            self.wechat_api.source.get_info_by_wxid(user_id)
+        )
+        # 连接之后可能收到了新消息，重新统计这个好友
+        stats = self.wechat_api.refresh_talker_stats(user_id)
+        progress.update(stage="同步消息", total_rows=stats.count if stats else None)
+        try:
+            self.wechat_api.sync_message_store(
+                user_id, progress=lambda rows: progress.add("rows_synced", rows), refresh=False
+            )
+        except AnalysisCancelled:
+            raise
+        except Exception as e:
+            # 读取消息时会再同步一次
+            logging.warning(f"sync_message_store err {e}")
+        self.build_count_rank(user_id)
+
+    def aggregate(self, user_id: str, progress: ProgressReporter):
+        """
+        读取、分词、统计，使用本地保存的聊天记录时不需要连接微信，可以在分析进程中执行。
+        每读取 ANALYSIS_CHUNK_ROWS 条消息统计一次，和之前的结果合并，同时只保留一块消息和它的分词结果
+        """
+        self.wait_warmup("pandas", progress)
+        from api.messages import MessageBatch
+
+        # 之前保存的统计结果，有的话只读取之后的新消息再合并
+        self.summary = self.load_summary(user_id)
+        after = None
+        if self.summary is not None:
+            create_time, db_index, local_id = self.summary.cursor
+            after = MessageCursor(db_index, create_time, local_id)
+        progress.update(stage="读取消息")
+        batches = []
+        rows = 0
+        for batch in self.iter_chat_messages(user_id, after):
+            batches.append(batch)
+            rows += len(batch)
+            progress.add("rows_read", len(batch))
+            if rows >= ANALYSIS_CHUNK_ROWS:
+                self.summarize_chunk(MessageBatch.concat(batches, user_id), progress)
+                batches = []
+                rows = 0
+                progress.update(stage="读取消息")
+        if batches:
+            self.summarize_chunk(MessageBatch.concat(batches, user_id), progress)
+        if self.summary is not None:
+            self.build_message_infos()
+            self.build_busiest_day_topics(user_id)
+            self.build_longest_session_topics(user_id)
+        self.save_summary(user_id)
+
+    def render_images(self, progress: ProgressReporter):
+        # 画词云，控件在 build_view 中生成
+        progress.update(stage="生成图表")
+        if self.summary is None:
+            return
+        self.wait_warmup("plot", progress)
+        from api.plot import render_cloud
+
+        self.cloud_path = render_cloud(self.summary.top_words(top_n=100))
+
+    def get_options(self) -> dict:
+        # 在分析进程中创建 Analyzer 的参数
+        return {
+            "message_filter": self.message_filter,
+            "topic_capacity": self.topic_capacity,
+            "session_gap": self.session_gap,
+        }
+
+    def export_result(self) -> tuple[dict, dict]:
+        # 分析进程交给界面进程的结果 (meta, arrays)，arrays 经共享内存传递
+        if self.summary is None:
+            return {"summary": None, "cloud_path": None}, {}
+        meta, arrays = self.summary.to_arrays()
+        return {"summary": meta, "cloud_path": self.cloud_path}, arrays
+
+    def load_result(self, meta: dict, arrays: dict):
+        from api.analytics import ChatSummary
+        from api.messages import LOCAL_TZ
+
+        self.cloud_path = meta["cloud_path"]
+        self.summary = None
+        if meta["summary"] is not None:
+            self.summary = ChatSummary.from_arrays(meta["summary"], arrays, LOCAL_TZ)
+            self.build_message_infos()
+
+    def get_analysis_key(self):
+        # 过滤条件、时区、自定义词典变了之后，之前的统计结果不能再用
+        from api.analytics import SUMMARY_VERSION
+        from api.messages import LOCAL_TZ_NAME
+        from api.stop_words import (
+            MIN_WORD_LENGTH,
+            STOP_WORDS_FILE,
+            USER_DICT_FILE,
+            get_dict_path,
+        )
+
+        parts = [
+            str(SUMMARY_VERSION),
+            repr(self.message_filter),
+            str(self.topic_capacity),
+            str(self.get_session_gap()),
+            str(MIN_WORD_LENGTH),
+            LOCAL_TZ_NAME,
+        ]
+        for name in (STOP_WORDS_FILE, USER_DICT_FILE):
+            path = get_dict_path(name)
+            parts.append(str(path.stat().st_mtime) if path.exists() else "")
+        return hashlib.md5("|".join(parts).encode()).hexdigest()
+
+    def get_session_gap(self) -> int:
+        from api.sessions import SESSION_GAP_SECONDS
+
+        return self.session_gap or SESSION_GAP_SECONDS
+
+    def load_summary(self, user_id: str) -> ChatSummary | None:
+        from api.analytics import ChatSummary
+        from api.messages import LOCAL_TZ
+
+        try:
+            # 已经在 prepare 中同步过
+            store = self.wechat_api.get_message_store()
+            if store is None:
+                return None
+            res = store.load_analysis(user_id, self.get_analysis_key())
+            if res is None:
+                return None
+            covered_lines, data = res
+            summary = ChatSummary.from_dict(data, LOCAL_TZ)
+            if summary.cursor is None:
+                return None
+            if store.count_rows(user_id, summary.cursor) != covered_lines:
+                # 已经统计过的范围内消息有变化，重新统计
+                return None
+            return summary
+        except Exception as e:
+            logging.warning(f"load_summary err {e}")
+            return None
+
+    def save_summary(self, user_id: str):
+        try:
+            store = self.wechat_api.get_message_store()
+            if store is None or self.summary is None or self.summary.cursor is None:
+                return
+            store.save_analysis(
+                user_id,
+                self.get_analysis_key(),
+                store.count_rows(user_id, self.summary.cursor),
+                self.summary.to_dict(),
+            )
+        except Exception as e:
+            logging.warning(f"save_summary err {e}")
+
+    def summarize_chunk(self, batch: MessageBatch, progress: ProgressReporter):
+        # 第一句话、聊得最晚的消息、按天/小时的消息数、字数、词频和回复时间，都由整列数据一次算出，
+        # 再和之前的统计结果合并
+        from api.analytics import summarize_chat
+
+        df = batch.to_analysis_frame()
+        # 每条消息只分词一次，这一块中各处的话题统计共用
+        progress.update(stage="分词")
+        self.wait_warmup("jieba", progress)
+        token_index = self.wechat_api.get_tokenizer().build_index(
+            batch.contents(), progress, self.topic_capacity
+        )
+        progress.update(stage="统计")
+        summary = summarize_chat(
+            df,
+            token_index,
+            self.topic_capacity,
+            self.summary,
+            self.get_session_gap(),
+            check=progress.check,
+        )
+        if summary is None:
+            return
+        summary.cursor = tuple(
+            int(batch.columns[name][-1]) for name in ("CreateTime", "db_index", "localId")
+        )
+        self.summary = summary if self.summary is None else self.summary.merge(summary)
+
+    def build_message_infos(self):
+        # 第一句话和聊得最晚的消息
+        from api.messages import LOCAL_TZ
+
+        summary = self.summary
+        self.start_message_info = StartMessageInfo(
+            start_time=dt.datetime.fromtimestamp(summary.start_time, LOCAL_TZ),
+            from_my=summary.start_from_my,
+            content=summary.start_content,
+            resp_content=summary.resp_content,
+            interval=summary.resp_interval,
+        )
+        self.most_late_message = MostLateMessageInfo(
+            datetime=dt.datetime.fromtimestamp(summary.late_time, LOCAL_TZ),
+            interval=summary.late_interval,
+            message=MessageData.from_dict(
+                {
+                    "CreateTime": summary.late_time,
+                    "IsSender": int(summary.late_is_sender),
+                    "StrContent": summary.late_content,
+                }
+            ),
+        )
+
+    def read_token_index(self, user_id: str, start: int, end: int) -> TokenIndex:
+        # 单独读出 [start, end) 之间的消息分词，用于包含之前统计过的消息的时间段
+        from api.messages import MessageBatch
+        from api.tokens import TokenIndex
+
+        time_filter = dataclasses.replace(
+            self.message_filter, start_time=start, end_time=end
+        )
+        lines = MessageBatch.concat(
+            list(
+                self.wechat_api.iter_chat_messages(user_id, message_filter=time_filter)
+            )
+        )
+        return TokenIndex.build(lines.contents())
+
+    def build_busiest_day_topics(self, user_id: str):
+        # 分块统计时最后才知道哪一天聊天最多，单独读出这一天的消息
+        summary = self.summary
+        day, count = summary.busiest_day()
+        start = int(day.timestamp())
+        cached = summary.busiest_day_topics
+        if count <= 3 or (cached and cached[:2] == (start, count)):
+            return
+        from api.messages import next_day
+
+        end = int(next_day(day).timestamp())
+        topics = self.read_token_index(user_id, start, end).top()
+        summary.busiest_day_topics = (start, count, topics)
+
+    def build_longest_session_topics(self, user_id: str):
+        # 最长的一次聊天跨过了上次统计的位置时，合并后没有话题，单独读出来
+        from api.sessions import get_session_topics
+
+        longest = self.summary.sessions.longest
+        if longest.topics is None:
+            longest.topics = get_session_topics(
+                self.read_token_index(user_id, longest.start_time, longest.end_time + 1)
+            )
+
+    def build_result(self, user_id: str) -> dict:
+        # 可以保存成 json 的分析结果，批量分析时使用
+        summary = self.summary
+        res = {
+            "wxid": user_id,
+            "name": self.user_info.remark or self.user_info.name if self.user_info else None,
+            "count": 0,
+        }
+        if self.count_rank_info:
+            res["rank"] = dataclasses.asdict(self.count_rank_info)
+        if summary is None:
+            return res
+        day, day_count = summary.busiest_day()
+        res.update(
+            {
+                "start": {
+                    "time": self.start_message_info.start_time.isoformat(),
+                    "from_my": summary.start_from_my,
+                    "content": summary.start_content,
+                    "resp_content": summary.resp_content,
+                    "resp_interval": summary.resp_interval,
+                },
+                "latest": {
+                    "time": self.most_late_message.datetime.isoformat(),
+                    "interval": summary.late_interval,
+                    "is_sender": summary.late_is_sender,
+                    "content": summary.late_content,
+                },
+                "count": summary.count,
+                "my_count": summary.my_count,
+                "user_count": summary.user_count,
+                "words": summary.words,
+                "my_words": summary.my_words,
+                "user_words": summary.user_words,
+                "days": len(summary.daily),
+                "busiest_day": {
+                    "date": day.date().isoformat(),
+                    "count": day_count,
+                    "topics": summary.busiest_day_topics[2]
+                    if summary.busiest_day_topics
+                    else [],
+                },
+                "topics": summary.top_words(top_n=20),
+                # 使用 SpaceSaving 时话题的次数最多多算了这么多
+                "topic_max_error": summary.sketch.max_error() if summary.sketch else 0,
+                "daily": self.build_rollup_result("day"),
+                "weekly": self.build_rollup_result("week"),
+                "monthly": self.build_rollup_result("month"),
+                "hourly": summary.hourly[["my", "user"]].to_numpy().tolist(),
+                "reply_latency": self.build_latency_result(),
+                "sessions": self.build_session_result(),
+            }
+        )
+        return res
+
+    def build_rollup_result(self, bucket: str) -> dict:
+        from api.rollups import rollup_counts
+
+        counts = rollup_counts(self.summary.daily, bucket)
+        return {
+            index.date().isoformat(): [my, user]
+            for index, my, user in zip(
+                counts.index, counts["my"].tolist(), counts["user"].tolist()
+            )
+        }
+
+    def build_latency_result(self) -> dict:
+        # 回复时间的中位数和 p90，以及按月、按小时的中位数，单位都是秒
+        latency = self.summary.latency
+        monthly = latency.monthly_quantile().round(1).astype(object)
+        hourly = latency.hourly_quantile().round(1).astype(object)
+        return {
+            **latency.stats(),
+            "monthly": {
+                month.strftime("%Y-%m"): row
+                for month, row in zip(
+                    monthly.index, monthly.where(monthly.notna(), None).to_numpy().tolist()
+                )
+            },
+            "hourly": hourly.where(hourly.notna(), None).to_numpy().tolist(),
+        }
+
+    def build_session_result(self) -> dict:
+        from api.messages import LOCAL_TZ
+
+        sessions = self.summary.sessions
+        longest = sessions.longest
+        return {
+            "gap": sessions.gap,
+            "count": sessions.sessions,
+            "my_started": sessions.my_started,
+            "user_started": sessions.user_started,
+            "my_ended": sessions.my_ended,
+            "user_ended": sessions.user_ended,
+            "mean_count": round(sessions.mean_count, 2),
+            "mean_seconds": round(sessions.mean_seconds, 1),
+            "longest": {
+                "start": dt.datetime.fromtimestamp(longest.start_time, LOCAL_TZ).isoformat(),
+                "end": dt.datetime.fromtimestamp(longest.end_time, LOCAL_TZ).isoformat(),
+                "count": longest.count,
+                "my_count": longest.my_count,
+                "words": longest.words,
+                "started_by_me": longest.started_by_me,
+                "ended_by_me": longest.ended_by_me,
+                "topics": longest.topics,
+            },
+        }
+
+    def build_count_rank(self, user_id: str):
+        # [{'localId': 1, 'TalkerId': 1, 'MsgSvrID': 2061517216873451111, 'Type': 1, 'SubType': 0, 'IsSender': 0,
+        # 'CreateTime': 1676545342, 'Sequence': 1676545342000, 'StatusEx': 0, 'FlagEx': 16, 'Status': 2, 'MsgServerSeq': 1,
+        # 'MsgSequence': 791091113, 'StrTalker': '111@chatroom', 'StrContent': '[胜利]', 'DisplayContent': '',
+        # 'Reserved0': 0, 'Reserved1': 3, 'Reserved2': None, 'Reserved3': None, 'Reserved4': None, 'Reserved5': None,
+        # 'Reserved6': None, 'CompressContent': None, 'BytesExtra': b'', 'BytesTrans': None}]
+        talker_stats = self.wechat_api.get_talker_stats()
+        if talker_stats is None:
+            return
+        rank = talker_stats.rank(user_id)
+        if rank is None:
+            return
+        percent = talker_stats.percent(user_id)
+        top_10 = []
+        for item in talker_stats.top(10):
+            info = self.wechat_api.source.get_info_by_wxid(item.talker)
+            top_10.append(info["remark"] or info["name"])
+        self.count_rank_info = CountRankInfo(
+            count_rank=rank, percent=percent, top_10=top_10
+        )
+
+    def build_view(self):
+        import flet as ft
+
+        from api.messages import LOCAL_TZ
+        from api.rollups import ROLLUP_LABELS, choose_rollup
+        from api.plot import (
+            plot_day_bar,
+            plot_hour_bar,
+            plot_latency_hour,
+            plot_latency_month,
+        )
+
+        res = []
+        summary = self.summary
+        if summary is None:
+            res.append(self.build_container(ft.Text("我们没有任何对话")))
+            return res
+        part1 = []
+        # xxx与xxx
+        part1.append(
+            ft.Text(
+                spans=[
+                    ft.TextSpan(
+                        text=f"{self.my_info.remark or self.my_info.name}",
+                        style=ft.TextStyle(
+                            weight=ft.FontWeight.BOLD,
+                            size=20,
+                            color=self.theme_color,
+                        ),
+                    ),
+                    ft.TextSpan(
+                        text=f"与",
+                        style=ft.TextStyle(weight=ft.FontWeight.BOLD, size=20),
+                    ),
+                    ft.TextSpan(
+                        text=f"{self.user_info.remark or self.user_info.name}",
+                        style=ft.TextStyle(
+                            weight=ft.FontWeight.BOLD,
+                            size=20,
+                            color=self.theme_color,
+                        ),
+                    ),
+                ],
+                selectable=True,
+            )
+        )
+        # 2023年3月11日 是我们相识的第1天
+        start_year = self.start_message_info.start_time.year
+        start_month = self.start_message_info.start_time.month
+        start_day = self.start_message_info.start_time.day
+        part1.append(
+            ft.Text(
+                spans=[
+                    ft.TextSpan(
+                        text=f"{start_year}年{start_month}月{start_day}日 ",
+                        style=ft.TextStyle(weight=ft.FontWeight.BOLD),
+                    ),
+                    ft.TextSpan(text=f"是我们相识的第"),
+                    ft.TextSpan(
+                        text=f" 1 ",
+                        style=ft.TextStyle(size=20, color=self.theme_color),
+                    ),
+                    ft.TextSpan(text=f"天"),
+                ],
+                selectable=True,
+            )
+        )
+        if self.start_message_info.from_my:
+            # 我先说
+            part1.append(
+                ft.Text(
+                    spans=[
+                        ft.TextSpan(text=f"我对你说的第一句话："),
+                        ft.TextSpan(
+                            text=f"“{self.start_message_info.content}”",
+                            style=ft.TextStyle(color=self.theme_color),
+                        ),
+                    ],
+                    selectable=True,
+                )
+            )
+            if self.start_message_info.resp_content:
+                # 对方回复
+                part1.append(
+                    ft.Text(
+                        spans=[
+                            ft.TextSpan(text=f"你在"),
+                            ft.TextSpan(
+                                text=f" {get_time_interval(self.start_message_info.interval)} ",
+                                style=ft.TextStyle(weight=ft.FontWeight.BOLD),
+                            ),
+                            ft.TextSpan(text=f"后回复我："),
+                            ft.TextSpan(
+                                text=f"“{self.start_message_info.resp_content}”",
+                                style=ft.TextStyle(color=self.theme_color),
+                            ),
+                        ],
+                        selectable=True,
+                    )
+                )
+        else:
+            # 对方先说
+            part1.append(
+                ft.Text(
+                    spans=[
+                        ft.TextSpan(text=f"你对我说的第一句话："),
+                        ft.TextSpan(
+                            text=f"“{self.start_message_info.content}”",
+                            style=ft.TextStyle(color=self.theme_color),
+                        ),
+                    ],
+                    selectable=True,
+                )
+            )
+            if self.start_message_info.resp_content:
+                # 我回复
+                part1.append(
+                    ft.Text(
+                        spans=[
+                            ft.TextSpan(text=f"我在"),
+                            ft.TextSpan(
+                                text=f" {get_time_interval(self.start_message_info.interval)} ",
+                                style=ft.TextStyle(weight=ft.FontWeight.BOLD),
+                            ),
+                            ft.TextSpan(text=f"后回复你："),
+                            ft.TextSpan(
+                                text=f"“{self.start_message_info.resp_content}”",
+                                style=ft.TextStyle(color=self.theme_color),
+                            ),
+                        ],
+                        selectable=True,
+                    )
+                )
+        res.append(self.build_container(ft.Column(part1, tight=True)))
+        res.append(ft.Container(height=10))
+        part2 = []
+        # 今天是2024年4月27日 是我们相识的第412天
+        now = dt.datetime.now().astimezone()
+        days_to_now = (now - self.start_message_info.start_time).days
+        part2.append(
+            ft.Text(
+                spans=[
+                    ft.TextSpan(
+                        text=f"今天是{now.year}年{now.month}月{now.day}日 ",
+                        style=ft.TextStyle(weight=ft.FontWeight.BOLD),
+                    ),
+                    ft.TextSpan(text=f"是我们相识的第"),
+                    ft.TextSpan(
+                        text=f" {days_to_now} ",
+                        style=ft.TextStyle(size=20, color=self.theme_color),
+                    ),
+                    ft.TextSpan(text=f"天"),
+                ],
+                selectable=True,
+            )
+        )
+        # 在认识的xx天里
+        my_words_count = summary.my_words
+        user_words_count = summary.user_words
+        daily_count = summary.daily
+        part2.append(
+            ft.Text(
+                spans=[
+                    ft.TextSpan(text=f"在认识的{days_to_now}天里，我们共进行了"),
+                    ft.TextSpan(
+                        text=f"{len(daily_count)}天、{summary.count}次、{summary.words}字 ",
+                        style=ft.TextStyle(color=self.theme_color, size=20),
+                    ),
+                    ft.TextSpan(text=f"的对话"),
+                ],
+                selectable=True,
+            )
+        )
+        part2.append(
+            ft.Text(
+                spans=[
+                    ft.TextSpan(text=f"我对你说了"),
+                    ft.TextSpan(
+                        text=f" {summary.my_count} ",
+                        style=ft.TextStyle(color=self.theme_color),
+                    ),
+                    ft.TextSpan(text=f"句话，共"),
+                    ft.TextSpan(
+                        text=f" {my_words_count} ",
+                        style=ft.TextStyle(color=self.theme_color),
+                    ),
+                    ft.TextSpan(text=f"字；"),
+                    ft.TextSpan(text=f"你对我说了"),
+                    ft.TextSpan(
+                        text=f" {summary.user_count} ",
+                        style=ft.TextStyle(color=self.theme_color),
+                    ),
+                    ft.TextSpan(text=f"句话，共"),
+                    ft.TextSpan(
+                        text=f" {user_words_count} ",
+                        style=ft.TextStyle(color=self.theme_color),
+                    ),
+                    ft.TextSpan(text=f"字。"),
+                ],
+                selectable=True,
+            )
+        )
+        res.append(self.build_container(ft.Column(part2, tight=True)))
+        res.append(ft.Container(height=10))
+        res.append(
+            self.build_container(
+                ft.Text(
+                    spans=[
+                        ft.TextSpan(text=f"我们聊过最多的话题有"),
+                        ft.TextSpan(
+                            text=f"{' '.join(summary.top_words(top_n=20))}",
+                            style=ft.TextStyle(color=self.theme_color, size=20),
+                        ),
+                        ft.TextSpan(text=f"。"),
+                    ],
+                    selectable=True,
+                )
+            )
+        )
+        res.append(ft.Container(height=10))
+        # 聊天最多的一天
+        line_index, max_count = summary.busiest_day()
+        if max_count > 3:
+            # 一天说的话都不超过2条，没统计的必要了
+            topics = summary.busiest_day_topics[2] if summary.busiest_day_topics else []
+            res.append(
+                self.build_container(
+                    ft.Text(
+                        spans=[
+                            ft.TextSpan(
+                                text=f"{line_index.year}年{line_index.month}月{line_index.day}日 ",
+                                style=ft.TextStyle(color=self.theme_color, size=20),
+                            ),
+                            ft.TextSpan(text=f"我们聊天最多，共进行了"),
+                            ft.TextSpan(
+                                text=f"{max_count}次",
+                                style=ft.TextStyle(color=self.theme_color, size=20),
+                            ),
+                            ft.TextSpan(text=f"对话，"),
+                            ft.TextSpan(text=f"这一天我们讨论了"),
+                            ft.TextSpan(
+                                text=f"{' '.join(topics)}",
+                                style=ft.TextStyle(color=self.theme_color),
+                            ),
+                            ft.TextSpan(text=f"这些话题"),
+                        ],
+                        selectable=True,
+                    )
+                )
+            )
+
+        # 聊天最晚的一天
+        if self.most_late_message and self.most_late_message.datetime.hour < 4:
+            # 0-4点之间
+            datetime = self.most_late_message.datetime - dt.timedelta(days=1)
+            res.append(
+                self.build_container(
+                    ft.Text(
+                        spans=[
+                            ft.TextSpan(
+                                text=f"{datetime.year}年{datetime.month}月{datetime.day}日这一天，我们聊到了凌晨"
+                            ),
+                            ft.TextSpan(
+                                text=f"{datetime.hour}点{datetime.minute}分",
+                                style=ft.TextStyle(color=self.theme_color),
+                            ),
+                            ft.TextSpan(
+                                text=f"，我们当时一定有特别想聊的事情！"
+                                f"那天{'我' if self.most_late_message.message.IsSender == 1 else '你'}聊的最后一句话是："
+                            ),
+                            ft.TextSpan(
+                                text=f"“{self.most_late_message.message.StrContent}”",
+                                style=ft.TextStyle(color=self.theme_color),
+                            ),
+                        ],
+                        selectable=True,
+                    )
+                )
+            )
+
+        # 每次聊天
+        sessions = summary.sessions
+        longest = sessions.longest
+        longest_start = dt.datetime.fromtimestamp(longest.start_time, LOCAL_TZ)
+        session_spans = [
+            ft.TextSpan(text=f"我们一共聊了"),
+            ft.TextSpan(
+                text=f" {sessions.sessions} ",
+                style=ft.TextStyle(color=self.theme_color, size=20),
+            ),
+            ft.TextSpan(text=f"次，其中"),
+            ft.TextSpan(
+                text=f" {sessions.my_started} ",
+                style=ft.TextStyle(color=self.theme_color),
+            ),
+            ft.TextSpan(text=f"次是我先开口，"),
+            ft.TextSpan(
+                text=f" {sessions.user_started} ",
+                style=ft.TextStyle(color=self.theme_color),
+            ),
+            ft.TextSpan(text=f"次是你先开口；每次平均聊"),
+            ft.TextSpan(
+                text=f" {round(sessions.mean_count, 1)} ",
+                style=ft.TextStyle(color=self.theme_color),
+            ),
+            ft.TextSpan(text=f"句，持续"),
+            ft.TextSpan(
+                text=f" {get_time_interval(sessions.mean_seconds)} ",
+                style=ft.TextStyle(color=self.theme_color),
+            ),
+            ft.TextSpan(text=f"。"),
+        ]
+        if longest.count > 1:
+            session_spans += [
+                ft.TextSpan(text=f"最长的一次是"),
+                ft.TextSpan(
+                    text=f"{longest_start.year}年{longest_start.month}月{longest_start.day}日",
+                    style=ft.TextStyle(color=self.theme_color),
+                ),
+                ft.TextSpan(text=f"，聊了"),
+                ft.TextSpan(
+                    text=f" {longest.count} 句、{get_time_interval(longest.duration)} ",
+                    style=ft.TextStyle(color=self.theme_color, size=20),
+                ),
+            ]
+            if longest.topics:
+                session_spans += [
+                    ft.TextSpan(text=f"，聊到了"),
+                    ft.TextSpan(
+                        text=f"{' '.join(longest.topics)}",
+                        style=ft.TextStyle(color=self.theme_color),
+                    ),
+                ]
+            session_spans.append(ft.TextSpan(text=f"。"))
+        res.append(self.build_container(ft.Text(spans=session_spans, selectable=True)))
+
+        # 回复时间
+        latency = summary.latency.stats()
+        latency_spans = []
+        for side, who, whom in [("my", "我", "你"), ("user", "你", "我")]:
+            if latency[side]["median"] is None:
+                continue
+            latency_spans += [
+                ft.TextSpan(text=f"{who}回复{whom}一般要"),
+                ft.TextSpan(
+                    text=f" {get_time_interval(latency[side]['median'])} ",
+                    style=ft.TextStyle(color=self.theme_color, size=20),
+                ),
+                ft.TextSpan(text=f"，九成的回复在"),
+                ft.TextSpan(
+                    text=f" {get_time_interval(latency[side]['p90'])} ",
+                    style=ft.TextStyle(color=self.theme_color),
+                ),
+                ft.TextSpan(text=f"以内。"),
+            ]
+        if latency_spans:
+            res.append(
+                self.build_container(ft.Text(spans=latency_spans, selectable=True))
+            )
+
+        res.append(ft.Container(height=10))
+        # 聊天记录很长时按周、月汇总，柱子数有上限
+        bucket, counts = choose_rollup(summary.daily)
+        res.append(ft.Text(f"每{ROLLUP_LABELS[bucket]}消息统计图"))
+        res.append(plot_day_bar(counts, bucket))
+        res.append(ft.Text("日时段消息统计图"))
+        res.append(plot_hour_bar(summary.hourly))
+        if latency_spans:
+            res.append(ft.Text("每月回复时间（中位数，分钟）"))
+            res.append(plot_latency_month(summary.latency.monthly_quantile()))
+            res.append(ft.Text("各时段回复时间（中位数，分钟）"))
+            res.append(plot_latency_hour(summary.latency.hourly_quantile()))
+        res.append(ft.Text("词云图"))
+        res.append(ft.Image(str(self.cloud_path)))
+        # 好友排名
+        if self.count_rank_info:
+            res.append(
+                self.build_container(
+                    ft.Text(
+                        spans=[
+                            ft.TextSpan(text=f"我们的对话次数在所有好友中的排名第"),
+                            ft.TextSpan(
+                                text=f" {self.count_rank_info.count_rank} ",
+                                style=ft.TextStyle(color=self.theme_color, size=20),
+                            ),
+                            ft.TextSpan(text=f"，占所有对话的"),
+                            ft.TextSpan(
+                                text=f" {round(self.count_rank_info.percent * 100, 2)}% ",
+                                style=ft.TextStyle(color=self.theme_color, size=20),
+                            ),
+                        ],
+                        selectable=True,
+                    )
+                )
+            )
+            res.append(
+                self.build_container(
+                    ft.Text(
+                        spans=[
+                            ft.TextSpan(text=f"和我聊天最多的10个人是"),
+                            ft.TextSpan(
+                                text=f" {' '.join(self.count_rank_info.top_10)} ",
+                                style=ft.TextStyle(color=self.theme_color),
+                            ),
+                        ],
+                        selectable=True,
+                    )
+                )
+            )
+
+        return res
+
+    @staticmethod
+    def build_container(child):
+        import flet as ft
+
+        return ft.Container(
+            child,
+            padding=ft.padding.symmetric(horizontal=16, vertical=6),
+            border_radius=ft.border_radius.all(12),
+            bgcolor=ft.colors.WHITE,
+            width=350,
+        )
+
+    async def stop_analysis(self, e=None):
+        # 界面立即结束等待，分析线程在下一个检查点退出
+        if self.progress:
+            self.progress.cancel()
+        if self.analysis_task:
+            self.analysis_task.cancel()
+            self.analysis_task = None
+        if self.end_callback:
+            await self.end_callback()
+            self.end_callback = None
+
+
+@dataclass()
+class UserInfo:
+    wxid: str
+    code: str
+    remark: str
+    name: str
+    country: str
+    province: str
+    city: str
+    gender: str
+    avatar: str
+
+    @staticmethod
+    def from_dict(data):
+        return UserInfo(
+            wxid=data.get("wxid"),
+            code=data.get("code"),
+            remark=data.get("remark"),
+            name=data.get("name"),
+            country=data.get("country"),
+            province=data.get("province"),
+            city=data.get("city"),
+            gender=data.get("gender"),
+            avatar=data.get("avatar"),
+        )
+
+
+@dataclass()
+class StartMessageInfo:
+    start_time: dt.datetime
+    from_my: bool
+    content: str
+    resp_content: str | None = field(default=None)
+    interval: int | None = field(default=None)
+
+
+@dataclass()
+class MostLateMessageInfo:
+    # 我们和凌晨4点进行比较
+    datetime: dt.datetime
+    interval: int  # most_datetime和凌晨4点进行比较的秒数
+    message: MessageData
+
+
+@dataclass()
+class CountRankInfo:
+    count_rank: int
+    percent: float
+    top_10: List[str]
@@ -0,0 +1,115 @@
+import json
+import logging
+import re
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from api.query import ANALYSIS_FILTER, MessageFilter
+from api.analyzer import Analyzer
+from api.wechat import WeChatAPI
+
+
+class BatchAnalyzer:
+    """
+    批量分析多个好友，每个好友一个 Analyzer，在线程池中并发执行，
+    共用 WeChatAPI 的分页缓存、本地聊天记录、好友统计和分词进程池，
+    每个好友的结果保存成一个 json 文件
+    """
+
+    def __init__(
+        self,
+        wechat_api: WeChatAPI,
+        workers=4,
+        output_dir=None,
+        message_filter: MessageFilter = ANALYSIS_FILTER,
+        topic_capacity: int | None = None,
+        session_gap: int | None = None,
+        topic_epsilon: float | None = None,
+        topic_max_bytes: int | None = None,
+    ):
+        self.wechat_api = wechat_api
+        self.workers = workers
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.message_filter = message_filter
+        self.topic_capacity = topic_capacity
+        self.session_gap = session_gap
+        self.topic_epsilon = topic_epsilon
+        self.topic_max_bytes = topic_max_bytes
+
+    def get_output_dir(self) -> Path:
+        if self.output_dir is None:
+            from api.paths import MAIN_PATH
+
+            self.output_dir = MAIN_PATH.joinpath(
+                "reports", time.strftime("%Y%m%d_%H%M%S")
+            )
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        return self.output_dir
+
+    def top_talkers(self, top_n: int) -> list[str]:
+        # 按消息数排名的前 top_n 个好友，不含群聊
+        talker_stats = self.wechat_api.get_talker_stats()
+        if talker_stats is None:
+            return []
+        return [item.talker for item in talker_stats.top(top_n)]
+
+    def analyze_one(self, user_id: str) -> dict:
+        analyzer = Analyzer(
+            self.wechat_api,
+            message_filter=self.message_filter,
+            topic_capacity=self.topic_capacity,
+            session_gap=self.session_gap,
+            topic_epsilon=self.topic_epsilon,
+            topic_max_bytes=self.topic_max_bytes,
+        )
+        analyzer.analyze(user_id)
+        res = analyzer.build_result(user_id)
+        # wxid 中可能有 windows 文件名不允许的字符
+        name = re.sub(r'[\\/:*?"<>|]', "_", user_id)
+        path = self.get_output_dir().joinpath(f"{name}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+        return res
+
+    def run(self, user_ids: list[str] | None = None, top_n: int | None = None, progress=None):
+        """
+        user_ids 为空时分析消息数前 top_n 的好友，
+        progress(完成数, 总数, wxid) 在每个好友完成后调用，返回汇总信息，
+        每分钟分析的好友数只算成功的，失败的单独列出
+        """
+        if not user_ids:
+            user_ids = self.top_talkers(top_n or 0)
+        finished = 0
+        failed = []
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(self.analyze_one, user_id): user_id
+                for user_id in user_ids
+            }
+            for future in as_completed(futures):
+                user_id = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error(f"batch analyze {user_id} err {e} {traceback.format_exc()}")
+                    failed.append(user_id)
+                finished += 1
+                if progress:
+                    progress(finished, len(user_ids), user_id)
+        seconds = time.time() - start
+        succeeded = len(user_ids) - len(failed)
+        res = {
+            "contacts": len(user_ids),
+            "succeeded": succeeded,
+            "failed": failed,
+            "seconds": round(seconds, 2),
+            "contacts_per_minute": round(succeeded / seconds * 60, 2) if seconds else None,
+            "output_dir": str(self.get_output_dir()),
+        }
+        logging.info(f"batch analyze {res}")
+        with open(self.get_output_dir().joinpath("_summary.json"), "w", encoding="utf-8") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+        return res
@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+
+
+class MessageCacheLRU:
+    """
+    按估算字节数限制大小的 LRU 缓存，值需要提供 estimate_size() 和 trim(max_bytes)，
+    线程安全，后台预取和界面可以共用
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.items: OrderedDict = OrderedDict()
+        self.sizes: dict = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def get_or_create(self, key, factory):
+        with self.lock:
+            value = self.get(key)
+            if value is None:
+                value = factory()
+                self.put(key, value)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.items:
+                self.total_bytes -= self.sizes.pop(key)
+            self.items[key] = value
+            self.items.move_to_end(key)
+            self.sizes[key] = value.estimate_size()
+            self.total_bytes += self.sizes[key]
+            self.evict()
+
+    def update_size(self, key):
+        # 值的内容变化后重新计算大小
+        with self.lock:
+            if key not in self.items:
+                return
+            self.total_bytes -= self.sizes[key]
+            self.sizes[key] = self.items[key].estimate_size()
+            self.total_bytes += self.sizes[key]
+            self.evict()
+
+    def evict(self):
+        # 超出预算时先淘汰最久没用的，只剩当前一个时裁剪它自己
+        while self.total_bytes > self.max_bytes and len(self.items) > 1:
+            key, _ = self.items.popitem(last=False)
+            self.total_bytes -= self.sizes.pop(key)
+            self.evictions += 1
+        if self.total_bytes > self.max_bytes and self.items:
+            key = next(iter(self.items))
+            self.items[key].trim(self.max_bytes)
+            self.total_bytes -= self.sizes[key]
+            self.sizes[key] = self.items[key].estimate_size()
+            self.total_bytes += self.sizes[key]
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.sizes.clear()
+            self.total_bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "items": len(self.items),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
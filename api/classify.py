@@ -0,0 +1,119 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from api.messages import STRING_DTYPE, MessageBatch
+
+# 消息类别，kind 列按这个顺序存储编码
+KINDS = ["text", "image", "video", "voice", "voip", "emoji", "location", "revoke"]
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+# 由 Type 直接确定类别的消息
+TYPE_KINDS = {
+    1: "text",
+    3: "image",
+    34: "voice",
+    43: "video",
+    47: "emoji",
+    48: "location",
+    50: "voip",
+}
+
+# Type 不能确定时按内容判断，顺序即优先级，包含任一标记就算作这一类
+CONTENT_MARKERS = [
+    ("image", ["<msg><img ", "<imgdatahash></imgdatahash>"]),
+    ("video", ["<msg><videomsg ", "cdnrawvideoaeskey"]),
+    ("voice", ["voicemsg"]),
+    ("voip", ["<VoIPBubbleMsg>"]),
+    ("emoji", ["<msg><emoji"]),
+    ("location", ["location x"]),
+    ("revoke", ["<revokemsg>"]),
+]
+MARKER_CODES = [
+    (marker, KIND_CODES[kind]) for kind, markers in CONTENT_MARKERS for marker in markers
+]
+NOT_CHINESE = re.compile(r"[^\u4e00-\u9fa5]+")
+
+# 各类别显示的文本，text 保留原内容
+KIND_PREFIX = {
+    "image": "[图片]",
+    "video": "[视频]",
+    "voice": "[语音]",
+    "voip": "[语音通话]",
+    "emoji": "[EMOJI]",
+    "location": "[定位]",
+    "revoke": "",
+}
+# 这些类别在前缀后面附上内容里的中文
+KIND_WITH_CHINESE = {"voice", "voip", "location", "revoke"}
+
+
+def content_kind(content: str) -> int:
+    # 第一个命中的标记的类别编码，去掉换行后再判断，和原来的逐条判断一致
+    content = content.replace("\n", "").strip()
+    for marker, code in MARKER_CODES:
+        if marker in content:
+            return code
+    return KIND_CODES["text"]
+
+
+def classify_messages(types, content) -> pd.DataFrame:
+    """
+    按整列判断消息类别，返回 kind（分类编码）、chinese（内容中的中文）、text（显示的文本）。
+    Type 能确定的行不看内容，其余的行只遍历一次
+    """
+    content = pd.array(content, dtype=STRING_DTYPE, copy=False)
+    # string[python] 时就是内部的数组，不拷贝
+    values = np.asarray(content, dtype=object)
+    types = np.asarray(types)
+    codes = np.full(len(values), KIND_CODES["text"], dtype=np.int8)
+    known = np.zeros(len(values), dtype=bool)
+    for type_, kind in TYPE_KINDS.items():
+        mask = types == type_
+        codes[mask] = KIND_CODES[kind]
+        known |= mask
+
+    unknown = np.flatnonzero(~known)
+    if len(unknown):
+        codes[unknown] = [content_kind(c) for c in values[unknown]]
+
+    # 只有替换掉的行需要新的文本，其余的行沿用原来的字符串对象
+    text = values.copy()
+    chinese = np.full(len(values), "", dtype=object)
+    for k, prefix in KIND_PREFIX.items():
+        rows = np.flatnonzero(codes == KIND_CODES[k])
+        if not len(rows):
+            continue
+        if k in KIND_WITH_CHINESE:
+            # 纯 ASCII 的内容（大多是 xml）里没有中文，isascii 不用遍历字符串
+            chinese[rows] = [
+                "" if c.isascii() else NOT_CHINESE.sub("", c) for c in values[rows]
+            ]
+            text[rows] = [prefix + c for c in chinese[rows]]
+        else:
+            text[rows] = prefix
+    return pd.DataFrame(
+        {
+            "kind": pd.Categorical.from_codes(codes, KINDS),
+            "chinese": pd.array(chinese, dtype=content.dtype, copy=False),
+            "text": pd.array(text, dtype=content.dtype, copy=False),
+        },
+        copy=False,
+    )
+
+
+def classify_batch(batch: MessageBatch) -> MessageBatch:
+    # 替换成显示的文本，并加上 kind 列
+    res = classify_messages(batch.columns["Type"], batch.content)
+    classified = batch.with_content(res["text"].array)
+    classified.columns = {**batch.columns, "kind": res["kind"].cat.codes.to_numpy()}
+    return classified
+
+
+def filter_kinds(batch: MessageBatch, message_filter) -> MessageBatch:
+    # 过滤条件里只能在分类之后判断的部分
+    if message_filter is None or not message_filter.exclude_kinds:
+        return batch
+    codes = [KIND_CODES[kind] for kind in message_filter.exclude_kinds]
+    return batch.filter(~np.isin(batch.columns["kind"], codes))
@@ -0,0 +1,163 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+# 间隔超过一天算作重新开始聊天，不算回复
+MAX_REPLY_SECONDS = 24 * 3600
+# 回复时间按 log2(1 + 秒数) 分桶，每翻一倍分成 8 个桶，分位数的相对误差在 5% 以内
+BINS_PER_OCTAVE = 8
+LATENCY_BINS = int(np.ceil(np.log2(1 + MAX_REPLY_SECONDS) * BINS_PER_OCTAVE)) + 1
+# 第 i 个桶是 [LATENCY_EDGES[i], LATENCY_EDGES[i + 1])
+LATENCY_EDGES = np.exp2(np.arange(LATENCY_BINS + 1) / BINS_PER_OCTAVE) - 1
+# 第二维的下标，0 是我回复对方，1 是对方回复我
+SIDES = ["my", "user"]
+
+
+def latency_bins(latency: np.ndarray) -> np.ndarray:
+    bins = np.floor(np.log2(1 + latency) * BINS_PER_OCTAVE).astype(np.int64)
+    return np.minimum(bins, LATENCY_BINS - 1)
+
+
+def find_replies(create_time: np.ndarray, is_sender: np.ndarray):
+    """
+    说话的人变了的地方就是一次回复，返回 (回复的下标, 回复时间)，
+    回复时间是和对方上一条消息相差的秒数，超过 MAX_REPLY_SECONDS 的不算
+    """
+    changed = np.flatnonzero(is_sender[1:] != is_sender[:-1]) + 1
+    latency = create_time[changed] - create_time[changed - 1]
+    keep = (latency >= 0) & (latency <= MAX_REPLY_SECONDS)
+    return changed[keep], latency[keep]
+
+
+def histogram_quantile(hist: np.ndarray, q: float) -> np.ndarray:
+    # hist 最后一维是各个桶的次数，在桶内按次数线性插值，没有回复时是 nan
+    hist = np.asarray(hist, dtype=np.int64)
+    cum = np.cumsum(hist, axis=-1)
+    total = cum[..., -1]
+    rank = q * total
+    index = np.minimum((cum < rank[..., None]).sum(axis=-1), LATENCY_BINS - 1)
+    count = np.take_along_axis(hist, index[..., None], axis=-1)[..., 0]
+    before = np.take_along_axis(cum, index[..., None], axis=-1)[..., 0] - count
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.clip(np.where(count > 0, (rank - before) / count, 0), 0, 1)
+        res = LATENCY_EDGES[index] + frac * (LATENCY_EDGES[index + 1] - LATENCY_EDGES[index])
+    return np.where(total > 0, res, np.nan)
+
+
+@dataclass()
+class ReplyLatency:
+    """
+    双方回复时间的分布，按月份和小时保存直方图，形状是 (月份数或24, 2, LATENCY_BINS)，
+    中位数、p90 都由直方图得到，所以不同批次的结果可以直接相加合并。
+    月份和小时都按被回复的那条消息的时间算
+    """
+
+    # 月份的编号 year * 12 + month - 1，从小到大
+    months: np.ndarray = field(default_factory=lambda: np.zeros(0, np.int64))
+    monthly: np.ndarray = field(
+        default_factory=lambda: np.zeros((0, 2, LATENCY_BINS), np.int64)
+    )
+    hourly: np.ndarray = field(
+        default_factory=lambda: np.zeros((24, 2, LATENCY_BINS), np.int64)
+    )
+
+    @staticmethod
+    def build(datetime: pd.DatetimeIndex, is_sender: np.ndarray, previous=None):
+        """
+        datetime 是按时间排序的本地时间，previous 是之前统计过的最后一条消息
+        (CreateTime, IsSender)，新消息的第一条可能是对它的回复
+        """
+        create_time = datetime.asi8 // 10**9
+        if previous is not None:
+            create_time = np.concatenate([[previous[0]], create_time])
+            is_sender = np.concatenate([[bool(previous[1])], is_sender])
+            datetime = datetime.insert(
+                0, pd.Timestamp(previous[0], unit="s", tz="UTC").tz_convert(datetime.tz)
+            )
+        if len(create_time) < 2:
+            return ReplyLatency()
+        replies, latency = find_replies(create_time, is_sender)
+        asked = datetime[replies - 1]
+        month_keys = asked.year.to_numpy() * 12 + asked.month.to_numpy() - 1
+        months, month_index = np.unique(month_keys, return_inverse=True)
+        # 回复的人是我时，算我的回复时间
+        sides = np.where(is_sender[replies], 0, 1)
+        bins = latency_bins(latency)
+        monthly = np.bincount(
+            (month_index * 2 + sides) * LATENCY_BINS + bins,
+            minlength=len(months) * 2 * LATENCY_BINS,
+        ).reshape(len(months), 2, LATENCY_BINS)
+        hourly = np.bincount(
+            (asked.hour.to_numpy() * 2 + sides) * LATENCY_BINS + bins,
+            minlength=24 * 2 * LATENCY_BINS,
+        ).reshape(24, 2, LATENCY_BINS)
+        return ReplyLatency(months.astype(np.int64), monthly, hourly)
+
+    def merge(self, other: "ReplyLatency") -> "ReplyLatency":
+        months = np.union1d(self.months, other.months).astype(np.int64)
+        monthly = np.zeros((len(months), 2, LATENCY_BINS), np.int64)
+        monthly[np.searchsorted(months, self.months)] += self.monthly
+        monthly[np.searchsorted(months, other.months)] += other.monthly
+        return ReplyLatency(months, monthly, self.hourly + other.hourly)
+
+    def histogram(self) -> np.ndarray:
+        # (2, LATENCY_BINS)
+        return self.hourly.sum(axis=0)
+
+    def stats(self) -> dict:
+        # {"my": {"count", "median", "p90"}, "user": ...}，秒数，没有回复时是 None
+        hist = self.histogram()
+        median = histogram_quantile(hist, 0.5)
+        p90 = histogram_quantile(hist, 0.9)
+        return {
+            side: {
+                "count": int(hist[i].sum()),
+                "median": None if np.isnan(median[i]) else round(float(median[i]), 1),
+                "p90": None if np.isnan(p90[i]) else round(float(p90[i]), 1),
+            }
+            for i, side in enumerate(SIDES)
+        }
+
+    def monthly_quantile(self, q=0.5) -> pd.DataFrame:
+        # index 是每月1日，列是 my / user，这个月没有回复时是 nan
+        index = pd.PeriodIndex.from_ordinals(
+            self.months - 1970 * 12, freq="M"
+        ).to_timestamp()
+        return pd.DataFrame(
+            histogram_quantile(self.monthly, q).reshape(len(self.months), 2),
+            index=index.rename("month"),
+            columns=SIDES,
+        )
+
+    def hourly_quantile(self, q=0.5) -> pd.DataFrame:
+        return pd.DataFrame(
+            histogram_quantile(self.hourly, q),
+            index=pd.RangeIndex(24, name="hour"),
+            columns=SIDES,
+        )
+
+    def to_dict(self) -> dict:
+        # 直方图大多是 0，只保存不为 0 的位置
+        monthly = self.monthly.ravel()
+        hourly = self.hourly.ravel()
+        monthly_index = np.flatnonzero(monthly)
+        hourly_index = np.flatnonzero(hourly)
+        return {
+            "months": self.months.tolist(),
+            "monthly": [monthly_index.tolist(), monthly[monthly_index].tolist()],
+            "hourly": [hourly_index.tolist(), hourly[hourly_index].tolist()],
+        }
+
+    @staticmethod
+    def from_dict(data: dict):
+        months = np.asarray(data["months"], dtype=np.int64)
+        monthly = np.zeros(len(months) * 2 * LATENCY_BINS, np.int64)
+        monthly[data["monthly"][0]] = data["monthly"][1]
+        hourly = np.zeros(24 * 2 * LATENCY_BINS, np.int64)
+        hourly[data["hourly"][0]] = data["hourly"][1]
+        return ReplyLatency(
+            months,
+            monthly.reshape(len(months), 2, LATENCY_BINS),
+            hourly.reshape(24, 2, LATENCY_BINS),
+        )
@@ -0,0 +1,240 @@
+import datetime as dt
+import importlib.util
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# 整数列，按列存成 numpy 数组
+INT_COLUMNS = [
+    "db_index",
+    "localId",
+    "MsgSvrID",
+    "Type",
+    "SubType",
+    "IsSender",
+    "CreateTime",
+]
+# 有 pyarrow 时内容列用 arrow 存储，否则用 pandas 的 string 类型
+STRING_DTYPE = (
+    "string[pyarrow]" if importlib.util.find_spec("pyarrow") is not None else "string"
+)
+
+
+def get_local_tz():
+    """
+    本地时区和它的名字，带夏令时规则，和 datetime.fromtimestamp 的结果一致。
+    能找到时区名（TZ 环境变量、/etc/localtime、/etc/timezone）时用时区数据库，pandas 可以整列转换；
+    找不到时（Windows），没有夏令时的地区用固定的偏移，有夏令时的用 tzlocal，逐个时间计算，较慢
+    """
+    from dateutil import tz
+
+    name = os.environ.get("TZ", "").lstrip(":")
+    localtime = Path("/etc/localtime")
+    if not name and localtime.is_symlink():
+        target = str(localtime.resolve())
+        if "zoneinfo/" in target:
+            name = target.split("zoneinfo/", 1)[1]
+    if not name and Path("/etc/timezone").is_file():
+        name = Path("/etc/timezone").read_text().strip()
+    zone = tz.gettz(name) if name else None
+    if zone is not None:
+        return zone, name
+    if not time.daylight:
+        zone = dt.timezone(dt.timedelta(seconds=-time.timezone))
+        return zone, str(zone)
+    return tz.tzlocal(), "local " + "/".join(time.tzname)
+
+
+# 本地时区，CreateTime 统一转换到这个时区，名字用来区分保存的统计结果
+LOCAL_TZ, LOCAL_TZ_NAME = get_local_tz()
+
+
+def localize(naive: pd.DatetimeIndex, tz) -> pd.DatetimeIndex:
+    # 本地时间加上时区，夏令时跳过的时间取之后最早的时刻，重复的时间取第一次
+    if tz is None:
+        return naive
+    return naive.tz_localize(
+        tz, ambiguous=np.ones(len(naive), dtype=bool), nonexistent="shift_forward"
+    )
+
+
+def local_days(datetime: pd.DatetimeIndex) -> pd.DatetimeIndex:
+    # 每个时间所在那天的开始，有的时区夏令时从0点开始，那天从1点开始
+    return localize(datetime.tz_localize(None).normalize(), datetime.tz)
+
+
+def next_day(day: pd.Timestamp) -> pd.Timestamp:
+    # 下一天的开始，夏令时切换的那天不是24小时
+    return local_days(pd.DatetimeIndex([day + pd.Timedelta(hours=36)]))[0]
+
+
+class MessageBatch:
+    """
+    按列存储的一批消息，代替逐条的 MessageData，
+    迭代和下标访问返回 MessageRow，原来按属性读取的地方不用改
+    """
+
+    def __init__(self, columns: dict, content, talker: str | None = None):
+        self.columns: dict[str, np.ndarray] = columns
+        self.content = content
+        self.talker = talker
+
+    @staticmethod
+    def from_rows(rows: list, talker: str | None = None):
+        columns = {
+            name: np.fromiter(
+                (row.get(name) or 0 for row in rows), dtype=np.int64, count=len(rows)
+            )
+            for name in INT_COLUMNS
+        }
+        content = pd.array(
+            [row.get("StrContent") or "" for row in rows], dtype=STRING_DTYPE
+        )
+        return MessageBatch(columns, content, talker)
+
+    @staticmethod
+    def empty(talker: str | None = None):
+        return MessageBatch.from_rows([], talker)
+
+    @staticmethod
+    def concat(batches: list["MessageBatch"], talker: str | None = None):
+        if not batches:
+            return MessageBatch.empty(talker)
+        columns = {
+            name: np.concatenate([batch.columns[name] for batch in batches])
+            for name in batches[0].columns
+        }
+        content = pd.concat(
+            [pd.Series(batch.content, copy=False) for batch in batches],
+            ignore_index=True,
+        ).array
+        return MessageBatch(columns, content, talker or batches[0].talker)
+
+    def __len__(self):
+        return len(self.content)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield MessageRow(self, index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.take(np.arange(len(self))[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return MessageRow(self, index)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def take(self, indices):
+        # indices 可以是下标数组，也可以是布尔掩码
+        return MessageBatch(
+            {name: values[indices] for name, values in self.columns.items()},
+            self.content[indices],
+            self.talker,
+        )
+
+    def filter(self, mask):
+        return self.take(np.asarray(mask, dtype=bool))
+
+    def with_content(self, content):
+        # 已经是同样类型的数组时不再拷贝、检查一遍
+        return MessageBatch(
+            self.columns, pd.array(content, dtype=STRING_DTYPE, copy=False), self.talker
+        )
+
+    def contents(self) -> list[str]:
+        return list(self.content)
+
+    def value(self, name: str, index: int):
+        if name == "StrContent":
+            return self.content[index]
+        if name == "StrTalker":
+            return self.talker
+        if name in self.columns:
+            return int(self.columns[name][index])
+        if name in MESSAGE_DATA_FIELDS:
+            # 没有查询的列
+            return None
+        raise AttributeError(name)
+
+    def to_frame(self) -> pd.DataFrame:
+        # 直接用已有的数组构建，不复制
+        return pd.DataFrame(
+            {**self.columns, "StrContent": self.content}, copy=False
+        )
+
+    def to_analysis_frame(self) -> pd.DataFrame:
+        # 分析用的 DataFrame，CreateTime 一次性向量化转换成带时区的 DatetimeIndex
+        datetime = pd.DatetimeIndex(
+            pd.to_datetime(self.columns["CreateTime"], unit="s", utc=True),
+            name="datetime",
+        ).tz_convert(LOCAL_TZ)
+        data = {
+            "datetime": datetime,
+            "is_sender": self.columns["IsSender"] == 1,
+            "content": self.content,
+        }
+        if "kind" in self.columns:
+            from api.classify import KINDS
+
+            data["kind"] = pd.Categorical.from_codes(self.columns["kind"], KINDS)
+        return pd.DataFrame(data, index=datetime, copy=False)
+
+    def estimate_size(self) -> int:
+        size = sum(values.nbytes for values in self.columns.values())
+        if STRING_DTYPE == "string[pyarrow]":
+            return size + self.content.nbytes
+        # python 字符串对象分散存放，nbytes 只有指针大小
+        return size + sum(sys.getsizeof(s) for s in self.content)
+
+
+class MessageRow:
+    """
+    MessageBatch 中一行的视图，属性和 MessageData 一致
+    """
+
+    __slots__ = ("batch", "index")
+
+    def __init__(self, batch: MessageBatch, index: int):
+        self.batch = batch
+        self.index = index
+
+    def __getattr__(self, name):
+        return self.batch.value(name, self.index)
+
+    def __repr__(self):
+        return f"MessageRow({self.to_dict()})"
+
+    def to_dict(self) -> dict:
+        return {name: self.batch.value(name, self.index) for name in MESSAGE_DATA_FIELDS}
+
+
+# MessageData 的全部字段
+MESSAGE_DATA_FIELDS = [
+    "localId",
+    "TalkerId",
+    "MsgSvrID",
+    "Type",
+    "SubType",
+    "IsSender",
+    "CreateTime",
+    "Sequence",
+    "StatusEx",
+    "FlagEx",
+    "Status",
+    "MsgServerSeq",
+    "MsgSequence",
+    "StrTalker",
+    "StrContent",
+    "DisplayContent",
+    "BytesExtra",
+    "db_index",
+]
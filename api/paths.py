@@ -0,0 +1,4 @@
+from pathlib import Path
+
+# 项目根目录，字体、缓存、报告等都放在这里
+MAIN_PATH = Path(__file__).parent.parent.absolute()
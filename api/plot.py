@@ -1,32 +1,33 @@
 import time
+from pathlib import Path
 
 import flet as ft
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import pandas as pd
-import datetime as dt
+import numpy as np
 from wordcloud import WordCloud
 
+from api.rollups import MAX_POINTS, lttb
 
-def plot_day_bar(df: pd.DataFrame):
-    my_daily_count = df[df["is_sender"] == 1].resample("D").count()
-    my_daily_count = my_daily_count[my_daily_count["content"] != 0]
-    user_daily_count = df[df["is_sender"] == 0].resample("D").count()
-    user_daily_count = user_daily_count[user_daily_count["content"] != 0]
 
-    concat_dict = {}
-    for index, row in my_daily_count.iterrows():
-        index = index.timestamp()
-        concat_dict[index] = [index, row["content"], 0]
+# 各个时间粒度的柱子在提示中显示的时间
+BUCKET_FORMATS = {
+    "day": "%Y-%m-%d",
+    "week": "%Y-%m-%d起一周",
+    "month": "%Y-%m",
+    "quarter": "%Y-%m起一季度",
+    "year": "%Y年",
+}
 
-    for index, row in user_daily_count.iterrows():
-        index = index.timestamp()
-        if index in concat_dict:
-            concat_dict[index][2] = row["content"]
-        else:
-            concat_dict[index] = [index, 0, row["content"]]
 
-    concat_list = list(concat_dict.values())
-    concat_list.sort(key=lambda v: v[0])
+def plot_day_bar(counts: pd.DataFrame, bucket="day"):
+    # counts 是 api.rollups.choose_rollup 的结果，只有有消息的时间段，柱子数已经有上限
+    concat_list = [
+        [index, my, user]
+        for index, my, user in zip(
+            counts.index, counts["my"].tolist(), counts["user"].tolist()
+        )
+    ]
 
     bar_groups = []
     labels = []
@@ -41,7 +42,7 @@ def plot_day_bar(df: pd.DataFrame):
     if len(concat_list) > 80:
         bar_width = 4
     for index in range(len(concat_list)):
-        t = dt.datetime.fromtimestamp(concat_list[index][0]).strftime("%Y-%m-%d")
+        t = concat_list[index][0].strftime(BUCKET_FORMATS[bucket])
         labels.append(
             ft.ChartAxisLabel(
                 value=index,
@@ -105,28 +106,14 @@ def plot_day_bar(df: pd.DataFrame):
     return chart
 
 
-def plot_hour_bar(df: pd.DataFrame):
-    df = df.copy()
-    df["hour"] = df["datetime"].dt.hour
-    my_hour_count: pd.Series = (
-        df[df["is_sender"] == 1].groupby("hour")["content"].count()
-    )
-    user_hour_count: pd.Series = (
-        df[df["is_sender"] == 0].groupby("hour")["content"].count()
-    )
-
-    concat_dict = {}
-    for i in range(24):
-        concat_dict[i] = [i, 0, 0]
-
-    for index, row in my_hour_count.items():
-        concat_dict[index] = [index, row, 0]
-
-    for index, row in user_hour_count.items():
-        concat_dict[index][2] = row
-
-    concat_list = list(concat_dict.values())
-    concat_list.sort(key=lambda v: v[0])
+def plot_hour_bar(hourly: pd.DataFrame):
+    # hourly 是 api.analytics.hourly_counts 的结果，0-23点都有
+    concat_list = [
+        [index, my, user]
+        for index, my, user in zip(
+            hourly.index, hourly["my"].tolist(), hourly["user"].tolist()
+        )
+    ]
 
     bar_groups = []
     labels = []
@@ -205,23 +192,135 @@ def plot_hour_bar(df: pd.DataFrame):
     return chart
 
 
+def plot_latency_month(monthly: pd.DataFrame, max_points: int | None = MAX_POINTS):
+    # monthly 是 ReplyLatency.monthly_quantile 的结果，单位是秒，按分钟画两条线，
+    # 月份多于 max_points 时用 LTTB 降采样，max_points 为 None 时画出所有的点
+    from ui.utils import get_time_interval
+
+    data_series = []
+    for column, name, color in [
+        ("my", "我的回复", ft.colors.GREEN),
+        ("user", "你的回复", ft.colors.BLUE),
+    ]:
+        data_points = []
+        # 这个月没有回复时是 nan，不画
+        x = np.flatnonzero(monthly[column].notna().to_numpy())
+        values = monthly[column].to_numpy()[x]
+        if max_points is not None:
+            keep = lttb(x, values, max_points)
+            x, values = x[keep], values[keep]
+        for index, seconds in zip(x.tolist(), values.tolist()):
+            month = monthly.index[index]
+            data_points.append(
+                ft.LineChartDataPoint(
+                    index,
+                    round(seconds / 60, 1),
+                    tooltip=f"{month.strftime('%Y-%m')}\n{name}：{get_time_interval(seconds)}",
+                    tooltip_style=ft.TextStyle(color=ft.colors.WHITE),
+                )
+            )
+        data_series.append(
+            ft.LineChartData(
+                data_points=data_points,
+                color=color,
+                stroke_width=2,
+                curved=True,
+                prevent_curve_over_shooting=True,
+            )
+        )
+
+    chart = ft.LineChart(
+        data_series=data_series,
+        border=ft.border.all(1, ft.colors.GREY_400),
+        horizontal_grid_lines=ft.ChartGridLines(
+            color=ft.colors.GREY_300, width=1, dash_pattern=[3, 3]
+        ),
+        tooltip_bgcolor=ft.colors.BLACK87,
+        min_y=0,
+        interactive=True,
+    )
+
+    return chart
+
+
+def plot_latency_hour(hourly: pd.DataFrame):
+    # hourly 是 ReplyLatency.hourly_quantile 的结果，单位是秒，按分钟画，我和对方各一根柱子
+    from ui.utils import get_time_interval
+
+    bar_groups = []
+    bar_width = 4
+    for index, my, user in zip(
+        hourly.index, hourly["my"].tolist(), hourly["user"].tolist()
+    ):
+        t = f"{index}点-{index+1}点"
+        bar_rods = []
+        for seconds, name, color in [
+            (my, "我的回复", ft.colors.GREEN),
+            (user, "你的回复", ft.colors.BLUE),
+        ]:
+            bar_rods.append(
+                ft.BarChartRod(
+                    from_y=0,
+                    to_y=0 if pd.isna(seconds) else round(seconds / 60, 1),
+                    width=bar_width,
+                    color=color,
+                    tooltip=f"{t}\n{name}："
+                    + ("无" if pd.isna(seconds) else get_time_interval(seconds)),
+                    tooltip_style=ft.TextStyle(color=ft.colors.WHITE),
+                    border_radius=bar_width / 2,
+                )
+            )
+        bar_groups.append(ft.BarChartGroup(x=index, bar_rods=bar_rods, bars_space=1))
+
+    chart = ft.BarChart(
+        bar_groups=bar_groups,
+        border=ft.border.all(1, ft.colors.GREY_400),
+        horizontal_grid_lines=ft.ChartGridLines(
+            color=ft.colors.GREY_300, width=1, dash_pattern=[3, 3]
+        ),
+        tooltip_bgcolor=ft.colors.BLACK87,
+        interactive=True,
+        groups_space=bar_width / 2,
+    )
+
+    return chart
+
+
+def get_font_path():
+    from api.paths import MAIN_PATH
+
+    return MAIN_PATH.joinpath("assets", "fonts", "alipuhui.ttf")
+
+
+def prime_plot():
+    # 预热：加载字体生成一张很小的词云，第一次分析时不用再等
+    WordCloud(font_path=str(get_font_path()), width=64, height=64).generate("微信 聊天")
+
+
 def plot_cloud(text_list):
-    from main import MAIN_PATH
+    return ft.Image(str(render_cloud(text_list)))
+
+
+def render_cloud(text_list) -> Path:
+    # 只画图不生成控件，可以在分析进程中执行，返回保存的图片
+    from api.paths import MAIN_PATH
 
     wordcloud = WordCloud(
-        font_path=MAIN_PATH.joinpath("assets", "fonts", "alipuhui.ttf"),
+        font_path=get_font_path(),
         background_color="white",  # 背景色为白色
         height=400,  # 高度设置为400
         width=800,  # 宽度设置为800
         scale=20,  # 长宽拉伸程度设置为20
         prefer_horizontal=0.9999,
     ).generate(" ".join(text_list))
-    plt.figure(figsize=(8, 4))
-    plt.imshow(wordcloud)
-    plt.axis("off")
+    # 不用 pyplot，可以在分析线程中画图，画完也不会留下没有关闭的图
+    figure = Figure(figsize=(8, 4))
+    ax = figure.subplots()
+    ax.imshow(wordcloud)
+    ax.axis("off")
     """保存到本地"""
     if not MAIN_PATH.joinpath("tmp").exists():
         MAIN_PATH.joinpath("tmp").mkdir(parents=True, exist_ok=True)
     path = MAIN_PATH.joinpath("tmp").joinpath(f"{int(time.time())}.jpg")
-    plt.savefig(path, dpi=600, bbox_inches="tight")
-    return ft.Image(str(path))
+    figure.savefig(path, dpi=600, bbox_inches="tight")
+    return path
@@ -0,0 +1,63 @@
+import dataclasses
+import threading
+import time
+from dataclasses import dataclass, field
+
+
+class AnalysisCancelled(Exception):
+    """
+    分析被取消，在分析线程的下一个检查点抛出
+    """
+
+
+@dataclass()
+class AnalysisProgress:
+    stage: str = field(default="准备")
+    rows_synced: int = field(default=0)
+    rows_read: int = field(default=0)
+    rows_tokenized: int = field(default=0)
+    # 好友消息数统计中的总数，包含之后会被过滤掉的消息，只用来估计进度
+    total_rows: int | None = field(default=None)
+
+
+class ProgressReporter:
+    """
+    在分析线程中报告进度、检查是否取消。
+    每次 update 都会检查是否取消，callback 也在分析线程中调用，
+    换阶段时一定调用，否则两次调用至少间隔 interval 秒。
+    cancel_event 是有 is_set() / set() 的对象，默认是 threading.Event，在分析进程中由界面进程设置
+    """
+
+    def __init__(self, callback=None, interval=0.1, cancel_event=None):
+        self.callback = callback
+        self.interval = interval
+        self.progress = AnalysisProgress()
+        self.cancel_event = cancel_event or threading.Event()
+        self.last_report = 0.0
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check(self):
+        if self.cancel_event.is_set():
+            raise AnalysisCancelled()
+
+    def update(self, stage: str | None = None, **kwargs):
+        self.check()
+        changed = stage is not None and stage != self.progress.stage
+        if stage is not None:
+            self.progress.stage = stage
+        for name, value in kwargs.items():
+            setattr(self.progress, name, value)
+        now = time.monotonic()
+        if self.callback and (changed or now - self.last_report >= self.interval):
+            self.last_report = now
+            self.callback(dataclasses.replace(self.progress))
+
+    def add(self, name: str, rows: int):
+        # rows_read 等计数增加 rows
+        self.update(**{name: getattr(self.progress, name) + rows})
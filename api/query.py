@@ -0,0 +1,171 @@
+from dataclasses import dataclass, field
+
+# 显示和分析用到的列，BytesExtra、CompressContent、BytesTrans、Reserved* 都不需要
+MESSAGE_COLUMNS = [
+    "localId",
+    "MsgSvrID",
+    "Type",
+    "SubType",
+    "IsSender",
+    "CreateTime",
+    "StrTalker",
+    "StrContent",
+]
+
+
+class MessageQuery:
+    """
+    拼接 MSG 表的查询语句，只选需要的列，参数通过占位符绑定
+    """
+
+    def __init__(self, columns: list[str] | None = None, table: str = "MSG"):
+        self.columns = columns or MESSAGE_COLUMNS
+        self.table = table
+        self.clauses: list[str] = []
+        self.params: list = []
+        self.group_by_columns: list[str] = []
+        self.order_by_columns: list[str] = []
+        self.limit_num: int | None = None
+        self.offset_num: int = 0
+
+    def where(self, clause: str, *params):
+        self.clauses.append(clause)
+        self.params.extend(params)
+        return self
+
+    def talker(self, user_id: str):
+        return self.where("StrTalker = ?", user_id)
+
+    def after_local_id(self, local_id: int):
+        return self.where("localId > ?", local_id)
+
+    def seek(self, create_time: int, local_id: int, desc=False):
+        # (CreateTime, localId) 之后（desc 时之前）的行
+        op = "<" if desc else ">"
+        return self.where(
+            f"(CreateTime {op} ? OR (CreateTime = ? AND localId {op} ?))",
+            create_time,
+            create_time,
+            local_id,
+        )
+
+    def seek_db(self, cursor, db_index: int, desc=False):
+        # 全局顺序是 (CreateTime, db_index, localId)，不同的db对 CreateTime 相同的行取舍不同
+        if cursor is None:
+            return self
+        if db_index == cursor.db_index:
+            return self.seek(cursor.create_time, cursor.local_id, desc)
+        if (db_index > cursor.db_index) != desc:
+            op = "<=" if desc else ">="
+        else:
+            op = "<" if desc else ">"
+        return self.where(f"CreateTime {op} ?", cursor.create_time)
+
+    def filter(self, message_filter: "MessageFilter | None"):
+        if message_filter is not None:
+            message_filter.apply(self)
+        return self
+
+    def group_by(self, *columns: str):
+        self.group_by_columns.extend(columns)
+        return self
+
+    def order_by(self, *columns: str, desc=False):
+        self.order_by_columns.extend(
+            f"{column} DESC" if desc else column for column in columns
+        )
+        return self
+
+    def limit(self, limit: int, offset: int = 0):
+        self.limit_num = limit
+        self.offset_num = offset
+        return self
+
+    def build(self) -> tuple[str, tuple]:
+        sql = f"SELECT {', '.join(self.columns)} FROM {self.table}"
+        params = list(self.params)
+        if self.clauses:
+            sql += " WHERE " + " AND ".join(self.clauses)
+        if self.group_by_columns:
+            sql += " GROUP BY " + ", ".join(self.group_by_columns)
+        if self.order_by_columns:
+            sql += " ORDER BY " + ", ".join(self.order_by_columns)
+        if self.limit_num is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([self.limit_num, self.offset_num])
+        return sql + ";", tuple(params)
+
+
+@dataclass(frozen=True)
+class MessageFilter:
+    """
+    声明式的消息过滤条件，Type / SubType / 发送方 / 时间转换成 SQL 条件下推到每个db，
+    exclude_kinds 是按内容分类之后才能判断的，读取后再过滤
+    """
+
+    include_types: tuple[int, ...] | None = field(default=None)
+    exclude_types: tuple[int, ...] = field(default=())
+    # (Type, SubType)
+    exclude_sub_types: tuple[tuple[int, int], ...] = field(default=())
+    is_sender: int | None = field(default=None)
+    start_time: int | None = field(default=None)
+    end_time: int | None = field(default=None)
+    exclude_kinds: tuple[str, ...] = field(default=())
+
+    def apply(self, query: MessageQuery):
+        if self.include_types is not None:
+            query.where(
+                f"Type IN ({', '.join('?' * len(self.include_types))})",
+                *self.include_types,
+            )
+        if self.exclude_types:
+            query.where(
+                f"Type NOT IN ({', '.join('?' * len(self.exclude_types))})",
+                *self.exclude_types,
+            )
+        for type_, sub_type in self.exclude_sub_types:
+            query.where("NOT (Type = ? AND SubType = ?)", type_, sub_type)
+        if self.is_sender is not None:
+            query.where("IsSender = ?", self.is_sender)
+        if self.start_time is not None:
+            query.where("CreateTime >= ?", self.start_time)
+        if self.end_time is not None:
+            query.where("CreateTime < ?", self.end_time)
+        return query
+
+
+# 分析时忽略图片、视频、表情、定位、语音通话和打招呼、撤回等系统消息
+ANALYSIS_FILTER = MessageFilter(
+    exclude_types=(3, 43, 47, 48, 50, 10000),
+    exclude_kinds=("image", "video", "emoji", "location", "voip"),
+)
+# 只要文本消息
+TEXT_FILTER = MessageFilter(include_types=(1,))
+
+
+def render_sql(sql: str, params=()) -> str:
+    """
+    把参数按 sqlite 的字面量规则填进语句，给不支持参数绑定的 RPC 使用
+    """
+    if not params:
+        return sql
+    parts = sql.split("?")
+    if len(parts) != len(params) + 1:
+        raise ValueError(f"参数数量不匹配 {sql} {params}")
+    res = [parts[0]]
+    for param, part in zip(params, parts[1:]):
+        res.append(sql_literal(param))
+        res.append(part)
+    return "".join(res)
+
+
+def sql_literal(value) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, bytes):
+        return f"X'{value.hex()}'"
+    return "'" + str(value).replace("'", "''") + "'"
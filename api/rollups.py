@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+from api.messages import localize
+
+# 由细到粗的时间粒度，值是 pandas 的 Period 频率，周从周一开始
+ROLLUPS = {
+    "day": "D",
+    "week": "W-SUN",
+    "month": "M",
+    "quarter": "Q",
+    "year": "Y",
+}
+ROLLUP_LABELS = {"day": "日", "week": "周", "month": "月", "quarter": "季度", "year": "年"}
+# 柱状图最多的柱子数，聊天记录再长，发送给界面的控件数也不超过这个
+MAX_BARS = 100
+# 折线图最多的点数
+MAX_POINTS = 120
+
+
+def rollup_counts(daily: pd.DataFrame, bucket="day") -> pd.DataFrame:
+    """
+    由按天的统计（ChatSummary.daily）汇总成按周、月、季度、年的统计，
+    index 是每个时间段开始那天的0点，只保留有消息的时间段
+    """
+    if bucket == "day" or len(daily) == 0:
+        return daily
+    tz = daily.index.tz
+    # 按本地日期分组，不受时区和夏令时影响
+    periods = daily.index.tz_localize(None).to_period(ROLLUPS[bucket])
+    res = daily.groupby(periods.start_time, sort=True).sum()
+    res.index = localize(pd.DatetimeIndex(res.index), tz)
+    return res
+
+
+def choose_rollup(daily: pd.DataFrame, max_bars=MAX_BARS) -> tuple[str, pd.DataFrame]:
+    # 选择柱子数不超过 max_bars 的最细的粒度，返回 (粒度, 统计结果)
+    for bucket in ROLLUPS:
+        counts = rollup_counts(daily, bucket)
+        if len(counts) <= max_bars:
+            return bucket, counts
+    return bucket, counts
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold=MAX_POINTS) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets 降采样，返回保留的点的下标，保留首尾两个点，
+    中间每个桶保留和前一个保留点、下一个桶的平均点组成的三角形面积最大的点，折线的形状基本不变
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # 中间 n - 2 个点分成 threshold - 2 个桶
+    edges = np.floor(np.linspace(1, n - 1, threshold - 1)).astype(np.int64)
+    res = np.zeros(threshold, dtype=np.int64)
+    res[-1] = n - 1
+    selected = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end : edges[i + 2]].mean()
+            next_y = y[end : edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs(
+            (x[selected] - next_x) * (y[start:end] - y[selected])
+            - (x[selected] - x[start:end]) * (next_y - y[selected])
+        )
+        selected = start + int(np.argmax(area))
+        res[i + 1] = selected
+    return res
@@ -0,0 +1,257 @@
+import dataclasses
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+# 两条消息相隔超过30分钟，算作两次聊天
+SESSION_GAP_SECONDS = 30 * 60
+
+
+def split_sessions(create_time: np.ndarray, gap=SESSION_GAP_SECONDS) -> np.ndarray:
+    # 每条消息属于第几次聊天，从 0 开始，和上一条消息相隔超过 gap 秒的开始新的一次
+    if len(create_time) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate([[0], np.cumsum(np.diff(create_time) > gap)])
+
+
+def build_sessions(
+    df: pd.DataFrame,
+    ids: np.ndarray,
+    words: np.ndarray | None = None,
+    token_index=None,
+    top_n=5,
+) -> pd.DataFrame:
+    """
+    df 是 MessageBatch.to_analysis_frame() 的结果，ids 是 split_sessions 的结果，
+    words 是每条消息的字数，已经算过时传入，不用再算一遍，
+    每次聊天一行：开始/结束时间、持续秒数、消息数、各自的消息数和字数、谁开始、谁结束，
+    first / last 是这次聊天在 df 中的行号，一次聊天的消息是连续的一段，
+    给出同样这些消息的 token_index 时，topics 列是每次聊天的 top_n 个话题
+    """
+    if words is None:
+        words = df["content"].str.len().to_numpy(dtype=np.int64, na_value=0)
+    frame = pd.DataFrame(
+        {
+            "session": ids,
+            "time": df.index.asi8 // 10**9,
+            "is_sender": df["is_sender"].to_numpy(dtype=bool),
+            "words": words,
+            "row": np.arange(len(df)),
+        }
+    )
+    sessions = frame.groupby("session", sort=True).agg(
+        start_time=("time", "first"),
+        end_time=("time", "last"),
+        count=("time", "size"),
+        my_count=("is_sender", "sum"),
+        words=("words", "sum"),
+        started_by_me=("is_sender", "first"),
+        ended_by_me=("is_sender", "last"),
+        first=("row", "first"),
+        last=("row", "last"),
+    )
+    sessions["duration"] = sessions["end_time"] - sessions["start_time"]
+    sessions["user_count"] = sessions["count"] - sessions["my_count"]
+    if token_index is not None:
+        sessions["topics"] = session_topics(token_index, sessions, top_n)
+    return sessions
+
+
+def get_session_topics(token_index, rows=None, top_n=5) -> list[str]:
+    # 一次聊天的消息比较少，出现两次就算
+    return token_index.top(rows, top_n=top_n, min_count=2)
+
+
+def session_topics(
+    token_index, sessions: pd.DataFrame, top_n=5, min_count=2
+) -> list[list[str]]:
+    """
+    每次聊天的话题，和 get_session_topics 的结果一致，token_index 和 build_sessions 用的是同样这些消息。
+    所有聊天一起统计 (聊天, 词) 的次数，按聊天、次数、第一次出现的位置排序后每次聊天取前 top_n 个
+    """
+    vocab_size = max(len(token_index.vocab), 1)
+    # 每个词属于第几次聊天
+    session_rows = (sessions["last"] - sessions["first"] + 1).to_numpy()
+    message_session = np.repeat(np.arange(len(sessions)), session_rows)
+    token_session = np.repeat(message_session, np.diff(token_index.offsets))
+    ids = token_index.ids
+    keep = ~token_index.get_stop_mask()[ids]
+    keys = token_session[keep].astype(np.int64) * vocab_size + ids[keep]
+    unique, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    order = np.lexsort((first, -counts, unique // vocab_size))
+    session = (unique // vocab_size)[order]
+    word = (unique % vocab_size)[order]
+    # 在这次聊天中排第几
+    starts = np.searchsorted(session, session, side="left")
+    rank = np.arange(len(session)) - starts
+    top = np.flatnonzero((rank < top_n) & (counts[order] >= min_count))
+    res = [[] for _ in range(len(sessions))]
+    for i in top.tolist():
+        res[session[i]].append(token_index.vocab[word[i]])
+    return res
+
+
+@dataclass()
+class Session:
+    """
+    一次聊天，时间都是秒级时间戳
+    """
+
+    start_time: int
+    end_time: int
+    count: int
+    my_count: int
+    words: int
+    started_by_me: bool
+    ended_by_me: bool
+    # 只保存最长的一次聊天的话题，None 表示还没有统计
+    topics: list[str] | None = field(default=None)
+
+    @property
+    def duration(self):
+        return self.end_time - self.start_time
+
+    @staticmethod
+    def from_row(row: dict):
+        return Session(
+            **{
+                name: int(row[name])
+                for name in ("start_time", "end_time", "count", "my_count", "words")
+            },
+            started_by_me=bool(row["started_by_me"]),
+            ended_by_me=bool(row["ended_by_me"]),
+        )
+
+    def join(self, other: "Session") -> "Session":
+        # other 紧接着 self，是同一次聊天
+        return Session(
+            start_time=self.start_time,
+            end_time=other.end_time,
+            count=self.count + other.count,
+            my_count=self.my_count + other.my_count,
+            words=self.words + other.words,
+            started_by_me=self.started_by_me,
+            ended_by_me=other.ended_by_me,
+        )
+
+    def is_longer(self, other: "Session") -> bool:
+        # 按消息数比较，相同时按持续时间，再相同时先开始的算长
+        return (self.count, self.duration, -self.start_time) > (
+            other.count,
+            other.duration,
+            -other.start_time,
+        )
+
+
+@dataclass()
+class SessionStats:
+    """
+    所有聊天的汇总，由 build_sessions 的结果做几次整列的求和得到。
+    保存第一次和最后一次聊天，和之后新消息的统计结果合并时，
+    如果新消息接着最后一次聊天，两边的这两次聊天合并成一次
+    """
+
+    gap: int
+    sessions: int
+    my_started: int
+    my_ended: int
+    messages: int
+    seconds: int
+    first: Session
+    last: Session
+    longest: Session
+
+    @property
+    def user_started(self):
+        return self.sessions - self.my_started
+
+    @property
+    def user_ended(self):
+        return self.sessions - self.my_ended
+
+    @property
+    def mean_count(self) -> float:
+        return self.messages / self.sessions
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.seconds / self.sessions
+
+    @staticmethod
+    def build(sessions: pd.DataFrame, gap=SESSION_GAP_SECONDS):
+        # sessions 是 build_sessions 的结果，有 topics 列时记下最长一次聊天的话题
+        longest_index = int(
+            np.lexsort(
+                (
+                    sessions["start_time"].to_numpy(),
+                    -sessions["duration"].to_numpy(),
+                    -sessions["count"].to_numpy(),
+                )
+            )[0]
+        )
+        rows = sessions.iloc[[0, -1, longest_index]].to_dict("records")
+        first, last, longest = (Session.from_row(row) for row in rows)
+        if "topics" in sessions:
+            longest.topics = sessions["topics"].iloc[longest_index]
+        return SessionStats(
+            gap=gap,
+            sessions=len(sessions),
+            my_started=int(sessions["started_by_me"].sum()),
+            my_ended=int(sessions["ended_by_me"].sum()),
+            messages=int(sessions["count"].sum()),
+            seconds=int(sessions["duration"].sum()),
+            first=first,
+            last=last,
+            longest=longest,
+        )
+
+    def merge(self, other: "SessionStats") -> "SessionStats":
+        # other 是之后新消息的统计结果
+        if other.first.start_time - self.last.end_time > self.gap:
+            longest = other.longest if other.longest.is_longer(self.longest) else self.longest
+            return SessionStats(
+                gap=self.gap,
+                sessions=self.sessions + other.sessions,
+                my_started=self.my_started + other.my_started,
+                my_ended=self.my_ended + other.my_ended,
+                messages=self.messages + other.messages,
+                seconds=self.seconds + other.seconds,
+                first=self.first,
+                last=other.last,
+                longest=longest,
+            )
+        # 最后一次聊天和新消息的第一次聊天是同一次，话题要重新统计
+        joined = self.last.join(other.first)
+        longest = self.longest if self.longest.is_longer(other.longest) else other.longest
+        if joined.is_longer(longest):
+            longest = joined
+        return SessionStats(
+            gap=self.gap,
+            sessions=self.sessions + other.sessions - 1,
+            my_started=self.my_started + other.my_started - other.first.started_by_me,
+            my_ended=self.my_ended + other.my_ended - self.last.ended_by_me,
+            messages=self.messages + other.messages,
+            seconds=self.seconds
+            + other.seconds
+            - self.last.duration
+            - other.first.duration
+            + joined.duration,
+            first=joined if self.sessions == 1 else self.first,
+            last=joined if other.sessions == 1 else other.last,
+            longest=longest,
+        )
+
+    def to_dict(self) -> dict:
+        return dataclasses.asdict(self)
+
+    @staticmethod
+    def from_dict(data: dict):
+        return SessionStats(
+            **{
+                **data,
+                "first": Session(**data["first"]),
+                "last": Session(**data["last"]),
+                "longest": Session(**data["longest"]),
+            }
+        )
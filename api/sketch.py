@@ -0,0 +1,126 @@
+import math
+
+import numpy as np
+
+# 估算每个词占用的字节数：字典中的键、计数、误差
+ENTRY_BYTES = 200
+
+
+def get_capacity(
+    capacity: int | None = None,
+    epsilon: float | None = None,
+    max_bytes: int | None = None,
+) -> int | None:
+    """
+    SpaceSaving 的容量：capacity 是最多保存的词数，epsilon 是相对总词数的误差上限，
+    max_bytes 是内存上限，同时给出时取最小的容量，都没有给出时返回 None，精确统计
+    """
+    res = []
+    if capacity is not None:
+        res.append(capacity)
+    if epsilon is not None:
+        res.append(math.ceil(1 / epsilon))
+    if max_bytes is not None:
+        res.append(max(1, max_bytes // ENTRY_BYTES))
+    return min(res) if res else None
+
+
+class SpaceSaving:
+    """
+    SpaceSaving 高频词统计，最多保存 capacity 个词，内存固定。
+    保存的计数不小于真实次数，多出的部分不超过 error，error 不超过 total / capacity，
+    不同块、不同进程的统计结果可以合并
+    """
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        # 按第一次出现的顺序保存，次数相同时先出现的在前
+        self.counts: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self.total = 0
+
+    @staticmethod
+    def from_counts(words: list[str], counts, capacity=10000):
+        # 一块数据的精确计数，没有误差
+        sketch = SpaceSaving(capacity)
+        sketch.update(words, counts)
+        return sketch
+
+    def __len__(self):
+        return len(self.counts)
+
+    def min_count(self):
+        # 没有保存的词，真实次数不超过这个值；没有装满时没有被淘汰的词，是 0
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def update(self, words: list[str], counts):
+        # 合并一批精确计数，这一批不会淘汰任何词；容量不小于自己的容量，合并后仍保留 capacity 个词
+        exact = SpaceSaving(max(self.capacity, len(words) + 1))
+        for word, count in zip(words, np.asarray(counts).tolist()):
+            if count > 0:
+                exact.counts[word] = exact.counts.get(word, 0) + count
+                exact.errors[word] = 0
+                exact.total += count
+        merged = self.merge(exact)
+        self.counts, self.errors, self.total = merged.counts, merged.errors, merged.total
+        return self
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        # 某一边没有保存的词按那一边的最小计数估计，合并后保留计数最大的 capacity 个，
+        # capacity 取两边中较小的
+        words = list(dict.fromkeys([*self.counts, *other.counts]))
+        self_min = self.min_count()
+        other_min = other.min_count()
+        counts = np.fromiter(
+            (
+                self.counts.get(word, self_min) + other.counts.get(word, other_min)
+                for word in words
+            ),
+            dtype=np.int64,
+            count=len(words),
+        )
+        errors = np.fromiter(
+            (
+                self.errors.get(word, self_min) + other.errors.get(word, other_min)
+                for word in words
+            ),
+            dtype=np.int64,
+            count=len(words),
+        )
+        capacity = min(self.capacity, other.capacity)
+        keep = np.arange(len(words))
+        if len(words) > capacity:
+            keep = np.sort(np.argsort(-counts, kind="stable")[:capacity])
+        res = SpaceSaving(capacity)
+        res.counts = {words[i]: int(counts[i]) for i in keep}
+        res.errors = {words[i]: int(errors[i]) for i in keep}
+        res.total = self.total + other.total
+        return res
+
+    def max_error(self) -> int:
+        return max(self.errors.values(), default=0)
+
+    def top(self, top_n=10, min_count=3) -> list[str]:
+        words = list(self.counts)
+        counts = np.fromiter(self.counts.values(), dtype=np.int64, count=len(words))
+        order = np.argsort(-counts, kind="stable")[:top_n]
+        return [words[i] for i in order if counts[i] >= min_count]
+
+    def to_dict(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "total": self.total,
+            "words": list(self.counts),
+            "counts": list(self.counts.values()),
+            "errors": list(self.errors.values()),
+        }
+
+    @staticmethod
+    def from_dict(data: dict):
+        sketch = SpaceSaving(data["capacity"])
+        sketch.counts = dict(zip(data["words"], data["counts"]))
+        sketch.errors = dict(zip(data["words"], data["errors"]))
+        sketch.total = data["total"]
+        return sketch
@@ -0,0 +1,179 @@
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from api.query import render_sql
+
+
+class MessageSource(ABC):
+    """
+    聊天记录数据源，WeChatAPI 的所有读取都通过这里。
+    查询出错时直接抛出异常，不能返回空列表，否则分批读取会当作已经读完
+    """
+
+    @abstractmethod
+    def get_self_wxid(self) -> str:
+        ...
+
+    @abstractmethod
+    def get_friends(self) -> list:
+        ...
+
+    @abstractmethod
+    def get_dbs(self) -> list:
+        ...
+
+    @abstractmethod
+    def get_info_by_wxid(self, wxid: str) -> dict:
+        ...
+
+    @abstractmethod
+    def query_sql(self, db: str, sql: str, params=()) -> list:
+        ...
+
+    def close(self):
+        pass
+
+
+class WcfMessageSource(MessageSource):
+    """
+    通过 WeChatFerry 的 RPC 读取，需要登录中的微信客户端
+    """
+
+    def __init__(self, debug=False, block=True):
+        from wcferry import Wcf
+
+        self.wcf = Wcf(debug=debug, block=block)
+        # 同一个 RPC 连接不能同时收发，多线程查询时要排队
+        self.lock = threading.Lock()
+
+    def get_self_wxid(self):
+        return self.wcf.get_self_wxid()
+
+    def get_friends(self):
+        return self.wcf.get_friends()
+
+    def get_dbs(self):
+        return self.wcf.get_dbs()
+
+    def get_info_by_wxid(self, wxid):
+        return self.wcf.get_info_by_wxid(wxid)
+
+    def query_sql(self, db, sql, params=()):
+        # RPC 不支持参数绑定，按字面量规则转义后填入
+        sql = render_sql(sql, params)
+        with self.lock:
+            return self.wcf.query_sql(db, sql)
+
+    def close(self):
+        self.wcf.cleanup()
+
+
+# 和 wcferry 的 get_friends 保持一致，这些不算好友
+NOT_FRIENDS = {
+    "fmessage": "朋友推荐消息",
+    "medianote": "语音记事本",
+    "floatbottle": "漂流瓶",
+    "filehelper": "文件传输助手",
+    "newsapp": "新闻",
+}
+
+
+class SqliteMessageSource(MessageSource):
+    """
+    直接用 sqlite3 打开已经解密的 MSG0..N.db / MicroMsg.db，只读、immutable 模式，
+    不需要微信客户端，可以在 Linux 上运行
+    """
+
+    def __init__(self, db_dir, my_id: str | None = None):
+        self.db_dir = Path(db_dir)
+        if not self.db_dir.is_dir():
+            raise FileNotFoundError(f"数据库目录不存在 {self.db_dir}")
+        self.my_id = my_id
+        self.connections: dict[str, sqlite3.Connection] = {}
+        self.lock = threading.Lock()
+
+    def connect(self, db: str) -> sqlite3.Connection:
+        with self.lock:
+            if db not in self.connections:
+                path = self.db_dir.joinpath(db)
+                if not path.exists():
+                    raise FileNotFoundError(f"数据库文件不存在 {path}")
+                # immutable=1 时 sqlite 不加锁、不检查文件变化，适合读取解密后的副本
+                conn = sqlite3.connect(
+                    f"{path.as_uri()}?mode=ro&immutable=1",
+                    uri=True,
+                    check_same_thread=False,
+                )
+                conn.row_factory = sqlite3.Row
+                self.connections[db] = conn
+            return self.connections[db]
+
+    def get_self_wxid(self):
+        if self.my_id:
+            return self.my_id
+        # 没有指定时，尝试从 WeChat Files/wxid_xxx/Msg/Multi 这样的路径中推断
+        for part in reversed(self.db_dir.parts):
+            if part.startswith("wxid_"):
+                self.my_id = part
+                return part
+        raise ValueError("无法推断账号id，请指定 my_id")
+
+    def get_friends(self):
+        res = []
+        for contact in self.query_sql(
+            "MicroMsg.db", "SELECT UserName, Alias, Remark, NickName FROM Contact;"
+        ):
+            wxid = contact["UserName"]
+            if (
+                wxid.endswith("@chatroom")
+                or wxid.startswith("gh_")
+                or wxid in NOT_FRIENDS
+            ):
+                continue
+            res.append(self.format_contact(contact))
+        return res
+
+    def get_dbs(self):
+        return sorted(
+            p.name
+            for p in self.db_dir.iterdir()
+            if p.is_file() and re.fullmatch(r"\w+\.db", p.name)
+        )
+
+    def get_info_by_wxid(self, wxid):
+        res = self.query_sql(
+            "MicroMsg.db",
+            "SELECT UserName, Alias, Remark, NickName FROM Contact WHERE UserName = ?;",
+            (wxid,),
+        )
+        if not res:
+            return self.format_contact({"UserName": wxid})
+        return self.format_contact(res[0])
+
+    def query_sql(self, db, sql, params=()):
+        cursor = self.connect(db).execute(sql, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections.values():
+                conn.close()
+            self.connections.clear()
+
+    @staticmethod
+    def format_contact(contact: dict):
+        # 解密后的库里没有地区、性别这些字段的明文，保持和 wcferry 一样的字典结构
+        return {
+            "wxid": contact.get("UserName"),
+            "code": contact.get("Alias") or "",
+            "remark": contact.get("Remark") or "",
+            "name": contact.get("NickName") or "",
+            "country": "",
+            "province": "",
+            "city": "",
+            "gender": "",
+            "avatar": "",
+        }
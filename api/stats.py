@@ -0,0 +1,130 @@
+import logging
+from dataclasses import dataclass, field
+
+from api.query import MessageQuery
+
+# 每个好友在一个db中的统计
+STATS_COLUMNS = [
+    "COUNT(*) AS count",
+    "SUM(IsSender) AS my_count",
+    "MIN(CreateTime) AS first_time",
+    "MAX(CreateTime) AS last_time",
+]
+
+
+@dataclass()
+class TalkerStats:
+    talker: str
+    count: int = field(default=0)
+    my_count: int = field(default=0)
+    first_time: int | None = field(default=None)
+    last_time: int | None = field(default=None)
+    # 每个db中的消息数
+    db_lines: dict = field(default_factory=dict)
+
+    @property
+    def user_count(self):
+        return self.count - self.my_count
+
+    def add(self, db_name: str, row: dict):
+        self.count += row["count"]
+        self.my_count += row["my_count"] or 0
+        self.db_lines[db_name] = self.db_lines.get(db_name, 0) + row["count"]
+        if row["first_time"] is not None:
+            self.first_time = (
+                row["first_time"]
+                if self.first_time is None
+                else min(self.first_time, row["first_time"])
+            )
+        if row["last_time"] is not None:
+            self.last_time = (
+                row["last_time"]
+                if self.last_time is None
+                else max(self.last_time, row["last_time"])
+            )
+
+
+class TalkerStatsIndex:
+    """
+    连接时每个db扫描一次，之后的消息数、排名、占比都直接查表。
+    连接之后还会收到新消息，同步、分析一个好友之前用 refresh 重新统计这个好友
+    """
+
+    def __init__(self):
+        self.stats: dict[str, TalkerStats] = {}
+        self.ranks: dict[str, int] = {}
+        self.ranked: list[TalkerStats] = []
+        self.total = 0
+
+    def build(self, source, db_files: list, executor=None):
+        query = MessageQuery(["StrTalker", *STATS_COLUMNS]).group_by("StrTalker")
+        stats = {}
+        for db_name, res in zip(db_files, self.query(source, db_files, query, executor)):
+            for row in res or []:
+                talker = row["StrTalker"]
+                if talker not in stats:
+                    stats[talker] = TalkerStats(talker)
+                stats[talker].add(db_name, row)
+        self.stats = stats
+        self.build_ranks()
+        logging.info(f"talker stats built, {len(self.stats)} talkers")
+        return self
+
+    def refresh(self, source, db_files: list, talker: str, executor=None):
+        # 重新统计一个好友，返回新的统计，没有消息时返回 None
+        query = MessageQuery(STATS_COLUMNS).talker(talker)
+        stats = TalkerStats(talker)
+        for db_name, res in zip(db_files, self.query(source, db_files, query, executor)):
+            for row in res or []:
+                stats.add(db_name, row)
+        if stats.count:
+            self.stats[talker] = stats
+        else:
+            self.stats.pop(talker, None)
+        self.build_ranks()
+        return self.stats.get(talker)
+
+    @staticmethod
+    def query(source, db_files: list, query: MessageQuery, executor=None) -> list:
+        # 每个db的查询结果，有线程池时同时查询
+        sql, params = query.build()
+        if executor is not None:
+            return list(executor.map(lambda db: source.query_sql(db, sql, params), db_files))
+        return [source.query_sql(db, sql, params) for db in db_files]
+
+    def build_ranks(self):
+        # 排名不包含群聊，消息数相同的排名相同，算完再替换，其他线程不会读到一半的结果
+        ranked = sorted(
+            (v for k, v in list(self.stats.items()) if not k.endswith("@chatroom")),
+            key=lambda v: v.count,
+            reverse=True,
+        )
+        ranks = {}
+        for index, stats in enumerate(ranked):
+            if index > 0 and stats.count == ranked[index - 1].count:
+                ranks[stats.talker] = ranks[ranked[index - 1].talker]
+            else:
+                ranks[stats.talker] = index + 1
+        self.ranked, self.ranks = ranked, ranks
+        self.total = sum(v.count for v in ranked)
+
+    def get(self, talker: str) -> TalkerStats | None:
+        return self.stats.get(talker)
+
+    def db_lines(self, talker: str, db_files: list) -> dict:
+        stats = self.stats.get(talker)
+        return {
+            db_name: stats.db_lines.get(db_name, 0) if stats else 0
+            for db_name in db_files
+        }
+
+    def rank(self, talker: str) -> int | None:
+        return self.ranks.get(talker)
+
+    def percent(self, talker: str) -> float | None:
+        if talker not in self.ranks or not self.total:
+            return None
+        return self.stats[talker].count / self.total
+
+    def top(self, n=10) -> list[TalkerStats]:
+        return self.ranked[:n]
@@ -1,4 +1,10 @@
-stop_words = """$
+import logging
+import re
+from pathlib import Path
+
+import numpy as np
+
+STOP_WORDS_TEXT = """$
 0
 1
 2
@@ -784,8 +790,105 @@ voiceformat
 呲
 牙
 坏
-？""".split(
-    "\n"
+？"""
+
+# 只查一次哈希表，不再逐个比较列表
+stop_words = frozenset(
+    word.strip() for word in STOP_WORDS_TEXT.split("\n") if word.strip()
 )
 
-stop_words.append("\n")
+# 单个字的词 (x、见、好) 大多是语气词或分词的碎片，默认过滤掉，设为 1 保留单字
+MIN_WORD_LENGTH = 2
+
+# 纯数字、纯标点符号、空白
+JUNK_PATTERN = re.compile(r"^(?:\d+|[\W_]+)?$")
+
+# MAIN_PATH/dict 下的自定义词典，一行一个词，
+# user_dict.txt 是 jieba 的格式：词 [词频] [词性]
+DICT_DIR = "dict"
+STOP_WORDS_FILE = "stop_words.txt"
+USER_DICT_FILE = "user_dict.txt"
+
+
+def get_dict_path(name: str) -> Path:
+    from api.paths import MAIN_PATH
+
+    return MAIN_PATH.joinpath(DICT_DIR, name)
+
+
+def read_words(path) -> set[str]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return {line.strip() for line in f if line.strip()}
+    except OSError as e:
+        logging.warning(f"read stop words err {path} {e}")
+        return set()
+
+
+class StopWordFilter:
+    """
+    停用词过滤，停用词、自定义停用词文件和长度/正则规则在创建时一次性编译，
+    按词表生成掩码，每个不同的词只判断一次，
+    短于 min_length 个字的词也算停用词，默认 MIN_WORD_LENGTH 过滤单字
+    """
+
+    def __init__(
+        self,
+        words=stop_words,
+        files=(),
+        min_length=MIN_WORD_LENGTH,
+        junk_pattern: re.Pattern | None = JUNK_PATTERN,
+    ):
+        extra = set()
+        for path in files:
+            extra |= read_words(path)
+        self.words = frozenset(words) | extra
+        self.min_length = min_length
+        self.junk_pattern = junk_pattern
+
+    def __contains__(self, word: str):
+        return (
+            word in self.words
+            or len(word) < self.min_length
+            or (self.junk_pattern is not None and self.junk_pattern.match(word) is not None)
+        )
+
+    def mask(self, vocab: list[str]) -> np.ndarray:
+        # vocab 中每个词是否需要过滤
+        return np.fromiter(
+            (word in self for word in vocab), dtype=bool, count=len(vocab)
+        )
+
+
+default_filter: StopWordFilter | None = None
+
+
+def get_stop_word_filter() -> StopWordFilter:
+    # 默认的过滤器，带上 dict/stop_words.txt
+    global default_filter
+    if default_filter is None:
+        path = get_dict_path(STOP_WORDS_FILE)
+        default_filter = StopWordFilter(files=[path] if path.exists() else [])
+    return default_filter
+
+
+loaded_user_dicts: set[str] = set()
+
+
+def get_user_dict_paths() -> list[str]:
+    path = get_dict_path(USER_DICT_FILE)
+    return [str(path)] if path.exists() else []
+
+
+def load_user_dict(paths: list[str]):
+    # 给 jieba 加载自定义词典，同一个文件只加载一次，分词的子进程也要调用
+    import jieba
+
+    for path in paths:
+        if path in loaded_user_dicts:
+            continue
+        try:
+            jieba.load_userdict(path)
+            loaded_user_dicts.add(path)
+        except Exception as e:
+            logging.warning(f"load user dict err {path} {e}")
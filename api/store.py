@@ -0,0 +1,198 @@
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+
+from api.query import MESSAGE_COLUMNS, MessageFilter, MessageQuery
+
+# 分析用到的列，其余列不落盘
+STORE_COLUMNS = ["db_index", *MESSAGE_COLUMNS]
+
+
+class MessageStore:
+    """
+    按账号保存在本地的聊天记录，记录每个好友在每个db中已经同步到的位置，
+    再次分析时只拉取新增的消息；ANALYSIS 保存每个好友可以合并的统计结果
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.RLock()
+        with self.lock:
+            self.conn.executescript(
+                """
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                CREATE TABLE IF NOT EXISTS MSG (
+                    db_index INTEGER NOT NULL,
+                    localId INTEGER NOT NULL,
+                    MsgSvrID INTEGER,
+                    Type INTEGER,
+                    SubType INTEGER,
+                    IsSender INTEGER,
+                    CreateTime INTEGER,
+                    StrTalker TEXT,
+                    StrContent TEXT,
+                    PRIMARY KEY (db_index, localId)
+                );
+                CREATE INDEX IF NOT EXISTS MSG_TALKER_TIME
+                    ON MSG (StrTalker, CreateTime, db_index, localId);
+                CREATE TABLE IF NOT EXISTS SYNC_STATE (
+                    StrTalker TEXT NOT NULL,
+                    db_index INTEGER NOT NULL,
+                    max_local_id INTEGER NOT NULL,
+                    max_create_time INTEGER NOT NULL,
+                    line_count INTEGER NOT NULL,
+                    PRIMARY KEY (StrTalker, db_index)
+                );
+                CREATE TABLE IF NOT EXISTS ANALYSIS (
+                    StrTalker TEXT NOT NULL,
+                    analysis_key TEXT NOT NULL,
+                    covered_lines INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (StrTalker, analysis_key)
+                );
+                """
+            )
+
+    def get_sync_state(self, user_id: str) -> dict[int, sqlite3.Row]:
+        with self.lock:
+            res = self.conn.execute(
+                "SELECT * FROM SYNC_STATE WHERE StrTalker = ?;", (user_id,)
+            ).fetchall()
+        return {row["db_index"]: row for row in res}
+
+    def sync(self, cache_messages, batch_size=5000, progress=None):
+        """
+        每个db从记录的最大 localId 之后增量拉取，第一次查询就是有没有新消息的检查，不依赖消息数。
+        消息数（调用方在同步前刷新过）只用来发现删除：本地的行数比原库多时这个db重新同步，
+        删了旧消息又收到新消息、总数不变时，拉取新消息之后本地的行数会多出来，同样重新同步。
+        每批提交一次，progress(行数) 在每批之后调用，抛出异常时已经提交的部分下次不用再同步
+        """
+        user_id = cache_messages.user_id
+        cache_messages.count_lines()
+        state = self.get_sync_state(user_id)
+        new_lines = 0
+        for db_index, db_name in enumerate(cache_messages.db_files):
+            db_lines = cache_messages.db_lines[db_name]
+            old = state.get(db_index)
+            if old is not None and old["line_count"] > db_lines:
+                # 原库中有消息被删除了，这个db重新同步
+                self.reset(user_id, db_index)
+                old = None
+            lines, line_count = self.sync_db(
+                cache_messages, db_index, old, batch_size, progress
+            )
+            new_lines += lines
+            if line_count > db_lines:
+                self.reset(user_id, db_index)
+                lines, _ = self.sync_db(cache_messages, db_index, None, batch_size, progress)
+                new_lines += lines
+        if new_lines:
+            logging.info(f"message store sync {user_id} {new_lines} new lines")
+        return new_lines
+
+    def sync_db(self, cache_messages, db_index: int, old, batch_size=5000, progress=None):
+        # 拉取一个db中 old 记录的位置之后的消息，返回 (新增的行数, 本地的行数)
+        user_id = cache_messages.user_id
+        max_local_id = old["max_local_id"] if old else 0
+        max_create_time = old["max_create_time"] if old else 0
+        line_count = old["line_count"] if old else 0
+        new_lines = 0
+        for rows in cache_messages.iter_db_rows(
+            db_index, after_local_id=max_local_id, batch_size=batch_size
+        ):
+            with self.lock, self.conn:
+                self.conn.executemany(
+                    f"INSERT OR REPLACE INTO MSG ({', '.join(STORE_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(STORE_COLUMNS))});",
+                    [tuple(row.get(c) for c in STORE_COLUMNS) for row in rows],
+                )
+                max_local_id = rows[-1]["localId"]
+                max_create_time = max(
+                    max_create_time, max(row["CreateTime"] for row in rows)
+                )
+                line_count += len(rows)
+                new_lines += len(rows)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO SYNC_STATE VALUES (?, ?, ?, ?, ?);",
+                    (user_id, db_index, max_local_id, max_create_time, line_count),
+                )
+            if progress:
+                progress(len(rows))
+        return new_lines, line_count
+
+    def reset(self, user_id: str, db_index: int):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM MSG WHERE StrTalker = ? AND db_index = ?;",
+                (user_id, db_index),
+            )
+            self.conn.execute(
+                "DELETE FROM SYNC_STATE WHERE StrTalker = ? AND db_index = ?;",
+                (user_id, db_index),
+            )
+
+    def iter_rows(
+        self,
+        user_id: str,
+        batch_size=5000,
+        message_filter: MessageFilter | None = None,
+        after: tuple[int, int, int] | None = None,
+    ):
+        # 按 (CreateTime, db_index, localId) 分批定位读取，和 CacheMessages 的顺序一致，
+        # after 是已经读过的最后一行
+        last = after
+        while True:
+            query = MessageQuery(STORE_COLUMNS).talker(user_id).filter(message_filter)
+            if last is not None:
+                query.where("(CreateTime, db_index, localId) > (?, ?, ?)", *last)
+            sql, params = (
+                query.order_by("CreateTime", "db_index", "localId")
+                .limit(batch_size)
+                .build()
+            )
+            with self.lock:
+                res = [dict(row) for row in self.conn.execute(sql, params)]
+            if not res:
+                return
+            yield res
+            if len(res) < batch_size:
+                return
+            last = (res[-1]["CreateTime"], res[-1]["db_index"], res[-1]["localId"])
+
+    def count_rows(self, user_id: str, until: tuple[int, int, int]) -> int:
+        # (CreateTime, db_index, localId) 不超过 until 的消息数，用来判断之前的统计是否还有效
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM MSG WHERE StrTalker = ? "
+                "AND (CreateTime, db_index, localId) <= (?, ?, ?);",
+                (user_id, *until),
+            ).fetchone()[0]
+
+    def load_analysis(self, user_id: str, analysis_key: str):
+        # 返回 (covered_lines, data)，没有时返回 None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT covered_lines, data FROM ANALYSIS "
+                "WHERE StrTalker = ? AND analysis_key = ?;",
+                (user_id, analysis_key),
+            ).fetchone()
+        if row is None:
+            return None
+        return row["covered_lines"], json.loads(row["data"])
+
+    def save_analysis(self, user_id: str, analysis_key: str, covered_lines: int, data: dict):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ANALYSIS VALUES (?, ?, ?, ?);",
+                (user_id, analysis_key, covered_lines, json.dumps(data, ensure_ascii=False)),
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
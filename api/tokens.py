@@ -0,0 +1,302 @@
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import jieba
+import numpy as np
+
+from api.progress import AnalysisCancelled, ProgressReporter
+from api.sketch import SpaceSaving
+from api.stop_words import (
+    StopWordFilter,
+    get_stop_word_filter,
+    get_user_dict_paths,
+    load_user_dict,
+)
+
+
+def tokenize(contents) -> list[list[str]]:
+    # 每条消息单独分词
+    return [jieba.lcut(content) for content in contents]
+
+
+# jieba 词典的缓存文件，放在 MAIN_PATH/cache 下，系统临时目录被清理后也不用重新构建
+JIEBA_CACHE_FILE = "jieba.cache"
+
+
+def get_jieba_cache_dir() -> str:
+    from api.paths import MAIN_PATH
+
+    return str(MAIN_PATH.joinpath("cache"))
+
+
+def init_jieba(cache_dir: str | None = None, user_dicts: list[str] | None = None):
+    # 加载 jieba 词典和自定义词典，已经加载过时直接返回
+    if not jieba.dt.initialized:
+        cache_dir = cache_dir or get_jieba_cache_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+        jieba.dt.tmp_dir = cache_dir
+        jieba.dt.cache_file = JIEBA_CACHE_FILE
+        jieba.initialize()
+    load_user_dict(get_user_dict_paths() if user_dicts is None else user_dicts)
+
+
+# 子进程中统计高频词时用的停用词，和主进程的一致
+worker_stop_filter: StopWordFilter | None = None
+
+
+def init_worker(cache_dir: str, user_dicts: list[str], stop_filter: StopWordFilter):
+    # 子进程启动时加载一次词典
+    global worker_stop_filter
+    init_jieba(cache_dir, user_dicts)
+    worker_stop_filter = stop_filter
+
+
+def tokenize_chunk(contents: list[str], topic_capacity: int | None = None):
+    # 在子进程中执行，返回按块编号的 TokenIndex，传回的只是几个数组；
+    # 给出 topic_capacity 时同时统计这一块的 SpaceSaving，由主进程合并
+    index = TokenIndex.build(contents)
+    if topic_capacity is not None:
+        index.build_sketch(topic_capacity, worker_stop_filter)
+    return index
+
+
+class TokenIndex:
+    """
+    每条消息只分词一次，按 CSR 方式存储：第 i 条消息的词是 ids[offsets[i]:offsets[i + 1]]，
+    词按第一次出现的顺序编号，各种话题统计都是对其中一段做 bincount
+    """
+
+    def __init__(self, vocab: list[str], ids: np.ndarray, offsets: np.ndarray):
+        self.vocab = vocab
+        self.ids = ids
+        self.offsets = offsets
+        # 默认用 get_stop_word_filter()
+        self.stop_filter: StopWordFilter | None = None
+        self.stop_mask: np.ndarray | None = None
+        # 这些消息去掉停用词后的 SpaceSaving，由 build_sketch 统计，合并时各块的也合并
+        self.sketch: SpaceSaving | None = None
+
+    @staticmethod
+    def build(contents, tokenizer=tokenize):
+        return TokenIndex.from_tokens(tokenizer(contents))
+
+    @staticmethod
+    def from_tokens(tokens: list[list[str]]):
+        word_ids: dict[str, int] = {}
+        ids = np.fromiter(
+            (word_ids.setdefault(word, len(word_ids)) for words in tokens for word in words),
+            dtype=np.int32,
+        )
+        offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum([len(words) for words in tokens], out=offsets[1:])
+        return TokenIndex(list(word_ids), ids, offsets)
+
+    @staticmethod
+    def concat(indexes: list["TokenIndex"]):
+        # 按顺序合并各块，词的编号换成全局编号，仍然是第一次出现的顺序
+        word_ids: dict[str, int] = {}
+        ids = []
+        offsets = [np.zeros(1, dtype=np.int64)]
+        for index in indexes:
+            remap = np.fromiter(
+                (word_ids.setdefault(word, len(word_ids)) for word in index.vocab),
+                dtype=np.int32,
+                count=len(index.vocab),
+            )
+            ids.append(remap[index.ids])
+            offsets.append(index.offsets[1:] + offsets[-1][-1])
+        res = TokenIndex(
+            list(word_ids),
+            np.concatenate(ids) if ids else np.zeros(0, dtype=np.int32),
+            np.concatenate(offsets),
+        )
+        sketches = [index.sketch for index in indexes]
+        if sketches and None not in sketches:
+            res.sketch = functools.reduce(SpaceSaving.merge, sketches)
+        return res
+
+    def __len__(self):
+        # 消息条数
+        return len(self.offsets) - 1
+
+    def select(self, rows=None) -> np.ndarray:
+        # rows 可以是 None（全部）、连续的 slice 或者按消息的布尔掩码
+        if rows is None:
+            return self.ids
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(len(self))
+            if step == 1:
+                return self.ids[self.offsets[start] : self.offsets[max(start, stop)]]
+            mask = np.zeros(len(self), dtype=bool)
+            mask[rows] = True
+            rows = mask
+        rows = np.asarray(rows, dtype=bool)
+        return self.ids[np.repeat(rows, np.diff(self.offsets))]
+
+    def counts(self, rows=None) -> np.ndarray:
+        # 每个词在选中消息里出现的次数，下标是词的编号
+        return np.bincount(self.select(rows), minlength=len(self.vocab))
+
+    def get_stop_mask(self) -> np.ndarray:
+        # 每个不同的词只判断一次
+        if self.stop_mask is None:
+            stop_filter = self.stop_filter or get_stop_word_filter()
+            self.stop_mask = stop_filter.mask(self.vocab)
+        return self.stop_mask
+
+    def build_sketch(
+        self, capacity: int, stop_filter: StopWordFilter | None = None
+    ) -> SpaceSaving:
+        # 停用词不占用位置
+        stop_mask = (
+            stop_filter.mask(self.vocab) if stop_filter is not None else self.get_stop_mask()
+        )
+        keep = np.flatnonzero(~stop_mask)
+        self.sketch = SpaceSaving.from_counts(
+            [self.vocab[i] for i in keep], self.counts()[keep], capacity
+        )
+        return self.sketch
+
+    def top(self, rows=None, top_n=10, min_count=3) -> list[str]:
+        # 出现次数最多的词，次数相同时先出现的在前，和 Counter.most_common 一致
+        ids = self.select(rows)
+        ids = ids[~self.get_stop_mask()[ids]]
+        if len(ids) == 0:
+            return []
+        unique, first, counts = np.unique(ids, return_index=True, return_counts=True)
+        order = np.lexsort((first, -counts))[:top_n]
+        return [self.vocab[unique[i]] for i in order if counts[i] >= min_count]
+
+
+class ParallelTokenizer:
+    """
+    把消息按字数切成块，用多进程并行分词，每个进程只加载一次词典，
+    内容较少或只有一个进程时直接在当前进程分词
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        chunk_chars=200_000,
+        min_chars=500_000,
+        user_dicts: list[str] | None = None,
+        serial_chunk_chars=20_000,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        # jieba 自定义词典，默认是 dict/user_dict.txt
+        self.user_dicts = user_dicts
+        self.chunk_chars = chunk_chars
+        self.min_chars = min_chars
+        # 在当前进程分词并且需要报告进度时，每块的字数，一块几十毫秒，取消时不用等太久
+        self.serial_chunk_chars = serial_chunk_chars
+        self.executor: ProcessPoolExecutor | None = None
+        # 批量分析时多个线程共用
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=init_worker,
+                    initargs=(
+                        get_jieba_cache_dir(),
+                        self.get_user_dicts(),
+                        get_stop_word_filter(),
+                    ),
+                )
+            return self.executor
+
+    def get_user_dicts(self):
+        if self.user_dicts is None:
+            self.user_dicts = get_user_dict_paths()
+        return self.user_dicts
+
+    def chunks(self, contents: list[str], chunk_chars: int | None = None):
+        chunk_chars = chunk_chars or self.chunk_chars
+        chunk = []
+        chars = 0
+        for content in contents:
+            chunk.append(content)
+            chars += len(content)
+            if chars >= chunk_chars:
+                yield chunk
+                chunk = []
+                chars = 0
+        if chunk:
+            yield chunk
+
+    def build_index(
+        self,
+        contents: list[str],
+        progress: ProgressReporter | None = None,
+        topic_capacity: int | None = None,
+    ) -> TokenIndex:
+        """
+        progress 不为 None 时每完成一块报告 rows_tokenized，取消时抛出 AnalysisCancelled，
+        给出 topic_capacity 时每块分别统计 SpaceSaving，合并后是结果的 sketch
+        """
+        init_jieba(user_dicts=self.get_user_dicts())
+        if self.workers <= 1 or sum(map(len, contents)) < self.min_chars:
+            return self.build_serial(contents, progress, topic_capacity)
+        try:
+            return self.build_parallel(contents, progress, topic_capacity)
+        except AnalysisCancelled:
+            raise
+        except Exception as e:
+            # 进程池不可用时退回当前进程
+            logging.warning(f"parallel tokenize err {e}")
+            self.close()
+            return self.build_serial(contents, progress, topic_capacity)
+
+    def build_serial(
+        self,
+        contents: list[str],
+        progress: ProgressReporter | None = None,
+        topic_capacity: int | None = None,
+    ):
+        # 在当前进程中时分块只是为了报告进度，合并后统计一次 SpaceSaving
+        if progress is None:
+            index = TokenIndex.build(contents)
+        else:
+            indexes = []
+            for chunk in self.chunks(contents, self.serial_chunk_chars):
+                indexes.append(TokenIndex.build(chunk))
+                progress.add("rows_tokenized", len(chunk))
+            index = TokenIndex.concat(indexes)
+        if topic_capacity is not None:
+            index.build_sketch(topic_capacity)
+        return index
+
+    def build_parallel(
+        self,
+        contents: list[str],
+        progress: ProgressReporter | None = None,
+        topic_capacity: int | None = None,
+    ):
+        executor = self.get_executor()
+        futures = [
+            executor.submit(tokenize_chunk, chunk, topic_capacity)
+            for chunk in self.chunks(contents)
+        ]
+        try:
+            pending = set(futures)
+            while pending:
+                # 最多等 0.1 秒就检查一次是否取消
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                if progress is not None:
+                    progress.add("rows_tokenized", sum(len(f.result()) for f in done))
+            return TokenIndex.concat([f.result() for f in futures])
+        finally:
+            # 取消时还没有开始的块不再执行
+            for future in futures:
+                future.cancel()
+
+    def close(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
@@ -0,0 +1,76 @@
+import logging
+import threading
+import time
+
+
+def warm_pandas():
+    # numpy / pandas 和按列处理消息的模块
+    import api.analytics
+    import api.classify
+    import api.messages
+
+
+def warm_jieba():
+    # 从 MAIN_PATH/cache 下的缓存文件加载词典
+    from api.tokens import init_jieba
+
+    init_jieba()
+
+
+def warm_plot():
+    # 导入 matplotlib / wordcloud，并加载词云字体
+    from api.plot import prime_plot
+
+    prime_plot()
+
+
+# 预热的各个阶段，按顺序执行
+STAGES = {
+    "pandas": warm_pandas,
+    "jieba": warm_jieba,
+    "plot": warm_plot,
+}
+
+
+class Warmup:
+    """
+    连接成功后在后台线程中预先加载分析要用的模块和词典，
+    分析时用 wait() 只等待还没有准备好的部分
+    """
+
+    def __init__(self):
+        self.events = {stage: threading.Event() for stage in STAGES}
+        self.seconds: dict[str, float] = {}
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        for stage, warm in STAGES.items():
+            start = time.time()
+            try:
+                warm()
+            except Exception as e:
+                logging.warning(f"warmup {stage} err {e}")
+            finally:
+                self.seconds[stage] = round(time.time() - start, 3)
+                self.events[stage].set()
+        logging.info(f"warmup finished {self.seconds}")
+
+    def is_ready(self, stage: str) -> bool:
+        return self.events[stage].is_set()
+
+    def ready(self) -> dict[str, bool]:
+        return {stage: self.is_ready(stage) for stage in STAGES}
+
+    def wait(self, stage: str, timeout: float | None = None) -> bool:
+        # 没有启动预热时直接返回，由用到的地方自己加载
+        if self.thread is None:
+            return True
+        return self.events[stage].wait(timeout)
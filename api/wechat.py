@@ -1,76 +1,124 @@
-import asyncio
-import json
+from __future__ import annotations
+
+import heapq
+import itertools
 import logging
-from collections import Counter
-
-import httpx
-import jieba
-import datetime as dt
-import flet as ft
-import pandas as pd
-import traceback
-from asyncio import Task
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import List
+from typing import TYPE_CHECKING
+
+from api.cache import MessageCacheLRU
+from api.source import MessageSource, WcfMessageSource, SqliteMessageSource
+from api.query import MESSAGE_COLUMNS, MessageFilter, MessageQuery
+from api.stats import TalkerStats, TalkerStatsIndex
+from api.store import MessageStore
+from api.warmup import Warmup
+
+if TYPE_CHECKING:
+    from api.messages import MessageBatch
+    from api.tokens import ParallelTokenizer
+    from api.worker import AnalysisWorker
+
+# numpy / pandas / jieba / flet 等都在用到时才导入，只统计消息数时不需要加载
+
 
-from wcferry import Wcf
+def to_batch(rows: list, talker: str, message_filter: MessageFilter | None = None):
+    # 查询结果转换成分好类的 MessageBatch
+    from api.classify import classify_batch, filter_kinds
+    from api.messages import MessageBatch
 
-from api.plot import *
-from api.stop_words import stop_words
-from ui.utils import extract_chinese, get_time_interval, ai_url
+    return filter_kinds(
+        classify_batch(MessageBatch.from_rows(rows, talker)), message_filter
+    )
 
 
 class WeChatAPI:
-    def __init__(self):
-        self.wcf: Wcf | None = None
+    def __init__(self, cache_max_bytes=64 * 1024 * 1024, tokenize_workers: int | None = None):
+        self.source: MessageSource | None = None
         self.my_id: str | None = None
         self.user_id: str | None = None
         self.friends_list: list | None = None
         self.db_files: list | None = None
-        self.message_cache = {}
+        # 每个好友的分页缓存，按估算的字节数做 LRU 淘汰
+        self.message_cache = MessageCacheLRU(max_bytes=cache_max_bytes)
+        # 所有好友的消息数统计，连接时建立
+        self.talker_stats: TalkerStatsIndex | None = None
+        # 并发查询各个MSG*.db的线程池
+        self.query_executor = ThreadPoolExecutor(max_workers=4)
+        # 本地持久化的聊天记录，分析时增量同步
+        self.use_message_store = True
+        self.message_store: MessageStore | None = None
+        # 多进程分词，tokenize_workers 为 1 时只在当前进程分词，默认按 CPU 核数
+        self.tokenize_workers = tokenize_workers
+        self.tokenizer: ParallelTokenizer | None = None
+        # 连接成功后在后台预先加载分析要用的模块和词典
+        self.warmup = Warmup()
+        # 在常驻的分析进程中读取、分词、统计，不和界面争抢 GIL，需要 use_message_store
+        self.use_analysis_worker = False
+        self.analysis_worker: AnalysisWorker | None = None
 
     def init_wcf(self):
         try:
-            if self.wcf is None:
-                self.wcf = Wcf(debug=False, block=True)
+            if self.source is None:
+                self.source = WcfMessageSource(debug=False, block=True)
         except Exception as e:
             logging.warning(f"init_wcf error {e}")
             return "连接微信失败"
 
+    def init_sqlite(self, db_dir, my_id: str | None = None):
+        # 直接读取已经解密的数据库文件，不需要微信客户端
+        try:
+            if self.source is None:
+                self.source = SqliteMessageSource(db_dir, my_id=my_id)
+        except Exception as e:
+            logging.warning(f"init_sqlite error {e}")
+            return "打开数据库失败"
+
     def close_wcf(self):
-        if self.wcf is not None:
-            self.wcf.cleanup()
+        if self.analysis_worker is not None:
+            self.analysis_worker.stop()
+            self.analysis_worker = None
+        if self.source is not None:
+            self.source.close()
+        self.query_executor.shutdown(wait=False)
+        if self.tokenizer is not None:
+            self.tokenizer.close()
+        if self.message_store is not None:
+            self.message_store.close()
+            self.message_store = None
 
     def get_my_id(self):
-        if self.wcf is None:
+        if self.source is None:
             return "未连接微信"
         try:
-            self.my_id = self.wcf.get_self_wxid()
+            self.my_id = self.source.get_self_wxid()
             return None
         except Exception as e:
             logging.warning(f"get_my_id error {e}")
             return "获取用户id失败"
 
     def get_friends_list(self):
-        if self.wcf is None:
+        if self.source is None:
             return "未连接微信"
         try:
             # {'wxid': 'wxid_t01111c11', 'code': 'SpanishSahara_', 'remark': '', 'name': '🦋', 'country': 'CN',
             # 'province': 'Jiangsu', 'city': 'Nanjing', 'gender': ''}
-            self.friends_list = self.wcf.get_friends()
+            self.friends_list = self.source.get_friends()
             self.friends_list.sort(key=lambda v: v["name"])
         except Exception as e:
             logging.warning(f"get_friends_list error {e}")
             return "获取好友列表失败"
 
     def get_db_files(self):
-        if self.wcf is None:
+        if self.source is None:
             return "未连接微信"
         try:
             tmp = []
             # ['ChatMsg.db', 'Emotion.db', 'FunctionMsg.db', 'MSG0.db', 'MSG1.db', 'MSG2.db', 'Media.db',
             # 'MediaMSG0.db', 'MediaMSG1.db', 'MediaMSG2.db', 'MicroMsg.db', 'Misc.db']
-            for name in self.wcf.get_dbs():
+            for name in self.source.get_dbs():
                 if name.startswith("MSG"):
                     tmp.append(name)
             self.db_files = tmp
@@ -79,93 +127,394 @@ class WeChatAPI:
             logging.warning(f"get_db_files error {e}")
             return "获取数据库文件失败"
 
+    def build_talker_stats(self):
+        # 每个db扫描一次，统计所有好友的消息数、时间范围
+        if self.source is None:
+            return "未连接微信"
+        try:
+            self.talker_stats = TalkerStatsIndex().build(
+                self.source, self.db_files, self.query_executor
+            )
+        except Exception as e:
+            logging.warning(f"build_talker_stats error {e}")
+            return "统计消息数失败"
+
+    def get_talker_stats(self) -> TalkerStatsIndex | None:
+        if self.talker_stats is None:
+            self.build_talker_stats()
+        return self.talker_stats
+
     def clear_message_cache(self):
         self.message_cache.clear()
 
+    def get_message_cache(self, user_id: str) -> "CacheMessages":
+        return self.message_cache.get_or_create(
+            user_id, lambda: CacheMessages(self, user_id, self.db_files)
+        )
+
     def get_chat_messages(self, user_id: str, offset=0, limit=100, desc=False):
         # 获取聊天记录
-        # 聊天记录在 self.db_files 这几个数据库中，需要逐个，第一个查询完了，再接着第二个
+        # 聊天记录在 self.db_files 这几个数据库中，同时查询后按时间归并
         try:
-            if user_id not in self.message_cache:
-                self.message_cache[user_id] = CacheMessages(
-                    self, user_id, self.db_files
-                )
-            return self.message_cache[user_id].get_messages(offset, limit, desc)
+            return self.get_message_cache(user_id).get_messages(offset, limit, desc)
         except Exception as e:
             logging.error(f"get_chat_messages err {e}")
             return []
 
+    def get_chat_messages_after(
+        self, user_id: str, cursor: "MessageCursor | None" = None, limit=100
+    ):
+        # 游标之后的 limit 条消息，cursor 为 None 时从第一条开始
+        try:
+            return self.get_message_cache(user_id).get_messages_after(cursor, limit)
+        except Exception as e:
+            logging.error(f"get_chat_messages_after err {e}")
+            return []
+
+    def get_tokenizer(self) -> ParallelTokenizer:
+        if self.tokenizer is None:
+            from api.tokens import ParallelTokenizer
+
+            self.tokenizer = ParallelTokenizer(workers=self.tokenize_workers)
+        return self.tokenizer
+
+    def get_message_store(self) -> "MessageStore | None":
+        if not self.use_message_store or not self.my_id:
+            return None
+        if self.message_store is None:
+            from api.paths import MAIN_PATH
+
+            self.message_store = MessageStore(
+                MAIN_PATH.joinpath("cache", f"{self.my_id}.db")
+            )
+        return self.message_store
+
+    def refresh_talker_stats(self, user_id: str) -> "TalkerStats | None":
+        # 重新统计这个好友在各个db中的消息数，同步、分析之前调用
+        self.get_message_cache(user_id).count_lines(refresh=True)
+        talker_stats = self.get_talker_stats()
+        return talker_stats.get(user_id) if talker_stats else None
+
+    def sync_message_store(
+        self, user_id: str, batch_size=5000, progress=None, refresh=True
+    ) -> "MessageStore | None":
+        # 先把新消息同步到本地，之后从本地读取，progress(行数) 在每批同步之后调用，
+        # refresh 时先重新统计消息数，刚统计过时可以不用；
+        # 没有连接微信时（分析进程中）只读取已经同步的消息
+        if refresh and self.source is not None:
+            self.refresh_talker_stats(user_id)
+        store = self.get_message_store()
+        if store is not None and self.source is not None:
+            store.sync(
+                self.get_message_cache(user_id), batch_size=batch_size, progress=progress
+            )
+        return store
+
+    def get_analysis_worker(self) -> "AnalysisWorker | None":
+        # 分析进程只读取本地保存的聊天记录，不使用时返回 None，在当前进程分析
+        store = self.get_message_store()
+        if not self.use_analysis_worker or store is None:
+            return None
+        if self.analysis_worker is None:
+            from api.worker import AnalysisWorker
+
+            self.analysis_worker = AnalysisWorker(store.path, self.my_id, self.tokenize_workers)
+        return self.analysis_worker
+
+    def iter_chat_messages(
+        self,
+        user_id: str,
+        batch_size=5000,
+        ordered=True,
+        message_filter: MessageFilter | None = None,
+        after: "MessageCursor | None" = None,
+    ):
+        # 分批返回全部聊天记录，内存占用只和 batch_size 有关，没有条数上限
+        # message_filter 中的条件会下推到每个db的查询里，ordered 时可以用 after 只读之后的消息
+        # 出错时抛出，不能当作聊天记录已经读完，否则分析时会把不完整的结果当作全部保存下来
+        try:
+            cache = self.get_message_cache(user_id)
+            store = self.sync_message_store(user_id, batch_size)
+            if store is None or not ordered:
+                yield from cache.iter_messages(batch_size, ordered, message_filter, after)
+                return
+            for rows in store.iter_rows(
+                user_id,
+                batch_size,
+                message_filter,
+                after=(after.create_time, after.db_index, after.local_id) if after else None,
+            ):
+                yield to_batch(rows, user_id, message_filter)
+        except Exception as e:
+            logging.error(f"iter_chat_messages err {e}")
+            raise
+
+    def get_chat_messages_before(
+        self, user_id: str, cursor: "MessageCursor", limit=100
+    ):
+        # 游标之前的 limit 条消息，按时间正序返回
+        try:
+            return self.get_message_cache(user_id).get_messages_before(cursor, limit)
+        except Exception as e:
+            logging.error(f"get_chat_messages_before err {e}")
+            return []
+
 
 class CacheMessages:
-    def __init__(self, wechat_api, user_id, db_files):
+    def __init__(self, wechat_api, user_id, db_files, columns: list[str] | None = None):
         self.wechat_api: WeChatAPI = wechat_api
         self.user_id = user_id
         self.db_files = db_files
+        # 只查询需要的列
+        self.columns = columns or MESSAGE_COLUMNS
         self.db_lines = {}
+        # 已经查询过的分页，key 为查询方式和位置
+        self.pages: OrderedDict[tuple, MessageBatch] = OrderedDict()
+        self.pages_size = 0
+        self.lock = threading.Lock()
+
+    def cached_page(self, key: tuple, load):
+        with self.lock:
+            if key in self.pages:
+                self.pages.move_to_end(key)
+                return self.pages[key]
+        messages = load()
+        with self.lock:
+            if key not in self.pages:
+                self.pages[key] = messages
+                self.pages_size += messages.estimate_size()
+        # 不能在持有 self.lock 时调用，LRU 淘汰时会回调 trim
+        self.wechat_api.message_cache.update_size(self.user_id)
+        return messages
+
+    def estimate_size(self):
+        return self.pages_size
+
+    def trim(self, max_bytes):
+        # 只保留最近使用的分页
+        with self.lock:
+            while self.pages and self.pages_size > max_bytes:
+                _, messages = self.pages.popitem(last=False)
+                self.pages_size -= messages.estimate_size()
+
+    def query(self) -> MessageQuery:
+        return MessageQuery(self.columns).talker(self.user_id)
+
+    def count_lines(self, refresh=False):
+        # refresh 时重新统计，连接之后收到的新消息也算进去
+        if len(self.db_lines) > 0 and not refresh:
+            return
+        talker_stats = self.wechat_api.get_talker_stats()
+        if talker_stats is not None:
+            # 从连接时建立的统计中读取
+            if refresh:
+                talker_stats.refresh(
+                    self.wechat_api.source,
+                    self.db_files,
+                    self.user_id,
+                    self.wechat_api.query_executor,
+                )
+            self.set_db_lines(talker_stats.db_lines(self.user_id, self.db_files))
+            return
+        query = MessageQuery(["COUNT(*) AS count"]).talker(self.user_id)
+        results = self.fan_out(
+            {db_index: query for db_index in range(len(self.db_files))}
+        )
+        self.set_db_lines(
+            {
+                self.db_files[db_index]: res[0]["count"] if res else 0
+                for db_index, res in results.items()
+            }
+        )
+
+    def set_db_lines(self, db_lines: dict):
+        # 消息数变了之后，按位置缓存的分页不再准确
+        changed = self.db_lines and db_lines != self.db_lines
+        self.db_lines = db_lines
+        if changed:
+            with self.lock:
+                self.pages.clear()
+                self.pages_size = 0
+            self.wechat_api.message_cache.update_size(self.user_id)
+
+    def query_db(self, db_index: int, query: MessageQuery) -> list:
+        sql, params = query.build()
+        res = self.wechat_api.source.query_sql(self.db_files[db_index], sql, params)
+        return self.with_db_index(res or [], db_index)
+
+    def fan_out(self, queries: dict[int, MessageQuery]) -> dict[int, list]:
+        # 各个db的查询同时进行，总耗时约等于最慢的一个db
+        futures = {
+            db_index: self.wechat_api.query_executor.submit(
+                self.query_db, db_index, query
+            )
+            for db_index, query in queries.items()
+        }
+        return {db_index: future.result() for db_index, future in futures.items()}
+
+    def merge(self, results: dict[int, list], desc=False):
+        # 每个db的结果已经有序，按 (CreateTime, db_index, localId) 做多路归并，
+        # 不要求每个db的时间范围是连续的
+        return heapq.merge(
+            *results.values(),
+            key=lambda row: (row["CreateTime"], row["db_index"], row["localId"]),
+            reverse=desc,
+        )
+
+    def non_empty_dbs(self):
+        self.count_lines()
+        return [
+            db_index
+            for db_index, db_name in enumerate(self.db_files)
+            if self.db_lines[db_name] > 0
+        ]
 
     def get_messages(self, offset=0, limit=100, desc=False):
-        if len(self.db_lines) == 0:
-            for db_file in self.db_files:
-                query = f"SELECT COUNT(*) FROM MSG WHERE StrTalker = '{self.user_id}';"
-                res = self.wechat_api.wcf.query_sql(
-                    db_file,
-                    query,
+        return self.cached_page(
+            ("offset", offset, limit, desc),
+            lambda: self.load_messages(offset, limit, desc),
+        )
+
+    def get_messages_after(self, cursor: "MessageCursor | None", limit=100):
+        return self.cached_page(
+            ("after", cursor, limit),
+            lambda: self.load_messages_after(cursor, limit),
+        )
+
+    def get_messages_before(self, cursor: "MessageCursor", limit=100):
+        return self.cached_page(
+            ("before", cursor, limit),
+            lambda: self.load_messages_before(cursor, limit),
+        )
+
+    def load_messages(self, offset=0, limit=100, desc=False):
+        # 每个db都可能有全局排序的前 offset + limit 条，分别取出后归并
+        results = self.fan_out(
+            {
+                db_index: self.query()
+                .order_by("CreateTime", "localId", desc=desc)
+                .limit(offset + limit)
+                for db_index in self.non_empty_dbs()
+            }
+        )
+        result = itertools.islice(self.merge(results, desc), offset, offset + limit)
+        return to_batch(list(result), self.user_id)
+
+    def load_messages_after(self, cursor: "MessageCursor | None", limit=100):
+        # 按 (CreateTime, db_index, localId) 定位，不需要像 OFFSET 那样扫描并丢弃前面的行
+        results = self.fan_out(
+            {
+                db_index: self.query()
+                .seek_db(cursor, db_index)
+                .order_by("CreateTime", "localId")
+                .limit(limit)
+                for db_index in self.non_empty_dbs()
+            }
+        )
+        result = itertools.islice(self.merge(results), limit)
+        return to_batch(list(result), self.user_id)
+
+    def load_messages_before(self, cursor: "MessageCursor", limit=100):
+        results = self.fan_out(
+            {
+                db_index: self.query()
+                .seek_db(cursor, db_index, desc=True)
+                .order_by("CreateTime", "localId", desc=True)
+                .limit(limit)
+                for db_index in self.non_empty_dbs()
+            }
+        )
+        result = list(itertools.islice(self.merge(results, desc=True), limit))
+        result.reverse()
+        return to_batch(result, self.user_id)
+
+    def iter_db_rows(
+        self,
+        db_index: int,
+        after_local_id=0,
+        batch_size=5000,
+        message_filter: MessageFilter | None = None,
+    ):
+        # 按 localId 区间扫描单个db，localId 是主键，每一批都是直接定位
+        while True:
+            res = self.query_db(
+                db_index,
+                self.query()
+                .filter(message_filter)
+                .after_local_id(after_local_id)
+                .order_by("localId")
+                .limit(batch_size),
+            )
+            if not res:
+                return
+            yield res
+            if len(res) < batch_size:
+                return
+            after_local_id = res[-1]["localId"]
+
+    def iter_db_rows_by_time(
+        self,
+        db_index: int,
+        batch_size=5000,
+        message_filter: MessageFilter | None = None,
+        after: "MessageCursor | None" = None,
+    ):
+        # 单个db按 (CreateTime, localId) 分批定位，逐行返回，after 之前的不返回
+        last = None
+        while True:
+            query = self.query().filter(message_filter)
+            if last is not None:
+                query.seek(last["CreateTime"], last["localId"])
+            else:
+                query.seek_db(after, db_index)
+            res = self.query_db(
+                db_index, query.order_by("CreateTime", "localId").limit(batch_size)
+            )
+            if not res:
+                return
+            yield from res
+            if len(res) < batch_size:
+                return
+            last = res[-1]
+
+    def iter_messages(
+        self,
+        batch_size=5000,
+        ordered=True,
+        message_filter: MessageFilter | None = None,
+        after: "MessageCursor | None" = None,
+    ):
+        if ordered:
+            # 每个db一个分批读取的生成器，流式归并，同时在内存中的最多是 db数 * batch_size 行
+            rows = self.merge(
+                {
+                    db_index: self.iter_db_rows_by_time(
+                        db_index, batch_size, message_filter, after
+                    )
+                    for db_index in self.non_empty_dbs()
+                }
+            )
+            batches = iter(lambda: list(itertools.islice(rows, batch_size)), [])
+        else:
+            # 不关心顺序时逐个db按 localId 扫描
+            batches = (
+                batch
+                for db_index in self.non_empty_dbs()
+                for batch in self.iter_db_rows(
+                    db_index, batch_size=batch_size, message_filter=message_filter
                 )
-                if not res:
-                    self.db_lines[db_file] = 0
-                else:
-                    self.db_lines[db_file] = res[0]["COUNT(*)"]
-        result = []
-        dbs = self.db_files
-        if desc:
-            dbs = dbs[::-1]
-        for db_name in dbs:
-            lines_num = self.db_lines[db_name]
-            if lines_num == 0:
-                # 此db为空
-                continue
-            if offset > lines_num:
-                # 此db有数据，但是比offset小，减去offset，然后在下一个db获取
-                offset -= lines_num
-                continue
-            query = f"SELECT * FROM MSG WHERE StrTalker = '{self.user_id}' ORDER BY CreateTime {'DESC' if desc else ''} LIMIT {offset}, {limit};"
-            res = self.wechat_api.wcf.query_sql(
-                db_name,
-                query,
             )
-            if res:
-                result.extend(res)
-                if len(res) == limit:
-                    # 获取的数据够了，结束
-                    break
-                # 不够，需要从下一个db继续获取，下一个db直接从0获取就行了
-                offset = 0
-                limit = limit - len(res)
-        return self.format_messages([MessageData.from_dict(i) for i in result])
-
-    def format_messages(self, messages: list["MessageData"]):
-        res = []
-        for m in messages:
-            content = m.StrContent.replace("\n", "").replace("\r\n", "").strip()
-            if "<msg><img " in content or "<imgdatahash></imgdatahash>" in content:
-                m.StrContent = "[图片]"
-            elif "<msg><videomsg " in content or "cdnrawvideoaeskey" in content:
-                m.StrContent = "[视频]"
-            elif "voicemsg" in content:
-                m.StrContent = f"[语音]{extract_chinese(content)}"
-            elif "<VoIPBubbleMsg>" in content:
-                m.StrContent = f"[语音通话]{extract_chinese(content)}"
-            elif "<msg><emoji" in content:
-                m.StrContent = f"[EMOJI]"
-            elif "location x" in content:
-                m.StrContent = f"[定位]{extract_chinese(content)}"
-            elif "<revokemsg>" in content:
-                m.StrContent = f"{extract_chinese(content)}"
-            res.append(m)
-        return res
-
-
-@dataclass
+        for batch in batches:
+            yield to_batch(batch, self.user_id, message_filter)
+
+    @staticmethod
+    def with_db_index(rows: list, db_index: int):
+        for row in rows:
+            row["db_index"] = db_index
+        return rows
+
+
+@dataclass(slots=True)
 class MessageData:
     localId: int | None
     TalkerId: int | None
@@ -184,6 +533,8 @@ class MessageData:
     StrContent: str | None
     DisplayContent: str | None
     BytesExtra: bytes | None
+    # 所在数据库在 db_files 中的序号，分页游标使用
+    db_index: int | None = field(default=None)
 
     @staticmethod
     def from_dict(data):
@@ -205,616 +556,21 @@ class MessageData:
             StrContent=data.get("StrContent"),
             DisplayContent=data.get("DisplayContent"),
             BytesExtra=data.get("BytesExtra"),
+            db_index=data.get("db_index"),
         )
 
 
-class Analyzer:
-    def __init__(self, wechat_api: WeChatAPI):
-        self.wechat_api: WeChatAPI = wechat_api
-        self.analysis_task: Task | None = None
-        self.end_callback = None
-        self.theme_color = ft.colors.BLUE
-
-        self.my_info: UserInfo | None = None
-        self.user_info: UserInfo | None = None
-        self.start_message_info: StartMessageInfo | None = None
-        self.count_rank_info: CountRankInfo | None = None
-
-        self.most_late_message: MostLateMessageInfo | None = None
-        self.filter_messages = []
-        self.message_df: pd.DataFrame | None = None
-
-    def start_analysis(self, user_id: str, end_callback, error_callback):
-        self.end_callback = end_callback
-        self.analysis_task = asyncio.create_task(
-            self.generate_analysis_task(user_id, end_callback, error_callback=error_callback)
-        )
-
-    async def get_ai_result(self, user_id, username, password):
-        if not username or not password:
-            return None
-        try:
-            messages = self.get_chat_messages(user_id)
-            message_string = "\n".join([i.StrContent for i in messages])
-            url = ai_url
-            res = ""
-            async with httpx.AsyncClient().stream(
-                method="POST",
-                url=url,
-                json={
-                    "username": username,
-                    "password": password,
-                    "content": message_string,
-                },
-                timeout=300,
-            ) as response:
-                async for chunk in response.aiter_lines():
-                    if chunk.startswith("data:"):
-                        data = json.loads(chunk[5:])
-                        if "result" in data and data["result"]:
-                            res += data["result"]
-                    else:
-                        return self.build_container(ft.Text(chunk, selectable=True))
-            return self.build_container(ft.Text(res, selectable=True))
-        except Exception as e:
-            logging.warning(f"{e} {traceback.format_exc()}")
-            return self.build_container(ft.Text(str(e), selectable=True))
-
-    def get_chat_messages(self, user_id) -> List[MessageData]:
-        # 移除无用的信息
-        res: List[MessageData] = []
-        all_messages: List[MessageData] = self.wechat_api.get_chat_messages(
-            user_id, offset=0, limit=100000
-        )
-        for message in all_messages:
-            if message.Type == 10000:
-                # 打招呼、撤回等系统消息，忽略
-                continue
-            for w in ["[图片]", "[视频]", "[语音通话]", "[EMOJI]", "[定位]"]:
-                if message.StrContent.startswith(w):
-                    # 把这些忽略掉
-                    continue
-            res.append(message)
-        return res
-
-    async def generate_analysis_task(self, user_id: str, end_callback, error_callback):
-        try:
-            my_id = self.wechat_api.my_id
-            # {'wxid': 'wxid_xxx', 'code': '', 'remark': '', 'name': 'xxx', 'country': '',
-            # 'province': '', 'city': '', 'gender': '女'}
-            self.my_info = UserInfo.from_dict(
-                self.wechat_api.wcf.get_info_by_wxid(my_id)
-            )
-            self.user_info = UserInfo.from_dict(
-                self.wechat_api.wcf.get_info_by_wxid(user_id)
-            )
-            all_messages: List[MessageData] = self.get_chat_messages(user_id)
-            for message in all_messages:
-                self.build_start_message(message)
-                self.build_most_late_message(message)
-                self.build_filter_message(message)
-
-            self.build_count_rank()
-            self.message_df = pd.DataFrame.from_records(self.filter_messages)
-            if "datetime" in self.message_df.columns:
-                self.message_df.set_index("datetime", inplace=True, drop=False)
-            await end_callback(self.build_view())
-        except Exception as e:
-            logging.error(f"generate_analysis_task error {e} {traceback.format_exc()}")
-            await end_callback()
-            await error_callback(f"{e} {traceback.format_exc()}")
-
-    def build_start_message(self, message: MessageData):
-        if not hasattr(self, "build_start_message_finished"):
-            setattr(self, "build_start_message_finished", False)
-        finished = getattr(self, "build_start_message_finished")
-        if finished:
-            return
-
-        if not self.start_message_info:
-            self.start_message_info = StartMessageInfo(
-                start_time=dt.datetime.fromtimestamp(message.CreateTime),
-                from_my=message.IsSender == 1,
-                content=message.StrContent,
-            )
-        elif self.start_message_info.resp_content is None:
-            #  还没收到对方的回复
-            if self.start_message_info.from_my and message.IsSender == 1:
-                # 仍然是自己的消息
-                if (
-                    message.CreateTime - self.start_message_info.start_time.timestamp()
-                ) < 600:
-                    # 规定一个600秒的限制
-                    self.start_message_info.content += " " + message.StrContent
-            elif (not self.start_message_info.from_my) and message.IsSender == 0:
-                # 仍然是对方发的
-                if (
-                    message.CreateTime - self.start_message_info.start_time.timestamp()
-                ) < 600:
-                    # 规定一个600秒的限制
-                    self.start_message_info.content += " " + message.StrContent
-            else:
-                # 是对方发的了
-                self.start_message_info.resp_content = message.StrContent
-                self.start_message_info.interval = (
-                    message.CreateTime - self.start_message_info.start_time.timestamp()
-                )
-                setattr(self, "build_start_message_finished", True)
-
-    def build_most_late_message(self, message: MessageData):
-        def get_interval():
-            # 计算和凌晨4点差多少秒
-            datetime = dt.datetime.fromtimestamp(message.CreateTime)
-            if datetime.hour < 4:
-                return 4 * 3600 - (
-                    datetime.hour * 3600 + datetime.minute * 60 + datetime.second
-                )
-            else:
-                return (
-                    24 * 3600
-                    - (datetime.hour * 3600 + datetime.minute * 60 + datetime.second)
-                    + 4 * 3600
-                )
-
-        if (
-            not self.most_late_message
-            or get_interval() < self.most_late_message.interval
-        ):
-            self.most_late_message = MostLateMessageInfo(
-                datetime=dt.datetime.fromtimestamp(message.CreateTime),
-                interval=get_interval(),
-                message=message,
-            )
-
-    def build_filter_message(self, message: MessageData):
-        self.filter_messages.append(
-            {
-                "datetime": dt.datetime.fromtimestamp(message.CreateTime),
-                "is_sender": message.IsSender == 1,
-                "content": message.StrContent,
-            }
-        )
-
-    def build_count_rank(self):
-        # [{'localId': 1, 'TalkerId': 1, 'MsgSvrID': 2061517216873451111, 'Type': 1, 'SubType': 0, 'IsSender': 0,
-        # 'CreateTime': 1676545342, 'Sequence': 1676545342000, 'StatusEx': 0, 'FlagEx': 16, 'Status': 2, 'MsgServerSeq': 1,
-        # 'MsgSequence': 791091113, 'StrTalker': '111@chatroom', 'StrContent': '[胜利]', 'DisplayContent': '',
-        # 'Reserved0': 0, 'Reserved1': 3, 'Reserved2': None, 'Reserved3': None, 'Reserved4': None, 'Reserved5': None,
-        # 'Reserved6': None, 'CompressContent': None, 'BytesExtra': b'', 'BytesTrans': None}]
-        counts = {}
-        for db in self.wechat_api.db_files:
-            res = self.wechat_api.wcf.query_sql(
-                db, "SELECT StrTalker, COUNT(*) AS count FROM Msg GROUP BY StrTalker;"
-            )
-            for i in res:
-                if i["StrTalker"].endswith("@chatroom"):
-                    # 把群聊去掉
-                    continue
-                if i["StrTalker"] not in counts:
-                    counts[i["StrTalker"]] = i["count"]
-                else:
-                    counts[i["StrTalker"]] += i["count"]
-        if self.wechat_api.user_id not in counts:
-            return
-        counter = Counter(counts)
-        message_num = counter.get(self.wechat_api.user_id)
-        rank = [item[1] for item in counter.most_common()].index(message_num) + 1
-        percent = message_num / counter.total()
-        top_10 = []
-        for item in counter.most_common(10):
-            info = self.wechat_api.wcf.get_info_by_wxid(item[0])
-            top_10.append(info["remark"] or info["name"])
-        self.count_rank_info = CountRankInfo(
-            count_rank=rank, percent=percent, top_10=top_10
-        )
-
-    def build_view(self):
-        res = []
-        message_df: pd.DataFrame = self.message_df
-        if len(message_df) == 0:
-            res.append(self.build_container(ft.Text("我们没有任何对话")))
-            return res
-        part1 = []
-        # xxx与xxx
-        part1.append(
-            ft.Text(
-                spans=[
-                    ft.TextSpan(
-                        text=f"{self.my_info.remark or self.my_info.name}",
-                        style=ft.TextStyle(
-                            weight=ft.FontWeight.BOLD,
-                            size=20,
-                            color=self.theme_color,
-                        ),
-                    ),
-                    ft.TextSpan(
-                        text=f"与",
-                        style=ft.TextStyle(weight=ft.FontWeight.BOLD, size=20),
-                    ),
-                    ft.TextSpan(
-                        text=f"{self.user_info.remark or self.user_info.name}",
-                        style=ft.TextStyle(
-                            weight=ft.FontWeight.BOLD,
-                            size=20,
-                            color=self.theme_color,
-                        ),
-                    ),
-                ],
-                selectable=True,
-            )
-        )
-        # 2023年3月11日 是我们相识的第1天
-        start_year = self.start_message_info.start_time.year
-        start_month = self.start_message_info.start_time.month
-        start_day = self.start_message_info.start_time.day
-        part1.append(
-            ft.Text(
-                spans=[
-                    ft.TextSpan(
-                        text=f"{start_year}年{start_month}月{start_day}日 ",
-                        style=ft.TextStyle(weight=ft.FontWeight.BOLD),
-                    ),
-                    ft.TextSpan(text=f"是我们相识的第"),
-                    ft.TextSpan(
-                        text=f" 1 ",
-                        style=ft.TextStyle(size=20, color=self.theme_color),
-                    ),
-                    ft.TextSpan(text=f"天"),
-                ],
-                selectable=True,
-            )
-        )
-        if self.start_message_info.from_my:
-            # 我先说
-            part1.append(
-                ft.Text(
-                    spans=[
-                        ft.TextSpan(text=f"我对你说的第一句话："),
-                        ft.TextSpan(
-                            text=f"“{self.start_message_info.content}”",
-                            style=ft.TextStyle(color=self.theme_color),
-                        ),
-                    ],
-                    selectable=True,
-                )
-            )
-            if self.start_message_info.resp_content:
-                # 对方回复
-                part1.append(
-                    ft.Text(
-                        spans=[
-                            ft.TextSpan(text=f"你在"),
-                            ft.TextSpan(
-                                text=f" {get_time_interval(self.start_message_info.interval)} ",
-                                style=ft.TextStyle(weight=ft.FontWeight.BOLD),
-                            ),
-                            ft.TextSpan(text=f"后回复我："),
-                            ft.TextSpan(
-                                text=f"“{self.start_message_info.resp_content}”",
-                                style=ft.TextStyle(color=self.theme_color),
-                            ),
-                        ],
-                        selectable=True,
-                    )
-                )
-        else:
-            # 对方先说
-            part1.append(
-                ft.Text(
-                    spans=[
-                        ft.TextSpan(text=f"你对我说的第一句话："),
-                        ft.TextSpan(
-                            text=f"“{self.start_message_info.content}”",
-                            style=ft.TextStyle(color=self.theme_color),
-                        ),
-                    ],
-                    selectable=True,
-                )
-            )
-            if self.start_message_info.resp_content:
-                # 我回复
-                part1.append(
-                    ft.Text(
-                        spans=[
-                            ft.TextSpan(text=f"我在"),
-                            ft.TextSpan(
-                                text=f" {get_time_interval(self.start_message_info.interval)} ",
-                                style=ft.TextStyle(weight=ft.FontWeight.BOLD),
-                            ),
-                            ft.TextSpan(text=f"后回复你："),
-                            ft.TextSpan(
-                                text=f"“{self.start_message_info.resp_content}”",
-                                style=ft.TextStyle(color=self.theme_color),
-                            ),
-                        ],
-                        selectable=True,
-                    )
-                )
-        res.append(self.build_container(ft.Column(part1, tight=True)))
-        res.append(ft.Container(height=10))
-        part2 = []
-        # 今天是2024年4月27日 是我们相识的第412天
-        now = dt.datetime.now()
-        days_to_now = (now - message_df.iloc[0].datetime).days
-        part2.append(
-            ft.Text(
-                spans=[
-                    ft.TextSpan(
-                        text=f"今天是{now.year}年{now.month}月{now.day}日 ",
-                        style=ft.TextStyle(weight=ft.FontWeight.BOLD),
-                    ),
-                    ft.TextSpan(text=f"是我们相识的第"),
-                    ft.TextSpan(
-                        text=f" {days_to_now} ",
-                        style=ft.TextStyle(size=20, color=self.theme_color),
-                    ),
-                    ft.TextSpan(text=f"天"),
-                ],
-                selectable=True,
-            )
-        )
-        # 在认识的xx天里
-        my_words_count = (
-            message_df[message_df["is_sender"] == 1]["content"].str.len().sum()
-        )
-        user_words_count = (
-            message_df[message_df["is_sender"] == 0]["content"].str.len().sum()
-        )
-        daily_count = message_df.resample("D").count()
-        daily_count = daily_count[daily_count["content"] > 0]
-        part2.append(
-            ft.Text(
-                spans=[
-                    ft.TextSpan(text=f"在认识的{days_to_now}天里，我们共进行了"),
-                    ft.TextSpan(
-                        text=f"{len(daily_count)}天、{len(message_df)}次、{my_words_count + user_words_count}字 ",
-                        style=ft.TextStyle(color=self.theme_color, size=20),
-                    ),
-                    ft.TextSpan(text=f"的对话"),
-                ],
-                selectable=True,
-            )
-        )
-        part2.append(
-            ft.Text(
-                spans=[
-                    ft.TextSpan(text=f"我对你说了"),
-                    ft.TextSpan(
-                        text=f" {len(message_df[message_df['is_sender'] == 1])} ",
-                        style=ft.TextStyle(color=self.theme_color),
-                    ),
-                    ft.TextSpan(text=f"句话，共"),
-                    ft.TextSpan(
-                        text=f" {my_words_count} ",
-                        style=ft.TextStyle(color=self.theme_color),
-                    ),
-                    ft.TextSpan(text=f"字；"),
-                    ft.TextSpan(text=f"你对我说了"),
-                    ft.TextSpan(
-                        text=f" {len(message_df[message_df['is_sender'] == 0])} ",
-                        style=ft.TextStyle(color=self.theme_color),
-                    ),
-                    ft.TextSpan(text=f"句话，共"),
-                    ft.TextSpan(
-                        text=f" {user_words_count} ",
-                        style=ft.TextStyle(color=self.theme_color),
-                    ),
-                    ft.TextSpan(text=f"字。"),
-                ],
-                selectable=True,
-            )
-        )
-        res.append(self.build_container(ft.Column(part2, tight=True)))
-        res.append(ft.Container(height=10))
-        res.append(
-            self.build_container(
-                ft.Text(
-                    spans=[
-                        ft.TextSpan(text=f"我们聊过最多的话题有"),
-                        ft.TextSpan(
-                            text=f"{' '.join(self.get_topics(self.get_contents(message_df), top_n=20))}",
-                            style=ft.TextStyle(color=self.theme_color, size=20),
-                        ),
-                        ft.TextSpan(text=f"。"),
-                    ],
-                    selectable=True,
-                )
-            )
-        )
-        res.append(ft.Container(height=10))
-        # 聊天最多的一天
-        # my_daily_count = message_df[message_df["is_sender"] == 1].resample("D").count()
-        # user_daily_count = (
-        #     message_df[message_df["is_sender"] == 0].resample("D").count()
-        # )
-        total_daily_count = message_df.resample("D").count()
-        total_max_count_day = total_daily_count[
-            total_daily_count["content"] == total_daily_count["content"].max()
-        ]
-        if total_daily_count["content"].max() > 3 and len(total_max_count_day) > 0:
-            # 一天说的话都不超过2条，没统计的必要了
-            line = total_max_count_day.iloc[0]
-            line_index: dt.datetime = total_max_count_day.index[0]
-            lines = message_df[message_df.index.normalize() == line_index]
-            res.append(
-                self.build_container(
-                    ft.Text(
-                        spans=[
-                            ft.TextSpan(
-                                text=f"{line_index.year}年{line_index.month}月{line_index.day}日 ",
-                                style=ft.TextStyle(color=self.theme_color, size=20),
-                            ),
-                            ft.TextSpan(text=f"我们聊天最多，共进行了"),
-                            ft.TextSpan(
-                                text=f"{line['content']}次",
-                                style=ft.TextStyle(color=self.theme_color, size=20),
-                            ),
-                            ft.TextSpan(text=f"对话，"),
-                            ft.TextSpan(text=f"这一天我们讨论了"),
-                            ft.TextSpan(
-                                text=f"{' '.join(self.get_topics(self.get_contents(lines)))}",
-                                style=ft.TextStyle(color=self.theme_color),
-                            ),
-                            ft.TextSpan(text=f"这些话题"),
-                        ],
-                        selectable=True,
-                    )
-                )
-            )
-
-        # 聊天最晚的一天
-        if self.most_late_message and self.most_late_message.datetime.hour < 4:
-            # 0-4点之间
-            datetime = self.most_late_message.datetime - dt.timedelta(days=1)
-            res.append(
-                self.build_container(
-                    ft.Text(
-                        spans=[
-                            ft.TextSpan(
-                                text=f"{datetime.year}年{datetime.month}月{datetime.day}日这一天，我们聊到了凌晨"
-                            ),
-                            ft.TextSpan(
-                                text=f"{datetime.hour}点{datetime.minute}分",
-                                style=ft.TextStyle(color=self.theme_color),
-                            ),
-                            ft.TextSpan(
-                                text=f"，我们当时一定有特别想聊的事情！"
-                                f"那天{'我' if self.most_late_message.message.IsSender == 1 else '你'}聊的最后一句话是："
-                            ),
-                            ft.TextSpan(
-                                text=f"“{self.most_late_message.message.StrContent}”",
-                                style=ft.TextStyle(color=self.theme_color),
-                            ),
-                        ],
-                        selectable=True,
-                    )
-                )
-            )
-
-        res.append(ft.Container(height=10))
-        res.append(ft.Text("每日消息统计图"))
-        res.append(plot_day_bar(self.message_df))
-        res.append(ft.Text("日时段消息统计图"))
-        res.append(plot_hour_bar(self.message_df))
-        res.append(ft.Text("词云图"))
-        res.append(
-            plot_cloud(
-                self.get_topics(self.get_contents(df=self.message_df), top_n=100)
-            )
-        )
-        # 好友排名
-        if self.count_rank_info:
-            res.append(
-                self.build_container(
-                    ft.Text(
-                        spans=[
-                            ft.TextSpan(text=f"我们的对话次数在所有好友中的排名第"),
-                            ft.TextSpan(
-                                text=f" {self.count_rank_info.count_rank} ",
-                                style=ft.TextStyle(color=self.theme_color, size=20),
-                            ),
-                            ft.TextSpan(text=f"，占所有对话的"),
-                            ft.TextSpan(
-                                text=f" {round(self.count_rank_info.percent * 100, 2)}% ",
-                                style=ft.TextStyle(color=self.theme_color, size=20),
-                            ),
-                        ],
-                        selectable=True,
-                    )
-                )
-            )
-            res.append(
-                self.build_container(
-                    ft.Text(
-                        spans=[
-                            ft.TextSpan(text=f"和我聊天最多的10个人是"),
-                            ft.TextSpan(
-                                text=f" {' '.join(self.count_rank_info.top_10)} ",
-                                style=ft.TextStyle(color=self.theme_color),
-                            ),
-                        ],
-                        selectable=True,
-                    )
-                )
-            )
-
-        return res
+@dataclass(frozen=True)
+class MessageCursor:
+    # 消息在所有数据库中的位置，按 (CreateTime, db_index, localId) 排序
+    db_index: int
+    create_time: int
+    local_id: int
 
     @staticmethod
-    def build_container(child):
-        return ft.Container(
-            child,
-            padding=ft.padding.symmetric(horizontal=16, vertical=6),
-            border_radius=ft.border_radius.all(12),
-            bgcolor=ft.colors.WHITE,
-            width=350,
+    def from_message(message: MessageData):
+        return MessageCursor(
+            db_index=message.db_index,
+            create_time=message.CreateTime,
+            local_id=message.localId,
         )
-
-    async def stop_analysis(self, e=None):
-        if self.analysis_task:
-            self.analysis_task.cancel()
-            self.analysis_task = None
-        if self.end_callback:
-            await self.end_callback()
-            self.end_callback = None
-
-    def get_contents(self, df):
-        combined_string = " ".join(df["content"])
-        return combined_string
-
-    def get_topics(self, content, top_n=10):
-        words = jieba.cut(content)
-        filtered_words = [word for word in words if word not in stop_words]
-        word_counts = Counter(filtered_words)
-        return [i[0] for i in word_counts.most_common(top_n) if i[1] > 2]
-
-
-@dataclass()
-class UserInfo:
-    wxid: str
-    code: str
-    remark: str
-    name: str
-    country: str
-    province: str
-    city: str
-    gender: str
-    avatar: str
-
-    @staticmethod
-    def from_dict(data):
-        return UserInfo(
-            wxid=data.get("wxid"),
-            code=data.get("code"),
-            remark=data.get("remark"),
-            name=data.get("name"),
-            country=data.get("country"),
-            province=data.get("province"),
-            city=data.get("city"),
-            gender=data.get("gender"),
-            avatar=data.get("avatar"),
-        )
-
-
-@dataclass()
-class StartMessageInfo:
-    start_time: dt.datetime
-    from_my: bool
-    content: str
-    resp_content: str | None = field(default=None)
-    interval: int | None = field(default=None)
-
-
-@dataclass()
-class MostLateMessageInfo:
-    # 我们和凌晨4点进行比较
-    datetime: dt.datetime
-    interval: int  # most_datetime和凌晨4点进行比较的秒数
-    message: MessageData
-
-
-@dataclass()
-class CountRankInfo:
-    count_rank: int
-    percent: float
-    top_10: List[str]
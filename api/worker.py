@@ -0,0 +1,217 @@
+import atexit
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from api.progress import AnalysisCancelled, ProgressReporter
+
+# 共享内存中每个数组的起始位置按 64 字节对齐
+ALIGNMENT = 64
+
+
+def pack_arrays(arrays: dict[str, np.ndarray]) -> tuple[SharedMemory, dict]:
+    """
+    把数组依次拷贝到一块新的共享内存，返回共享内存和描述 {"name", "arrays": [(key, dtype, shape, offset)]}，
+    描述很小，经队列传递，另一个进程用 unpack_arrays 读出
+    """
+    layout = []
+    size = 0
+    for key, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        layout.append((key, array.dtype.str, array.shape, size))
+        size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    shm = SharedMemory(create=True, size=max(size, 1))
+    for (key, dtype, shape, offset), array in zip(layout, arrays.values()):
+        np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)[...] = array
+    return shm, {"name": shm.name, "arrays": layout}
+
+
+def unpack_arrays(descriptor: dict) -> dict[str, np.ndarray]:
+    # 拷贝出来后立即关闭，共享内存由创建的进程释放
+    shm = SharedMemory(name=descriptor["name"])
+    try:
+        return {
+            key: np.ndarray(shape, dtype, buffer=shm.buf, offset=offset).copy()
+            for key, dtype, shape, offset in descriptor["arrays"]
+        }
+    finally:
+        shm.close()
+
+
+def release_shared(shm: SharedMemory):
+    shm.close()
+    shm.unlink()
+
+
+class CancelFlag:
+    """
+    代替 threading.Event 传给分析进程中的 ProgressReporter，
+    共享的 value 中是要取消的请求编号，等于 request_id 时算作已经取消
+    """
+
+    def __init__(self, value, request_id: int):
+        self.value = value
+        self.request_id = request_id
+
+    def is_set(self) -> bool:
+        return self.value.value == self.request_id
+
+    def set(self):
+        self.value.value = self.request_id
+
+
+def run_request(wechat_api, user_id: str, options: dict, progress: ProgressReporter):
+    # 读取、分词、统计、画词云，返回 Analyzer.export_result()
+    from api.analyzer import Analyzer
+
+    analyzer = Analyzer(wechat_api, **options)
+    analyzer.aggregate(user_id, progress)
+    analyzer.render_images(progress)
+    return analyzer.export_result()
+
+
+def worker_main(store_path, my_id: str, tokenize_workers, requests, responses, cancel_value):
+    """
+    分析进程的入口，只打开界面进程同步好的本地聊天记录，不连接微信。
+    请求是 ("analyze", 编号, user_id, options) 和 ("release", 编号)，None 表示退出；
+    返回 ("progress", 编号, AnalysisProgress)，最后是 ("done", 编号, (meta, 共享内存的描述))、
+    ("cancelled", 编号) 或 ("error", 编号, 错误信息)。
+    共享内存在界面进程读完发来 release 之后才释放，Windows 下最后一个句柄关闭时共享内存就会被销毁
+    """
+    from api.store import MessageStore
+    from api.wechat import WeChatAPI
+
+    wechat_api = WeChatAPI(tokenize_workers=tokenize_workers)
+    wechat_api.my_id = my_id
+    wechat_api.message_store = MessageStore(store_path)
+    wechat_api.warmup.start()
+    shared: dict[int, SharedMemory] = {}
+    try:
+        while True:
+            try:
+                request = requests.get(timeout=1)
+            except queue.Empty:
+                # 界面进程异常退出时没有发来 None
+                if not multiprocessing.parent_process().is_alive():
+                    break
+                continue
+            if request is None:
+                break
+            command, request_id, *args = request
+            if command == "release":
+                if request_id in shared:
+                    release_shared(shared.pop(request_id))
+                continue
+            user_id, options = args
+            progress = ProgressReporter(
+                lambda p, request_id=request_id: responses.put(("progress", request_id, p)),
+                cancel_event=CancelFlag(cancel_value, request_id),
+            )
+            try:
+                meta, arrays = run_request(wechat_api, user_id, options, progress)
+                shm, descriptor = pack_arrays(arrays)
+                shared[request_id] = shm
+                responses.put(("done", request_id, (meta, descriptor)))
+            except AnalysisCancelled:
+                responses.put(("cancelled", request_id))
+            except Exception as e:
+                logging.error(f"analysis worker error {e} {traceback.format_exc()}")
+                responses.put(("error", request_id, f"{e} {traceback.format_exc()}"))
+    finally:
+        for shm in shared.values():
+            release_shared(shm)
+        wechat_api.close_wcf()
+
+
+class AnalysisWorker:
+    """
+    常驻的分析进程，读取、分词、统计和画词云都在这个进程中执行，不和界面的事件循环争抢 GIL。
+    统计结果中的数组经共享内存传回，不经过 pickle，界面进程只生成控件。
+    分析进程只读取本地保存的聊天记录，同步由界面进程在分析之前完成
+    """
+
+    def __init__(self, store_path, my_id: str, tokenize_workers: int | None = None):
+        # 界面进程中有其他线程，不用 fork
+        context = multiprocessing.get_context("spawn")
+        self.requests = context.Queue()
+        self.responses = context.Queue()
+        # 要取消的请求编号
+        self.cancel_value = context.Value("q", -1)
+        self.request_ids = itertools.count()
+        # 同一时间只有一个请求，之前的请求取消后才会发出下一个
+        self.lock = threading.Lock()
+        # 分析进程自己还会启动分词的进程池，不能是 daemon
+        self.process = context.Process(
+            target=worker_main,
+            args=(
+                store_path,
+                my_id,
+                tokenize_workers,
+                self.requests,
+                self.responses,
+                self.cancel_value,
+            ),
+            name="analysis-worker",
+        )
+        self.process.start()
+        atexit.register(self.stop)
+
+    def analyze(self, user_id: str, options: dict, progress: ProgressReporter):
+        """
+        在分析线程中调用，阻塞到分析进程返回 (meta, arrays)，期间转发进度。
+        progress 被取消时通知分析进程，并立即抛出 AnalysisCancelled，不等待分析进程
+        """
+        with self.lock:
+            request_id = next(self.request_ids)
+            self.requests.put(("analyze", request_id, user_id, options))
+            try:
+                while True:
+                    progress.check()
+                    try:
+                        kind, response_id, *data = self.responses.get(
+                            timeout=progress.interval
+                        )
+                    except queue.Empty:
+                        if not self.process.is_alive():
+                            raise RuntimeError("分析进程已退出")
+                        continue
+                    if kind == "done" and response_id != request_id:
+                        # 之前取消了的请求，不用读取
+                        self.requests.put(("release", response_id))
+                    if response_id != request_id:
+                        continue
+                    if kind == "progress":
+                        # 同步的进度和总数由界面进程统计
+                        p = data[0]
+                        progress.update(
+                            stage=p.stage, rows_read=p.rows_read, rows_tokenized=p.rows_tokenized
+                        )
+                    elif kind == "done":
+                        meta, descriptor = data[0]
+                        try:
+                            return meta, unpack_arrays(descriptor)
+                        finally:
+                            self.requests.put(("release", request_id))
+                    elif kind == "cancelled":
+                        raise AnalysisCancelled()
+                    elif kind == "error":
+                        raise RuntimeError(f"分析进程出错 {data[0]}")
+            except AnalysisCancelled:
+                CancelFlag(self.cancel_value, request_id).set()
+                raise
+
+    def stop(self, timeout=5):
+        if not self.process.is_alive():
+            return
+        self.requests.put(None)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            logging.warning("analysis worker did not exit, terminate")
+            self.process.terminate()
+            self.process.join()
@@ -0,0 +1,58 @@
+"""
+停用词过滤的单词耗时对比，在项目根目录运行：python -m bench.stop_words
+"""
+import random
+import timeit
+
+import numpy as np
+
+from api.stop_words import STOP_WORDS_TEXT, StopWordFilter, stop_words
+
+TOKENS = 1_000_000
+VOCAB = 20_000
+
+
+def main():
+    random.seed(0)
+    words = sorted(stop_words)
+    # 一半停用词，一半普通词，普通词从一个较小的词表中抽取，和聊天记录的分布接近
+    vocab = [f"词{i}" for i in range(VOCAB)]
+    tokens = [
+        random.choice(words) if random.random() < 0.5 else random.choice(vocab)
+        for _ in range(TOKENS)
+    ]
+    stop_list = STOP_WORDS_TEXT.split("\n")
+    stop_filter = StopWordFilter()
+
+    def by_list():
+        return [word for word in tokens if word not in stop_list]
+
+    def by_set():
+        return [word for word in tokens if word not in stop_words]
+
+    def by_filter():
+        return [word for word in tokens if word not in stop_filter]
+
+    # TokenIndex 的做法：每个不同的词判断一次，再按编号取掩码
+    word_ids = {}
+    ids = np.fromiter(
+        (word_ids.setdefault(word, len(word_ids)) for word in tokens), dtype=np.int32
+    )
+    token_vocab = list(word_ids)
+
+    def by_vocab_mask():
+        mask = stop_filter.mask(token_vocab)
+        return ids[~mask[ids]]
+
+    for name, func, number in [
+        ("list", by_list, 1),
+        ("frozenset", by_set, 5),
+        ("StopWordFilter", by_filter, 5),
+        ("vocab mask", by_vocab_mask, 5),
+    ]:
+        seconds = timeit.timeit(func, number=number) / number
+        print(f"{name:>16}: {seconds * 1e9 / TOKENS:8.1f} ns/token")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+不启动界面的命令行入口，在项目根目录运行：
+
+    python -m cli --db-dir /path/to/decrypted/dbs count --top 20
+    python -m cli --db-dir /path/to/decrypted/dbs analyze --top 10
+    python -m cli --db-dir /path/to/decrypted/dbs export wxid_xxx -o wxid_xxx.csv
+
+不给 --db-dir 时通过 WeChatFerry 连接微信客户端。
+只有 analyze / export 才会导入 pandas、jieba，count 只查消息数统计
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import sys
+
+from api.wechat import WeChatAPI
+
+
+def connect(args) -> WeChatAPI:
+    wechat_api = WeChatAPI(tokenize_workers=args.workers)
+    wechat_api.use_message_store = not args.no_store
+    if args.db_dir:
+        init = lambda: wechat_api.init_sqlite(args.db_dir, my_id=args.my_id)
+    else:
+        init = wechat_api.init_wcf
+    # 和界面上的检测步骤一致，任何一步失败都直接退出
+    for step in [
+        init,
+        wechat_api.get_my_id,
+        wechat_api.get_friends_list,
+        wechat_api.get_db_files,
+        wechat_api.build_talker_stats,
+    ]:
+        err = step()
+        if err:
+            wechat_api.close_wcf()
+            sys.exit(err)
+    return wechat_api
+
+
+def get_name(wechat_api: WeChatAPI, wxid: str) -> str:
+    info = wechat_api.source.get_info_by_wxid(wxid)
+    return info["remark"] or info["name"] or wxid
+
+
+def count_command(wechat_api: WeChatAPI, args):
+    res = []
+    for item in wechat_api.get_talker_stats().top(args.top):
+        res.append(
+            {
+                "wxid": item.talker,
+                "name": get_name(wechat_api, item.talker),
+                "count": item.count,
+                "my_count": item.my_count,
+                "user_count": item.user_count,
+                "first_time": item.first_time,
+                "last_time": item.last_time,
+            }
+        )
+    if args.json:
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+        return
+    for i, item in enumerate(res):
+        print(f"{i + 1:>4} {item['count']:>8} {item['wxid']} {item['name']}")
+
+
+def analyze_command(wechat_api: WeChatAPI, args):
+    from api.batch import BatchAnalyzer
+
+    def progress(finished, total, wxid):
+        print(f"[{finished}/{total}] {wxid}", file=sys.stderr)
+
+    batch = BatchAnalyzer(
+        wechat_api,
+        workers=args.threads,
+        output_dir=args.output,
+        topic_capacity=args.topic_capacity,
+        session_gap=args.session_gap * 60 if args.session_gap else None,
+        topic_epsilon=args.topic_epsilon,
+        topic_max_bytes=args.topic_memory * 1024 * 1024 if args.topic_memory else None,
+    )
+    res = batch.run(args.wxids, top_n=args.top, progress=progress)
+    print(json.dumps(res, ensure_ascii=False, indent=2))
+
+
+def export_command(wechat_api: WeChatAPI, args):
+    # 分批写入，内存占用和聊天记录的条数无关
+    out = open(args.output, "w", encoding="utf-8-sig", newline="") if args.output else sys.stdout
+    try:
+        header = True
+        for batch in wechat_api.iter_chat_messages(args.wxid):
+            batch.to_frame().to_csv(out, header=header, index=False)
+            header = False
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="python -m cli", description="微信对话分析")
+    parser.add_argument("--db-dir", help="已解密的数据库目录，不给时连接微信客户端")
+    parser.add_argument("--my-id", help="自己的 wxid，读取数据库目录时使用")
+    parser.add_argument("--no-store", action="store_true", help="不使用本地缓存的聊天记录")
+    parser.add_argument("--workers", type=int, help="分词的进程数，默认按 CPU 核数")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出日志")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    count = commands.add_parser("count", help="按消息数排名的好友")
+    count.add_argument("--top", type=int, default=20)
+    count.add_argument("--json", action="store_true", help="输出 json")
+    count.set_defaults(func=count_command)
+
+    analyze = commands.add_parser("analyze", help="分析好友，每个好友保存一个 json 文件")
+    analyze.add_argument("wxids", nargs="*", help="不给时分析消息数前 --top 的好友")
+    analyze.add_argument("--top", type=int, default=10)
+    analyze.add_argument("--output", help="保存结果的目录，默认是 reports/时间")
+    analyze.add_argument("--topic-capacity", type=int, help="高频词统计最多保存的词数")
+    analyze.add_argument("--topic-epsilon", type=float, help="高频词次数相对总词数的误差上限，如 0.0001")
+    analyze.add_argument("--topic-memory", type=int, help="高频词统计的内存上限，单位 MB")
+    analyze.add_argument("--session-gap", type=int, help="相隔多少分钟算作两次聊天，默认30")
+    analyze.add_argument("--threads", type=int, default=4, help="同时分析的好友数")
+    analyze.set_defaults(func=analyze_command)
+
+    export = commands.add_parser("export", help="导出和一个好友的聊天记录为 csv")
+    export.add_argument("wxid")
+    export.add_argument("-o", "--output", help="csv 文件，默认输出到标准输出")
+    export.set_defaults(func=export_command)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+    wechat_api = connect(args)
+    try:
+        args.func(wechat_api, args)
+    finally:
+        wechat_api.close_wcf()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
@@ -1,9 +1,9 @@
+import multiprocessing
+
 import flet as ft
-from pathlib import Path
+from api.paths import MAIN_PATH
 from ui.home_page import HomePage
 
-MAIN_PATH = Path(__file__).parent.absolute()
-
 
 async def main(page: ft.Page):
     page.title = "微信聊天对话统计"
@@ -19,6 +19,8 @@ async def main(page: ft.Page):
 
 # Press the green button in the gutter to run the script.
 if __name__ == "__main__":
+    # 打包后多进程分词需要
+    multiprocessing.freeze_support()
     ft.app(target=main, assets_dir="assets")
 
 # See PyCharm help at https://www.jetbrains.com/help/pycharm/
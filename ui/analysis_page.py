@@ -1,11 +1,17 @@
 import asyncio
 import json
 import datetime as dt
+from typing import TYPE_CHECKING
+
 import flet as ft
-from typing import List
-from api.wechat import WeChatAPI, MessageData, Analyzer
+from api.analyzer import Analyzer
+from api.progress import AnalysisProgress
+from api.wechat import WeChatAPI, MessageCursor
 from ui.utils import async_partial, AD_NAME, AD_URL
 
+if TYPE_CHECKING:
+    from api.messages import MessageBatch
+
 
 class AnalysisPage(ft.Tab):
     def __init__(self, wechat_api, change_index_callback):
@@ -167,12 +173,14 @@ class AnalysisView(ft.Column):
         analyzer = Analyzer(self.wechat_api)
         user = json.loads(self.user_select.value)
         user_id = user["wxid"]
+        progress_ring = ft.ProgressRing()
+        progress_text = ft.Text("分析中...")
         self.page.show_dialog(
             ft.AlertDialog(
                 content=ft.Column(
                     [
-                        ft.ProgressRing(),
-                        ft.Text("分析中..."),
+                        progress_ring,
+                        progress_text,
                         ft.Text("仅支持文本消息，内容仅供参考"),
                         ft.Container(
                             ft.Markdown(
@@ -187,7 +195,6 @@ class AnalysisView(ft.Column):
                         ft.ElevatedButton(
                             "取消",
                             on_click=analyzer.stop_analysis,
-                            visible=False,
                         ),
                     ],
                     tight=True,
@@ -205,6 +212,25 @@ class AnalysisView(ft.Column):
                 ], tight=True))
             )
 
+        async def progress_callback(progress: AnalysisProgress):
+            if analyzer.progress is None or analyzer.progress.cancelled:
+                # 已经取消，对话框已经关闭
+                return
+            # 各阶段已经处理的消息数和估计的总数
+            rows, total = {
+                "同步消息": (progress.rows_synced, progress.total_rows),
+                "读取消息": (progress.rows_read, progress.total_rows),
+                "分词": (progress.rows_tokenized, progress.rows_read),
+            }.get(progress.stage, (None, None))
+            if rows is None:
+                progress_text.value = f"{progress.stage}..."
+                progress_ring.value = None
+            else:
+                progress_text.value = f"{progress.stage}：{rows}条"
+                progress_ring.value = min(rows / total, 1) if total else None
+            await progress_text.update_async()
+            await progress_ring.update_async()
+
         async def end_callback(views=None):
             if views:
                 # 成功才赋值
@@ -230,7 +256,12 @@ class AnalysisView(ft.Column):
             self.ai_username,
             self.ai_password,
         )
-        analyzer.start_analysis(user_id, end_callback, error_callback=error_callback)
+        analyzer.start_analysis(
+            user_id,
+            end_callback,
+            error_callback=error_callback,
+            progress_callback=progress_callback,
+        )
 
 
 class MessagesView(ft.Column):
@@ -238,7 +269,9 @@ class MessagesView(ft.Column):
         super().__init__()
         self.wechat_api: WeChatAPI = wechat_api
         self.user_id: str | None = None
-        self.page_offset: int = 0
+        # 当前页第一条和最后一条消息的位置
+        self.first_cursor: MessageCursor | None = None
+        self.last_cursor: MessageCursor | None = None
         self.page_limit: int = 100
         self.prev_page_btn = ft.IconButton(
             ft.icons.ARROW_BACK,
@@ -267,16 +300,24 @@ class MessagesView(ft.Column):
         self.wechat_api.user_id = user_id
         self.user_id = user_id
         await self.disable_page_btns()
-        messages = self.wechat_api.get_chat_messages(
-            user_id, offset=0, limit=self.page_limit
+        messages = self.wechat_api.get_chat_messages_after(
+            user_id, cursor=None, limit=self.page_limit
         )
         await self.put_messages(messages)
-        self.page_offset = len(messages)
+        self.update_cursors(messages)
         self.prev_page_btn.disabled = True
         self.next_page_btn.disabled = len(messages) != self.page_limit
         await self.prev_page_btn.update_async()
         await self.next_page_btn.update_async()
 
+    def update_cursors(self, messages: "MessageBatch"):
+        if messages:
+            self.first_cursor = MessageCursor.from_message(messages[0])
+            self.last_cursor = MessageCursor.from_message(messages[-1])
+        else:
+            self.first_cursor = None
+            self.last_cursor = None
+
     async def disable_page_btns(self):
         self.prev_page_btn.disabled = True
         await self.prev_page_btn.update_async()
@@ -288,26 +329,28 @@ class MessagesView(ft.Column):
         异步操作，用于获取前一页的消息并更新显示。
         """
         # 如果没有用户ID，则不执行任何操作
-        if not self.user_id:
+        if not self.user_id or not self.first_cursor:
             return
         # 禁用页面上的按钮
         await self.disable_page_btns()
-        # 更新页面偏移量，以显示前一页的内容
-        self.page_offset = max(
-            0, self.page_offset - self.page_limit - len(self.list.controls)
-        )
-        # 根据页面偏移量是否为0，禁用“上一页”按钮
-        self.prev_page_btn.disabled = self.page_offset == 0
-        # 从微信API获取聊天消息
-        messages = self.wechat_api.get_chat_messages(
-            self.user_id, offset=self.page_offset, limit=self.page_limit
+        # 从当前页第一条消息往前取一页
+        messages = self.wechat_api.get_chat_messages_before(
+            self.user_id, self.first_cursor, limit=self.page_limit
         )
+        if len(messages) < self.page_limit:
+            # 已经到头了，直接显示第一页
+            messages = self.wechat_api.get_chat_messages_after(
+                self.user_id, cursor=None, limit=self.page_limit
+            )
+            self.prev_page_btn.disabled = True
+        else:
+            self.prev_page_btn.disabled = False
         # 将获取到的消息显示在页面上
         await self.put_messages(messages)
-        # 更新页面偏移量，为加载下一页做准备
-        self.page_offset += len(messages)
-        # 根据获取到的消息数量是否等于页面限制数量，禁用“下一页”按钮
-        self.next_page_btn.disabled = len(messages) != self.page_limit
+        # 更新游标，为加载下一页做准备
+        self.update_cursors(messages)
+        # 往前翻页之后，后面一定还有消息
+        self.next_page_btn.disabled = False
         # 更新“上一页”和“下一页”按钮的状态
         await self.prev_page_btn.update_async()
         await self.next_page_btn.update_async()
@@ -317,27 +360,32 @@ class MessagesView(ft.Column):
         异步操作，用于获取并显示下一页的消息。
         """
         # 如果没有用户ID，则不执行任何操作
-        if not self.user_id:
+        if not self.user_id or not self.last_cursor:
             return
         # 禁用页面上的按钮
         await self.disable_page_btns()
-        # 从微信API获取聊天消息
-        messages = self.wechat_api.get_chat_messages(
-            self.user_id, offset=self.page_offset, limit=self.page_limit
+        # 从当前页最后一条消息往后取一页
+        messages = self.wechat_api.get_chat_messages_after(
+            self.user_id, cursor=self.last_cursor, limit=self.page_limit
         )
+        if not messages:
+            # 后面没有消息了，保留当前页
+            self.prev_page_btn.disabled = self.first_cursor is None
+            await self.prev_page_btn.update_async()
+            return
         # 将消息放入聊天窗口
         await self.put_messages(messages)
         # 启用上一页按钮
         self.prev_page_btn.disabled = False
-        # 更新页偏移量，为下一次请求做准备
-        self.page_offset += len(messages)
+        # 更新游标，为下一次请求做准备
+        self.update_cursors(messages)
         # 根据获取的消息数量，决定是否禁用下一页按钮
         self.next_page_btn.disabled = len(messages) != self.page_limit
         # 更新按钮状态
         await self.prev_page_btn.update_async()
         await self.next_page_btn.update_async()
 
-    async def put_messages(self, messages: List[MessageData]):
+    async def put_messages(self, messages: "MessageBatch"):
         self.list.controls = [
             ft.Container(
                 ft.Column(
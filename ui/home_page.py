@@ -10,6 +10,8 @@ class HomePage(ft.Tabs):
     def __init__(self):
         super().__init__()
         self.wechat_api = WeChatAPI()
+        # 界面中分析时在单独的进程中计算，界面不会卡顿
+        self.wechat_api.use_analysis_worker = True
         self.expand = 1
         self.selected_index = 0
         self.animation_duration = 300
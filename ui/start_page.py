@@ -171,6 +171,14 @@ class DetectView(ft.Column):
 
         # 4. 数据库文件
         res = self.wechat_api.get_db_files()
+        if res:
+            # 返回错误
+            await self.wechat_db_files_entity.update_status(DetectEntityStatus.error)
+            await self.wechat_db_files_entity.set_value(res)
+            await end()
+            return
+        # 统计所有好友的消息数，之后的分析都直接查表，每个db一次扫描，在线程中执行
+        res = await asyncio.to_thread(self.wechat_api.build_talker_stats)
         if res:
             # 返回错误
             await self.wechat_db_files_entity.update_status(DetectEntityStatus.error)
@@ -185,6 +193,9 @@ class DetectView(ft.Column):
 
         await end(succeed=True)
         self.wechat_api.clear_message_cache()
+        # 后台预先加载 pandas、jieba 词典和画图用的模块，并启动分析进程，分析进程中也会预热
+        self.wechat_api.warmup.start()
+        self.wechat_api.get_analysis_worker()
         self.page.show_dialog(
             ft.AlertDialog(
                 content=ft.Column(
@@ -19,9 +19,11 @@ def async_partial(f, *args):
     return f2
 
 
+CHINESE_PATTERN = re.compile(r"[\u4e00-\u9fa5]")  # 匹配中文字符的正则表达式
+
+
 def extract_chinese(text):
-    pattern = re.compile(r"[\u4e00-\u9fa5]")  # 匹配中文字符的正则表达式
-    chinese_chars = pattern.findall(text)  # 查找字符串中所有匹配的中文字符
+    chinese_chars = CHINESE_PATTERN.findall(text)  # 查找字符串中所有匹配的中文字符
     chinese_text = "".join(chinese_chars)  # 将匹配到的中文字符连接成字符串
     return chinese_text
 